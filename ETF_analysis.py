@@ -1,6 +1,5 @@
-import pandas as pd
-
-from get_stock_price_data import MyStock
+from etf_liquidity import liquidity_impact
+from panel_backtest import panel_backtest
 
 etf00940_constituent_stocks = {'2603': (9.2, '長榮'), '2303': (3.3, '聯電'), '5483': (3.2, '中美晶'),
                                '3005': (3.1, '神基'), '2404': (3.0, '漢唐'), '2385': (2.8, '群光'),
@@ -16,52 +15,46 @@ etf00939_constituent_stocks = {'2454': (6.21, '聯發科'), '3231': (5.85, '緯
 n_day = 5
 
 
-def get_etf_constituent_stocks_percentage(constituent_stocks, cost):
+def get_etf_constituent_stocks_percentage(constituent_stocks, cost, download=False):
+    """
+    :param download: 是否先下載成分股最近兩個月缺少的股價，預設只用DB內已有的資料
+    """
     print('ETF成分股購入金額，成交金額占比')
+    # 只讀每檔成分股最後n_day筆成交金額
+    res_df = liquidity_impact({'ETF': (constituent_stocks, cost)}, n_day=n_day, download=download)
     for stock_code, (weight, stock_name) in constituent_stocks.items():
         print(stock_code, weight)
-        my_stock = MyStock(stock_code)
-        stock_df = my_stock.to_df()
-        n_day_average_turnover = sum(stock_df.tail(n_day)['turnover']) / n_day
-        turnover_percentage = cost * weight / n_day_average_turnover
+        n_day_average_turnover = res_df.at[stock_code, 'avg_turnover']
+        turnover_percentage = res_df.at[stock_code, 'ETF']
         print(
             f"{stock_code}/{stock_name} 近{n_day}天平均成交金額: {n_day_average_turnover}, ETF購買金額於成交金額占比: {turnover_percentage:.2f}%")
 
 
 # get_etf_constituent_stocks_percentage(etf00939_constituent_stocks, 5 * 10 ** 10)
 # get_etf_constituent_stocks_percentage(etf00940_constituent_stocks, 1.7 * 10 ** 11)
+# 多檔ETF一起算，重複的成分股(例如2454、2385)只讀一次，total為各ETF購買金額加總後的占比
+# print(liquidity_impact({'00939': (etf00939_constituent_stocks, 5 * 10 ** 10),
+#                         '00940': (etf00940_constituent_stocks, 1.7 * 10 ** 11)}, n_day=n_day, download=True))
 
 # 上市日期前兩個月開始算1個月的漲幅
 # 939
 listing_date = '2024-02-01'
 # listing_date = '2024-03-01'
-res_list = []
-for stock_code, (weight, stock_name) in etf00939_constituent_stocks.items():
-    # stock_code, (weight, stock_name) = ('2454', (6.21, '聯發科'))
-    my_stock = MyStock(stock_code)
-    tmp_res = my_stock.cal_return(pd.to_datetime(listing_date), test_day_list=[30], silent=True, adjust_by_taiex=True,
-                                  n_daily_average=1)
-    tmp_res['stock_name'] = stock_name
-    res_list.append(tmp_res)
-
-res_df = pd.DataFrame(res_list)
-mean_return_939 = res_df['30'].mean()
-mean_return_939_adjust = res_df['30_adj'].mean()
+# 所有成分股一次回測，可以一次給多個上市日期
+res_df = panel_backtest(list(etf00939_constituent_stocks), listing_date, test_day_list=[30], adjust_by_taiex=True,
+                        n_daily_average=1)
+res_df['stock_name'] = res_df['sid'].map(lambda sid: etf00939_constituent_stocks[sid][1])
+mean_return_939 = res_df['metric'].mean()
+mean_return_939_adjust = res_df['adj_metric'].mean()
 print(f'ETF 939成分股2/1~3/1平均漲幅: {mean_return_939:.2f}%, 用大盤校正後: {mean_return_939_adjust:.2f}%')
 
 # 940
 listing_date = '2024-02-01'
 # listing_date = '2024-03-01'
-res_list = []
-for stock_code, (weight, stock_name) in etf00940_constituent_stocks.items():
-    # stock_code, (weight, stock_name) = ('2603', (9.2, '長榮'))
-    my_stock = MyStock(stock_code)
-    tmp_res = my_stock.cal_return(pd.to_datetime(listing_date), test_day_list=[30], silent=True, adjust_by_taiex=True,
-                                  n_daily_average=1)
-    tmp_res['stock_name'] = stock_name
-    res_list.append(tmp_res)
-res_df = pd.DataFrame(res_list)
-mean_return_940 = res_df['30'].mean()
-mean_return_940_adjust = res_df['30_adj'].mean()
+res_df = panel_backtest(list(etf00940_constituent_stocks), listing_date, test_day_list=[30], adjust_by_taiex=True,
+                        n_daily_average=1)
+res_df['stock_name'] = res_df['sid'].map(lambda sid: etf00940_constituent_stocks[sid][1])
+mean_return_940 = res_df['metric'].mean()
+mean_return_940_adjust = res_df['adj_metric'].mean()
 
 print(f'ETF 940成分股2/1~3/1平均漲幅: {mean_return_940:.2f}%, 用大盤校正後: {mean_return_940_adjust:.2f}%')
@@ -0,0 +1,155 @@
+"""
+多檔股票同時下載，用thread pool同時對twstock發出請求，並用全域的速率限制避免被證交所/櫃買中心封鎖。
+下載結果統一由呼叫端的thread(單一writer)寫入DB。
+
+使用方式
+from batch_downloader import download_stocks
+download_stocks(['2330', '2454', '2603'], 2020, 1, 2024, 6)
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import List, Callable, Tuple
+
+from coverage_map import load_coverages
+from get_stock_price_data import get_fetcher, save_stock_month_data, year_month
+
+
+class RateLimiter:
+    """
+    全域請求速率限制，所有thread共用，兩次請求之間至少間隔1 / requests_per_second秒
+    """
+
+    def __init__(self, requests_per_second: float = None):
+        """
+        :param requests_per_second: 每秒最多幾次請求，None代表不限制
+        """
+        self.interval = 0 if not requests_per_second else 1 / requests_per_second
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # 預約下一個可以發出請求的時間，在lock外面等待，不會卡住其他thread預約
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def plan_missing_months(sids: List[str], from_year: int, from_month: int, to_year: int, to_month: int):
+    """
+    找出需要線上抓取的(sid, 年, 月)，條件同MyStock.check_stock_data_in_db:
+    沒抓過、或是資料不完整且今天還沒抓過
+    """
+    month_list = []
+    ym_start = 12 * from_year + from_month - 1
+    ym_end = 12 * to_year + to_month
+    for ym in range(ym_start, ym_end):
+        year, month = divmod(ym, 12)
+        month_list.append((year, month + 1))
+    months = [year_month(year, month) for year, month in month_list]
+    # 所有股票的抓取狀態一次查詢
+    coverages = load_coverages(sids, months[0], months[-1]) if sids and months else {}
+    res = []
+    for sid in sids:
+        missing = set(coverages[sid].missing_months(months))
+        res.extend((sid, year, month) for (year, month), year_month_str in zip(month_list, months)
+                   if year_month_str in missing)
+    return res
+
+
+def fetch_with_retry(fetcher, sid: str, year: int, month: int, rate_limiter: RateLimiter, max_retries: int = 3,
+                     backoff: float = 2.0):
+    """
+    抓取單月資料，失敗時以指數退避(backoff * 2 ** n秒，加上隨機抖動)重試
+    twstock在所有重試都無法解析JSON(通常是被擋)時會回傳stat為空字串，也當作失敗
+    """
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        try:
+            res = fetcher.fetch(year, month, sid)
+            if res.get('stat') == '':
+                raise ConnectionError(f'股票代碼{sid} {year}/{month}抓取失敗，可能被限制請求')
+            return res['data']
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff * 2 ** attempt * (1 + random.random() / 2))
+
+
+def create_fetchers(fetcher_factory: Callable, sids: List[str]) -> Tuple[dict, dict]:
+    """
+    每檔股票各自建立fetcher，預設的fetcher_factory遇到twstock沒有列出的代碼(下市、改代號)會KeyError，
+    只讓該檔失敗，不影響其他股票
+    :return: ({sid: fetcher}, {sid: 錯誤訊息})
+    """
+    fetchers, errors = {}, {}
+    for sid in sids:
+        try:
+            fetchers[sid] = fetcher_factory(sid)
+        except Exception as e:
+            errors[sid] = repr(e)
+    return fetchers, errors
+
+
+def download_stocks(sids: List[str], from_year: int, from_month: int, to_year: int, to_month: int,
+                    max_workers: int = 4, requests_per_second: float = 0.6, max_retries: int = 3,
+                    backoff: float = 2.0, fetcher_factory: Callable = None, silent=False) -> dict:
+    """
+    多檔股票同時下載缺少的月份並寫入DB
+    :param sids: 股票代碼list
+    :param max_workers: 同時下載的thread數
+    :param requests_per_second: 全域每秒最多幾次請求(證交所約每5秒3次)，None代表不限制
+    :param max_retries: 失敗重試次數
+    :param backoff: 重試等待的基本秒數
+    :param fetcher_factory: 依sid產生fetcher的函式，預設使用set_fetcher_factory設定的來源(twstock)，
+        離線測試可換成FakeFetcher
+    :param silent: 是否不print進度
+    :return: {'months': 需抓取月份數, 'fetched': 成功月份數, 'rows': 寫入筆數, 'failed': [(sid, 月份, 錯誤)], 'seconds': 耗時}
+    """
+    start_time = time.perf_counter()
+    fetcher_factory = fetcher_factory or get_fetcher
+    fetchers, fetcher_errors = create_fetchers(fetcher_factory, sids)
+    rate_limiter = RateLimiter(requests_per_second)
+    today = datetime.today()
+    tasks = plan_missing_months(sids, from_year, from_month, to_year, to_month)
+    summary = {'months': len(tasks), 'fetched': 0, 'rows': 0, 'failed': []}
+    # 無法建立fetcher的股票，缺少的月份都記為失敗
+    for sid, year, month in tasks:
+        if sid in fetcher_errors:
+            summary['failed'].append((sid, year_month(year, month), fetcher_errors[sid]))
+    if not silent:
+        for sid, error in fetcher_errors.items():
+            print(f'股票代碼{sid}無法建立fetcher，錯誤訊息: {error}')
+    tasks = [task for task in tasks if task[0] in fetchers]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_with_retry, fetchers[sid], sid, year, month, rate_limiter, max_retries,
+                                   backoff): (sid, year, month) for sid, year, month in tasks}
+        # 單一writer: 只有這個thread寫DB
+        for future in as_completed(futures):
+            sid, year, month = futures[future]
+            year_month_str = year_month(year, month)
+            try:
+                data = future.result()
+            except Exception as e:
+                summary['failed'].append((sid, year_month_str, repr(e)))
+                if not silent:
+                    print(f'股票代碼{sid} {year_month_str}抓取失敗，錯誤訊息: {e}')
+                continue
+            is_this_month = year == today.year and month == today.month
+            save_stock_month_data(sid, year_month_str, data, is_full_data=not is_this_month)
+            summary['fetched'] += 1
+            summary['rows'] += len(data)
+
+    summary['seconds'] = time.perf_counter() - start_time
+    if not silent:
+        print(f"下載{len(sids)}檔股票，{summary['fetched']}/{summary['months']}個月份，{summary['rows']}筆，"
+              f"耗時{summary['seconds']:.2f}秒")
+    return summary
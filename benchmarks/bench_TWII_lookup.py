@@ -0,0 +1,62 @@
+"""
+比較get_TWII_data原本逐日往前查SQL的寫法與載入記憶體後二分搜尋的速度
+
+在專案根目錄執行: python -m benchmarks.bench_TWII_lookup
+使用暫存資料庫，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from benchmarks.bench_cal_return import fill_fake_TWII  # noqa: E402
+from create_downloaded_stock_price_db import conn  # noqa: E402
+from fake_sources import FakeFetcher  # noqa: E402
+from get_TWII_price import get_TWII_data, get_TWII_data_batch, get_TWII_close_batch, reset_TWII_index  # noqa: E402
+
+
+def legacy_get_TWII_data(date):
+    # 原本的寫法，每次查詢都確認更新日期，沒資料就往前一天再查一次
+    latest_updated_date = conn.execute("SELECT MAX(updated_date) FROM TWII_daily_price").fetchone()[0]
+    latest_updated_date = pd.to_datetime(latest_updated_date)
+    assert latest_updated_date.strftime('%Y-%m-%d') >= pd.Timestamp.now().strftime('%Y-%m-%d')
+    while 1:
+        res = conn.execute(f"SELECT * FROM TWII_daily_price WHERE date = '{date}'").fetchall()
+        if res:
+            break
+        date = pd.to_datetime(date)
+        date = date - pd.DateOffset(days=1)
+        date = date.strftime('%Y-%m-%d')
+    return res[0]
+
+
+if __name__ == '__main__':
+    fill_fake_TWII(FakeFetcher())
+    # 隨機1000天，包含週末
+    rng = np.random.default_rng(0)
+    dates = [(datetime(2010, 1, 1) + timedelta(days=int(i))).strftime('%Y-%m-%d')
+             for i in rng.integers(0, 365 * 15, 1000)]
+
+    start = time.perf_counter()
+    legacy = [legacy_get_TWII_data(date) for date in dates]
+    legacy_time = time.perf_counter() - start
+
+    reset_TWII_index()
+    start = time.perf_counter()
+    single = [get_TWII_data(date) for date in dates]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = get_TWII_data_batch(dates)
+    close = get_TWII_close_batch(dates)
+    batch_time = time.perf_counter() - start
+
+    assert legacy == single == batch
+    assert close.tolist() == [row[4] for row in legacy]
+    print(f'查詢{len(dates)}個日期: 原本{legacy_time:.3f}秒, 二分搜尋(含第一次載入){single_time:.4f}秒, '
+          f'批次{batch_time * 1000:.2f}毫秒')
@@ -0,0 +1,109 @@
+"""
+比較TWII每日更新原本的寫法(往前多抓10天、DELETE後to_sql整批寫入)與watermark增量upsert的
+下載筆數、寫入筆數與時間，更新時另一條連線持續讀取，確認讀取端不會看到資料變少，並確認兩種寫法結果相同
+
+在專案根目錄執行: python -m benchmarks.bench_TWII_update
+使用暫存資料庫與FakeTicker，不會連網
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+import pandas as pd  # noqa: E402
+
+from create_downloaded_stock_price_db import conn, create_TWII_table, db_file_name  # noqa: E402
+from fake_sources import FakeTicker  # noqa: E402
+from get_TWII_price import update_TWII_data  # noqa: E402
+
+TABLE_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits', 'previous_close',
+                 'change']
+UPDATE_DAYS = 20
+
+
+def legacy_update_TWII_data(ticker, start_date):
+    # 原本的寫法: 往前多抓10天算change，刪除DB內這段期間的資料後整批append
+    start_date = (pd.to_datetime(start_date) - pd.DateOffset(days=10)).strftime('%Y-%m-%d')
+    df = ticker.history(start=start_date, end=None)
+    df = df.reset_index(drop=False)
+    df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
+    df['previous_close'] = df['Close'].shift(1)
+    df['change'] = df['Close'] - df['previous_close']
+    df = df.dropna(subset=['change'])
+    conn.execute(f"DELETE FROM TWII_daily_price WHERE date >= '{min(df['Date'])}'")
+    df.columns = TABLE_COLUMNS
+    df.to_sql('TWII_daily_price', conn, if_exists='append', index=False)
+    conn.commit()
+    return len(df)
+
+
+class CountReader(threading.Thread):
+    """
+    另一條連線持續讀取TWII筆數，記錄是否曾經比之前少(讀到更新到一半的資料)
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop = threading.Event()
+        self.reads = 0
+        self.dropped = 0
+
+    def run(self):
+        reader = sqlite3.connect(db_file_name, timeout=30)
+        last_count = 0
+        while not self.stop.is_set():
+            count = reader.execute("SELECT COUNT(*) FROM TWII_daily_price").fetchone()[0]
+            self.reads += 1
+            if count < last_count:
+                self.dropped += 1
+            last_count = count
+        reader.close()
+
+
+def table_rows():
+    return conn.execute("SELECT date, close, previous_close, change FROM TWII_daily_price ORDER BY date").fetchall()
+
+
+def run(update, start_day):
+    """
+    由start_day開始每天更新一次，共UPDATE_DAYS天
+    :return: (下載筆數, 寫入筆數, 秒數, 讀取端讀到資料變少的次數)
+    """
+    ticker = FakeTicker(start_day)
+    conn.execute("DROP TABLE IF EXISTS TWII_daily_price")
+    create_TWII_table()
+    update_TWII_data(ticker=ticker)
+    ticker.row_count = 0
+    reader = CountReader()
+    reader.start()
+    written = 0
+    start = time.perf_counter()
+    for i in range(1, UPDATE_DAYS + 1):
+        ticker.end_date = start_day + timedelta(days=i)
+        written += update(ticker)
+    elapsed = time.perf_counter() - start
+    reader.stop.set()
+    reader.join()
+    return ticker.row_count, written, elapsed, reader.dropped
+
+
+def legacy_update(ticker):
+    latest_date = conn.execute("SELECT MAX(date) FROM TWII_daily_price").fetchone()[0]
+    return legacy_update_TWII_data(ticker, latest_date)
+
+
+if __name__ == '__main__':
+    start_day = date.today() - timedelta(days=UPDATE_DAYS)
+    legacy_res = run(legacy_update, start_day)
+    legacy_rows = table_rows()
+    new_res = run(lambda ticker: update_TWII_data(ticker=ticker), start_day)
+    assert table_rows() == legacy_rows
+    # 已經是最新的資料再更新一次，不會寫入
+    assert update_TWII_data(ticker=FakeTicker()) == 0
+    for name, (downloaded, written, elapsed, dropped) in (('DELETE + to_sql', legacy_res), ('增量upsert', new_res)):
+        print(f'{name:<16}: 更新{UPDATE_DAYS}天 下載{downloaded}筆 寫入{written}筆 {elapsed:.3f}秒, '
+              f'讀取端看到資料變少{dropped}次')
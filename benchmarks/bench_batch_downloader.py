@@ -0,0 +1,47 @@
+"""
+測量batch_downloader在不同thread數下的下載吞吐量(月份/秒)
+FakeFetcher模擬網路延遲與連線失敗，不會連網
+
+在專案根目錄執行: python -m benchmarks.bench_batch_downloader
+"""
+import os
+import tempfile
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from fake_sources import FakeFetcher  # noqa: E402
+
+SIDS = [str(1101 + i) for i in range(20)]
+
+if __name__ == '__main__':
+    latency = 0.02
+    for max_workers in (1, 2, 4, 8, 16):
+        reset_tables()
+        fetcher = FakeFetcher(latency=latency)
+        summary = download_stocks(SIDS, 2022, 1, 2022, 12, max_workers=max_workers, requests_per_second=None,
+                                  fetcher_factory=lambda sid: fetcher, silent=True)
+        assert summary['fetched'] == summary['months'] == len(SIDS) * 12
+        print(f"thread數{max_workers:>2}: {summary['months']}個月份, 耗時{summary['seconds']:.2f}秒, "
+              f"{summary['months'] / summary['seconds']:.0f}月份/秒 (每次請求延遲{latency}秒)")
+
+    # 速率限制: 每秒最多50次請求
+    reset_tables()
+    fetcher = FakeFetcher(latency=latency)
+    summary = download_stocks(SIDS[:5], 2022, 1, 2022, 12, max_workers=8, requests_per_second=50,
+                              fetcher_factory=lambda sid: fetcher, silent=True)
+    print(f"限制每秒50次: {summary['months']}個月份, 耗時{summary['seconds']:.2f}秒, "
+          f"{summary['months'] / summary['seconds']:.0f}月份/秒")
+
+    # 10%請求失敗，靠重試補回
+    reset_tables()
+    fetcher = FakeFetcher(latency=latency, fail_rate=0.1)
+    summary = download_stocks(SIDS, 2022, 1, 2022, 12, max_workers=8, requests_per_second=None, backoff=0.01,
+                              fetcher_factory=lambda sid: fetcher, silent=True)
+    print(f"10%請求失敗: 成功{summary['fetched']}/{summary['months']}個月份, 共請求{fetcher.fetch_count}次, "
+          f"失敗{len(summary['failed'])}個月份")
+
+    # 已經下載過的月份不會再抓
+    summary = download_stocks(SIDS, 2022, 1, 2022, 12, fetcher_factory=lambda sid: fetcher, silent=True)
+    assert summary['months'] == 0
@@ -0,0 +1,59 @@
+"""
+比較cal_beta向量化與原本逐期呼叫cal_return、cal_taiex_return的速度，並確認結果相同
+
+在專案根目錄執行: python -m benchmarks.bench_beta
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from benchmarks.bench_cal_return import legacy_cal_return, prepare_db  # noqa: E402
+from fake_sources import FakeFetcher  # noqa: E402
+
+
+def legacy_cal_periodic_returns(stock, start_date, end_date, interval=1):
+    # 原本cal_periodic_returns的算法
+    res = []
+    today = datetime.today()
+    while start_date < end_date and start_date + timedelta(days=interval) < today:
+        stock_return = legacy_cal_return(stock, start_date, n_daily_average=1, test_day_list=[interval])[str(interval)]
+        taiex_return = stock.cal_taiex_return(start_date, start_date + timedelta(days=interval))
+        res.append((stock_return, taiex_return))
+        start_date += timedelta(days=interval)
+    return res
+
+
+def legacy_cal_beta(stock, start_date, end_date, interval=1):
+    periodic_returns = legacy_cal_periodic_returns(stock, start_date, end_date, interval)
+    stock_returns = [tmp[0] for tmp in periodic_returns]
+    taiex_returns = [tmp[1] for tmp in periodic_returns]
+    return np.cov(stock_returns, taiex_returns)[0][1] / np.var(taiex_returns)
+
+
+if __name__ == '__main__':
+    stock = prepare_db(FakeFetcher(), '2330', 2015)
+    end_date = datetime.today()
+    start_date = end_date - timedelta(days=365 * 3)
+    for interval in (7, 1):
+        assert legacy_cal_periodic_returns(stock, start_date, end_date, interval) == \
+               stock.cal_periodic_returns(start_date, end_date, interval)
+        start = time.perf_counter()
+        legacy = legacy_cal_beta(stock, start_date, end_date, interval)
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        new = stock.cal_beta(start_date, end_date, interval)
+        new_time = time.perf_counter() - start
+        assert legacy == new, (legacy, new)
+        print(f'3年beta(間隔{interval}天): {new:.4f}, 原本{legacy_time:.3f}秒, 向量化{new_time * 1000:.1f}毫秒, '
+              f'快{legacy_time / new_time:.0f}倍')
+
+    start = time.perf_counter()
+    rolling = stock.cal_rolling_beta(start_date, end_date, interval=1, window=60)
+    print(f'3年每日滾動beta(60期): {(time.perf_counter() - start) * 1000:.1f}毫秒')
+    print(rolling.dropna().tail())
@@ -0,0 +1,87 @@
+"""
+比較股價寫入DB的速度(rows/sec)
+legacy: 原本每筆f-string INSERT後就commit
+month: 每個月一次executemany，header與股價同一個transaction
+bulk: 整段回補只commit一次
+
+在專案根目錄執行: python -m benchmarks.bench_bulk_insert
+會使用暫存資料夾的資料庫，不會動到config.py設定的正式資料庫
+"""
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from twstock.stock import DATATUPLE  # noqa: E402
+
+from create_downloaded_stock_price_db import (conn, create_stock_price_table, create_stock_header_table,  # noqa: E402
+                                              to_date_int)
+from get_stock_price_data import save_stock_month_data, year_month  # noqa: E402
+
+
+def make_month_data(year, month, base_price=100.0):
+    # 產生一個月(每月20個交易日)的假股價
+    res = []
+    for day in range(1, 21):
+        close = base_price + day * 0.5
+        res.append(DATATUPLE(datetime(year, month, day), 1000 * day, 100000 * day, close - 1, close + 1, close - 2,
+                             close, 0.5, 10 * day, ''))
+    return res
+
+
+def make_backfill(n_sid, n_year):
+    # {(sid, year_month_str): data}
+    res = {}
+    for i in range(n_sid):
+        sid = str(9000 + i)
+        for year in range(2020, 2020 + n_year):
+            for month in range(1, 13):
+                res[(sid, year_month(year, month))] = make_month_data(year, month, 50.0 + i)
+    return res
+
+
+def legacy_save(sid, year_month_str, fetch_data):
+    # 原本fetch_from_to的寫法(日期改為version 2的整數日期)
+    conn.execute(f"INSERT OR REPLACE INTO stock_header VALUES ('{sid}', '{year_month_str}', CURRENT_TIMESTAMP,1)")
+    conn.commit()
+    for data in fetch_data:
+        conn.execute(
+            f"INSERT OR REPLACE INTO stock_daily_price VALUES ('{sid}', "
+            f"{to_date_int(data.date)}, {data.capacity}, {data.turnover}, {data.close - data.change}, {data.open}, "
+            f"{data.high}, {data.low}, {data.close}, {data.change}, {data.transaction}, CURRENT_TIMESTAMP)")
+        conn.commit()
+
+
+def reset_tables():
+    conn.execute('DROP TABLE IF EXISTS stock_daily_price')
+    conn.execute('DROP TABLE IF EXISTS stock_header')
+    conn.execute('DROP TABLE IF EXISTS stock_indicator')
+    create_stock_price_table()
+    create_stock_header_table()
+
+
+def run(name, backfill, save_func, final_commit=False):
+    reset_tables()
+    n_rows = sum(len(data) for data in backfill.values())
+    start = time.perf_counter()
+    for (sid, year_month_str), data in backfill.items():
+        save_func(sid, year_month_str, data)
+    if final_commit:
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    db_rows = conn.execute('SELECT COUNT(*) FROM stock_daily_price').fetchone()[0]
+    assert db_rows == n_rows, f'{name}寫入筆數錯誤: {db_rows} != {n_rows}'
+    print(f'{name:>8}: {n_rows}筆, 耗時{elapsed:.3f}秒, {n_rows / elapsed:,.0f} rows/sec')
+    return n_rows / elapsed
+
+
+if __name__ == '__main__':
+    # 預設5檔股票回補2年
+    backfill = make_backfill(n_sid=5, n_year=2)
+    legacy = run('legacy', backfill, legacy_save)
+    month = run('month', backfill, lambda sid, ym, data: save_stock_month_data(sid, ym, data, True))
+    bulk = run('bulk', backfill, lambda sid, ym, data: save_stock_month_data(sid, ym, data, True, commit=False),
+               final_commit=True)
+    print(f'month比legacy快{month / legacy:.1f}倍, bulk比legacy快{bulk / legacy:.1f}倍')
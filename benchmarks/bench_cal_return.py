@@ -0,0 +1,124 @@
+"""
+比較cal_return向量化引擎與原本逐一測試天數計算N日均價的速度，並確認結果完全相同
+
+在專案根目錄執行: python -m benchmarks.bench_cal_return
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from create_downloaded_stock_price_db import create_stock_price_table, create_stock_header_table  # noqa: E402
+from fake_sources import FakeFetcher, FakeTicker  # noqa: E402
+from get_TWII_price import get_TWII_data, set_TWII_ticker_factory, update_TWII_data  # noqa: E402
+from get_stock_price_data import MyStock  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+
+def legacy_average_price(stock, target_date, n_daily_average):
+    # 原本get_target_date_n_daily_average_price的算法，固定一份在這裡，不受之後指標表等改動影響
+    n_day_plus = 3
+    while n_day_plus < 60:
+        pre_month = target_date - timedelta(days=n_daily_average * n_day_plus)
+        stock.fetch_from_to(pre_month.year, pre_month.month, target_date.year, target_date.month)
+        stock.data = [tmp_data for tmp_data in stock.data if tmp_data.date <= target_date]
+        if stock.data:
+            break
+        n_day_plus += 3
+    else:
+        raise ValueError(f'股票代碼{stock.sid}在{target_date}之前{60}天內無法抓取資料')
+    return stock.moving_average(stock.price, n_daily_average)[-1], stock.data[-1].date
+
+
+def legacy_cal_return(stock, start_cal_return_date, n_daily_average=5, test_day_list=(10, 30, 60, 120, 180, 360),
+                      evaluation_metric='ROI', adjust_by_taiex=False):
+    # 原本cal_return的算法(不print)
+    start_stock_price, real_start_cal_return_date = legacy_average_price(stock, start_cal_return_date,
+                                                                         n_daily_average)
+    result_dict = {}
+    for i in test_day_list:
+        test_date = start_cal_return_date + timedelta(days=i)
+        if test_date > datetime.today():
+            result_dict[str(i)] = None
+            if adjust_by_taiex:
+                result_dict[str(i) + '_adj'] = None
+            continue
+        test_stock_price, real_end_cal_return_date = legacy_average_price(stock, test_date, n_daily_average)
+        day_range = (real_end_cal_return_date - real_start_cal_return_date).days
+        if evaluation_metric == 'IRR':
+            metric = round(((test_stock_price / start_stock_price) ** (365 / day_range) - 1) * 100, 2)
+        else:
+            metric = round(((test_stock_price / start_stock_price) - 1) * 100, 2)
+        result_dict[str(i)] = metric
+        if adjust_by_taiex:
+            taiex_start_price = get_TWII_data(real_start_cal_return_date.strftime('%Y-%m-%d'))[4]
+            taiex_end_price = get_TWII_data(real_end_cal_return_date.strftime('%Y-%m-%d'))[4]
+            if evaluation_metric == 'IRR':
+                taiex_metric = round(((taiex_end_price / taiex_start_price) ** (365 / day_range) - 1) * 100, 2)
+            else:
+                taiex_metric = round(((taiex_end_price / taiex_start_price) - 1) * 100, 2)
+            result_dict[str(i) + '_adj'] = round(metric - taiex_metric, 2)
+    return result_dict
+
+
+def fill_fake_TWII(fetcher):
+    # 用假股價當作大盤，之後get_TWII_data每日的更新檢查也使用同一組假資料，不會連網
+    set_TWII_ticker_factory(lambda: FakeTicker(fetcher.end_date))
+    update_TWII_data()
+
+
+def prepare_db(fetcher, sid, from_year):
+    create_stock_price_table()
+    create_stock_header_table()
+    fill_fake_TWII(fetcher)
+    stock = MyStock(sid, initial_fetch=False, silent=True)
+    stock.fetcher = fetcher
+    today = datetime.today()
+    stock.fetch_from_to(from_year, 1, today.year, today.month, bulk_load=True)
+    return stock
+
+
+def timeit(func, warm, repeat=3):
+    """
+    :param warm: True為快取已有資料，False為每次都清空快取(從DB讀取)
+    """
+    best = None
+    res = func()
+    for _ in range(repeat):
+        if not warm:
+            price_cache.clear()
+        start = time.perf_counter()
+        res = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+if __name__ == '__main__':
+    stock = prepare_db(FakeFetcher(), '2330', 2015)
+    start_date = datetime(2018, 3, 5)
+    # 確認結果完全相同
+    for n_daily_average in (1, 5, 20, 60):
+        for evaluation_metric in ('ROI', 'IRR'):
+            kwargs = dict(n_daily_average=n_daily_average, test_day_list=[10, 30, 60, 120, 180, 360, 720],
+                          evaluation_metric=evaluation_metric, adjust_by_taiex=True)
+            legacy = legacy_cal_return(stock, start_date, **kwargs)
+            new = stock.cal_return(start_date, silent=True, **kwargs)
+            assert legacy == new, (kwargs, legacy, new)
+    print('結果與原本算法相同')
+
+    for warm in (False, True):
+        print('快取有資料(warm)' if warm else '每次清空快取(cold)')
+        for n_daily_average in (5, 60):
+            for n_horizon in (6, 60, 300):
+                test_day_list = [int(i * 2000 / n_horizon) + 1 for i in range(n_horizon)]
+                legacy_time, legacy = timeit(
+                    lambda: legacy_cal_return(stock, start_date, n_daily_average, test_day_list), warm, repeat=1)
+                new_time, new = timeit(
+                    lambda: stock.cal_return(start_date, n_daily_average, test_day_list, silent=True), warm)
+                assert legacy == new
+                print(f'    {n_daily_average:>2}日均價, 測試天數{n_horizon:>3}個: 原本{legacy_time:.3f}秒, '
+                      f'向量化{new_time:.4f}秒, 快{legacy_time / new_time:.1f}倍')
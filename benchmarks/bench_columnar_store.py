@@ -0,0 +1,74 @@
+"""
+比較讀取長期歷史股價: MyStock.fetch_from_to(SQLite逐月讀取+轉換) 與 columnar_store的memory-map讀取，
+以及只有最新月份變動時的增量同步速度
+
+在專案根目錄執行: python -m benchmarks.bench_columnar_store
+使用暫存資料庫、暫存npy資料夾與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+os.environ['TW_STOCK_NPY_PATH'] = tempfile.mkdtemp() + '/'
+
+import numpy as np  # noqa: E402
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from columnar_store import sync_columnar_store, load_columnar, load_columnar_df  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock, save_stock_month_data, year_month  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+FROM_YEAR = 2005
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(20)
+    today = datetime.today()
+    reset_tables()
+    download_stocks(sids, FROM_YEAR, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+
+    start = time.perf_counter()
+    sync_columnar_store(sids, silent=True)
+    print(f'首次同步{len(sids)}檔: {time.perf_counter() - start:.2f}秒')
+
+    # SQLite + MyStock讀取全部歷史收盤價
+    price_cache.clear()
+    start = time.perf_counter()
+    sqlite_close = {}
+    for sid in sids:
+        stock = MyStock(sid, initial_fetch=False, silent=True)
+        stock.fetcher = fetcher
+        stock.fetch_from_to(FROM_YEAR, 1, today.year, today.month)
+        sqlite_close[sid] = np.array([np.nan if d.close is None else d.close for d in stock.data])
+    sqlite_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columnar_close = {sid: load_columnar(sid, ['close'])['close'] for sid in sids}
+    # 實際掃過資料，避免只量到memory-map的開檔時間
+    total = sum(float(np.nansum(close)) for close in columnar_close.values())
+    mmap_time = time.perf_counter() - start
+
+    n_rows = 0
+    for sid in sids:
+        np.testing.assert_array_equal(sqlite_close[sid], columnar_close[sid])
+        n_rows += len(columnar_close[sid])
+    print(f'{len(sids)}檔共{n_rows}筆收盤價: MyStock.fetch_from_to {sqlite_time:.2f}秒, '
+          f'memory-map {mmap_time * 1000:.1f}毫秒, 快{sqlite_time / mmap_time:.0f}倍 (總和{total:.0f})')
+
+    # 模擬每日更新: 只有本月資料變動
+    time.sleep(1)  # updated_date精度到秒
+    this_month = year_month(today.year, today.month)
+    for sid in sids:
+        save_stock_month_data(sid, this_month, fetcher.fetch(today.year, today.month, sid)['data'],
+                              is_full_data=False)
+    start = time.perf_counter()
+    synced = sync_columnar_store(sids, silent=True)
+    print(f'增量同步(只有本月變動) {len(sids)}檔: {time.perf_counter() - start:.3f}秒, 讀取{sum(synced.values())}筆')
+    assert sync_columnar_store(sids, silent=True) == {sid: 0 for sid in sids}
+    np.testing.assert_array_equal(load_columnar(sids[0], ['close'])['close'], columnar_close[sids[0]])
+    print(load_columnar_df(sids[0]).tail())
@@ -0,0 +1,118 @@
+"""
+下載股價(寫入)的同時另一個thread持續讀取，比較原本的rollback journal與WAL模式下讀取的延遲與次數，
+並比較多個thread各自寫入與透過單一writer佇列寫入的速度
+
+在專案根目錄執行: python -m benchmarks.bench_concurrent_rw
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+import numpy as np  # noqa: E402
+
+import create_downloaded_stock_price_db as db  # noqa: E402
+from batch_downloader import download_stocks  # noqa: E402
+from connection_manager import ConnectionManager, DEFAULT_PRAGMAS  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import save_stock_month_data, year_month  # noqa: E402
+from price_series import PriceSeries  # noqa: E402
+
+# 原本的設定: rollback journal，遇到lock等待(sqlite3預設5秒)
+LEGACY_PRAGMAS = {'journal_mode': 'DELETE', 'busy_timeout': 5000}
+READ_SIDS = fake_universe(10)
+DOWNLOAD_SIDS = fake_universe(60)[10:]
+
+
+def use_database(name, pragmas):
+    # 換成新的資料庫檔案與連線設定
+    db._manager = ConnectionManager(db.db_path + name, pragmas)
+    db.init_db()
+
+
+def read_loop(stop, latencies):
+    # 持續讀取已下載的股價，直到下載結束
+    while not stop.is_set():
+        for sid in READ_SIDS:
+            start = time.perf_counter()
+            PriceSeries.load(sid)
+            latencies.append(time.perf_counter() - start)
+    db.get_manager().close_thread_connections()
+
+
+def download_while_reading(name, pragmas):
+    use_database(f'{name}.db', pragmas)
+    fetcher = FakeFetcher(latency=0.001)
+    today = datetime.today()
+    download_stocks(READ_SIDS, 2015, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    stop = threading.Event()
+    latencies = []
+    reader = threading.Thread(target=read_loop, args=(stop, latencies))
+    reader.start()
+    start = time.perf_counter()
+    summary = download_stocks(DOWNLOAD_SIDS, 2015, 1, today.year, today.month, max_workers=8,
+                              requests_per_second=None, fetcher_factory=lambda sid: fetcher, silent=True)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    reader.join()
+    latencies = np.array(latencies) * 1000
+    print(f'{name:<10}: 下載{summary["fetched"]}個月份 {elapsed:.2f}秒, 同時讀取{len(latencies)}次, '
+          f'讀取延遲p50 {np.percentile(latencies, 50):.2f}毫秒 p99 {np.percentile(latencies, 99):.2f}毫秒 '
+          f'最大{latencies.max():.1f}毫秒')
+
+
+def month_tasks(fetcher, sids):
+    return [(sid, year_month(year, month), fetcher.fetch(year, month, sid)['data'])
+            for sid in sids for year in range(2016, 2020) for month in range(1, 13)]
+
+
+def write_per_thread(tasks, n_thread):
+    # 每個thread用自己的連線寫入，寫入時互相等待lock
+    def run(sub_tasks):
+        for sid, year_month_str, data in sub_tasks:
+            save_stock_month_data(sid, year_month_str, data, is_full_data=True)
+        db.get_manager().close_thread_connections()
+
+    threads = [threading.Thread(target=run, args=(tasks[i::n_thread],)) for i in range(n_thread)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def write_with_queue(tasks, n_thread):
+    # 每個thread把寫入排進writer佇列
+    writer = db.get_manager().writer()
+
+    def run(sub_tasks):
+        for sid, year_month_str, data in sub_tasks:
+            writer.submit(save_stock_month_data, sid, year_month_str, data, True)
+
+    threads = [threading.Thread(target=run, args=(tasks[i::n_thread],)) for i in range(n_thread)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.flush()
+
+
+if __name__ == '__main__':
+    download_while_reading('rollback', LEGACY_PRAGMAS)
+    download_while_reading('WAL', DEFAULT_PRAGMAS)
+
+    fetcher = FakeFetcher()
+    tasks = month_tasks(fetcher, fake_universe(20))
+    for name, func in (('各thread寫入', write_per_thread), ('writer佇列', write_with_queue)):
+        use_database(f'{name}.db', DEFAULT_PRAGMAS)
+        start = time.perf_counter()
+        func(tasks, 8)
+        elapsed = time.perf_counter() - start
+        count = db.get_conn().execute("SELECT COUNT(*) FROM stock_header").fetchone()[0]
+        assert count == len(tasks), count
+        print(f'{name}: 8個thread寫入{len(tasks)}個月份 {elapsed:.2f}秒')
+    db.get_manager().close()
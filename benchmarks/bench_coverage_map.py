@@ -0,0 +1,93 @@
+"""
+比較fetch_from_to原本每個月查兩次DB(check_stock_data_in_db + SELECT)與CoverageMap一次查詢、範圍讀回的
+SQL次數與速度，並確認讀到的資料相同，也測試中間缺少的月份只會抓缺少的部分
+
+在專案根目錄執行: python -m benchmarks.bench_coverage_map
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from create_downloaded_stock_price_db import conn  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import (MyStock, PRICE_SELECT_COLUMNS, month_date_range, save_stock_month_data,  # noqa: E402
+                                  year_month)
+from price_cache import price_cache  # noqa: E402
+
+FROM_YEAR = 2015
+
+
+def legacy_fetch_from_to(stock, from_year, from_month, to_year, to_month):
+    # 原本的寫法: 每個月各查一次header與股價
+    today = datetime.today()
+    stock.data = []
+    for year, month in stock._month_year_iter(from_month, from_year, to_month, to_year):
+        is_this_month = year == today.year and month == today.month
+        year_month_str = year_month(year, month)
+        if not stock.check_stock_data_in_db(year_month_str):
+            save_stock_month_data(stock.sid, year_month_str, stock.fetcher.fetch(year, month, stock.sid)['data'],
+                                  is_full_data=not is_this_month)
+        res = conn.execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price WHERE sid = ? AND date BETWEEN ? AND ?",
+                           (stock.sid, *month_date_range(year_month_str)))
+        stock.data.extend(stock.to_datatuple(data) for data in res.fetchall())
+    return stock.data
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+    def __enter__(self):
+        conn.set_trace_callback(self)
+        return self
+
+    def __exit__(self, *exc):
+        conn.set_trace_callback(None)
+
+
+def run(func, sids, fetcher, today):
+    price_cache.clear()
+    fetch_count = fetcher.fetch_count
+    with QueryCounter() as counter:
+        start = time.perf_counter()
+        res = {}
+        for sid in sids:
+            stock = MyStock(sid, initial_fetch=False, silent=True, fetcher=fetcher)
+            res[sid] = list(func(stock, FROM_YEAR, 1, today.year, today.month))
+        elapsed = time.perf_counter() - start
+    return res, elapsed, counter.count, fetcher.fetch_count - fetch_count
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(10)
+    today = datetime.today()
+    reset_tables()
+    download_stocks(sids, FROM_YEAR, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    n_month = (today.year - FROM_YEAR) * 12 + today.month
+
+    legacy, legacy_time, legacy_queries, _ = run(legacy_fetch_from_to, sids, fetcher, today)
+    new, new_time, new_queries, _ = run(MyStock.fetch_from_to, sids, fetcher, today)
+    assert legacy == new
+    print(f'{len(sids)}檔 x {n_month}個月: 原本{legacy_queries}次SQL {legacy_time:.3f}秒, '
+          f'CoverageMap {new_queries}次SQL {new_time:.3f}秒, 快{legacy_time / new_time:.1f}倍')
+
+    # 刪掉中間兩段月份，只會抓這些月份
+    gaps = ['201703', '201704', '202006']
+    conn.executemany("DELETE FROM stock_header WHERE sid = ? AND month = ?",
+                     [(sid, month) for sid in sids for month in gaps])
+    conn.commit()
+    gap_res, gap_time, gap_queries, gap_fetch = run(MyStock.fetch_from_to, sids, fetcher, today)
+    assert gap_fetch == len(sids) * len(gaps), gap_fetch
+    assert gap_res == new
+    print(f'缺少{len(gaps)}個月份: 線上抓取{gap_fetch}次, {gap_queries}次SQL(含寫入每筆INSERT), {gap_time:.3f}秒')
@@ -0,0 +1,87 @@
+"""
+每日更新的中斷與接續: 100檔股票的當月資料是昨天抓的(不完整)，第一次執行到一半被限制請求而停止，
+重新執行只做剩下的工作，結果與沒有中斷時相同，並印出各階段的筆數與耗時
+
+在專案根目錄執行: python -m benchmarks.bench_daily_update
+使用暫存資料庫、FakeFetcher與FakeTicker，不會連網
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from create_downloaded_stock_price_db import init_db, get_conn  # noqa: E402
+from daily_update import run_daily_update, print_summary  # noqa: E402
+from fake_sources import FakeFetcher, FakeTicker, fake_universe  # noqa: E402
+
+N_SID = 100
+# 第幾次請求之後被限制
+LIMIT_AFTER = 60
+
+
+class LimitedFetcher(FakeFetcher):
+    """
+    請求次數超過limit之後，同twstock被擋時回傳stat為空字串
+    """
+
+    def __init__(self, end_date, limit: int):
+        super().__init__(end_date)
+        self.limit = limit
+
+    def fetch(self, year: int, month: int, sid: str, retry: int = 5):
+        with self._lock:
+            blocked = self.fetch_count >= self.limit
+        if blocked:
+            with self._lock:
+                self.fetch_count += 1
+            return {'stat': '', 'data': []}
+        return super().fetch(year, month, sid, retry)
+
+
+def snapshot(sids):
+    return get_conn().execute(
+        f"SELECT sid, date, close, turnover FROM stock_daily_price WHERE sid IN ({', '.join('?' * len(sids))}) "
+        f"AND date >= ? ORDER BY sid, date", (*sids, int(datetime.today().strftime('%Y%m01')))).fetchall()
+
+
+if __name__ == '__main__':
+    today = datetime.today()
+    sids = fake_universe(N_SID)
+    # 昨天之前的資料
+    yesterday = FakeFetcher(today.date() - timedelta(days=1))
+    init_db()
+    download_stocks(sids, today.year - 1, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: yesterday, silent=True)
+    conn = get_conn()
+    conn.execute("UPDATE stock_header SET updated_date = datetime('now', '-1 day') WHERE is_full_data = 0")
+    conn.commit()
+
+    fetcher = LimitedFetcher(today.date(), LIMIT_AFTER)
+    ticker = FakeTicker(today.date())
+    options = dict(requests_per_second=None, max_retries=0, backoff=0, max_workers=1, ticker=ticker)
+    print('第一次執行(被限制請求):')
+    first = run_daily_update(fetcher_factory=lambda sid: fetcher, max_failures=5, silent=True, **options)
+    print_summary(first)
+    assert first['stopped'] and first['done'] > 1 and first['pending'] > 0
+
+    fetcher.limit = float('inf')
+    fetcher.fetch_count = 0
+    print('\n重新執行(接續):')
+    second = run_daily_update(fetcher_factory=lambda sid: fetcher, silent=True, **options)
+    print_summary(second)
+    assert second['resumed'] and second['done'] == second['tasks']
+    # 只抓第一次沒完成的月份
+    assert fetcher.fetch_count == first['tasks'] - first['done'], fetcher.fetch_count
+    resumed = snapshot(sids)
+
+    # 與沒有中斷、一次完成的結果相同
+    print('\n重新規劃、一次完成:')
+    conn.execute("UPDATE stock_header SET updated_date = datetime('now', '-1 day') WHERE is_full_data = 0")
+    conn.commit()
+    third = run_daily_update(fetcher_factory=lambda sid: FakeFetcher(today.date()), restart=True, silent=True,
+                             **options)
+    print_summary(third)
+    assert snapshot(sids) == resumed
+    print('\n接續完成的結果與一次完成相同')
@@ -0,0 +1,63 @@
+"""
+比較原本逐檔建立MyStock、to_df()後取最後N天成交金額，與liquidity_impact多檔ETF一次查詢的速度，並確認占比相同
+
+在專案根目錄執行: python -m benchmarks.bench_etf_liquidity
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import math
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from create_downloaded_stock_price_db import init_db  # noqa: E402
+from etf_liquidity import liquidity_impact  # noqa: E402
+from fake_sources import FakeFetcher  # noqa: E402
+from get_stock_price_data import MyStock  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+N_DAY = 5
+# 同ETF_analysis的成分股
+ETFS = {
+    '00940': ({'2603': (9.2, '長榮'), '2303': (3.3, '聯電'), '5483': (3.2, '中美晶'), '3005': (3.1, '神基'),
+               '2404': (3.0, '漢唐'), '2385': (2.8, '群光'), '6176': (2.7, '瑞儀'), '2454': (2.6, '聯發科'),
+               '3293': (2.5, '鈊象'), '6121': (2.5, '新普')}, 1.7 * 10 ** 11),
+    '00939': ({'2454': (6.21, '聯發科'), '3231': (5.85, '緯創'), '3702': (5.33, '大聯大'), '3034': (5.07, '聯詠'),
+               '3711': (5.07, '日月光投控'), '2385': (5.06, '群光'), '6669': (4.84, '緯穎'), '3037': (3.93, '欣興'),
+               '2379': (3.75, '瑞昱'), '2603': (3.66, '長榮')}, 5 * 10 ** 10),
+}
+
+
+def original(fetcher):
+    # 原本get_etf_constituent_stocks_percentage的算法，每檔ETF分開算
+    res = {}
+    for etf, (constituent_stocks, cost) in ETFS.items():
+        for stock_code, (weight, _) in constituent_stocks.items():
+            stock_df = MyStock(stock_code, silent=True, fetcher=fetcher).to_df()
+            n_day_average_turnover = sum(stock_df.tail(N_DAY)['turnover']) / N_DAY
+            res[(etf, stock_code)] = cost * weight / n_day_average_turnover
+    return res
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    today = datetime.today()
+    init_db()
+    sids = sorted({sid for constituent_stocks, _ in ETFS.values() for sid in constituent_stocks})
+    download_stocks(sids, 2010, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+
+    price_cache.clear()
+    start = time.perf_counter()
+    expected = original(fetcher)
+    original_time = time.perf_counter() - start
+    start = time.perf_counter()
+    res = liquidity_impact(ETFS, n_day=N_DAY)
+    impact_time = time.perf_counter() - start
+    for (etf, sid), percentage in expected.items():
+        assert math.isclose(res.at[sid, etf], percentage, rel_tol=1e-12), (etf, sid)
+    print(f'{len(ETFS)}檔ETF {len(expected)}個成分股(不重複{len(sids)}檔): 原本{original_time:.3f}秒, '
+          f'一次查詢{impact_time * 1000:.1f}毫秒, 快{original_time / impact_time:.0f}倍，占比相同')
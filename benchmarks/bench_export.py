@@ -0,0 +1,134 @@
+"""
+匯出股價的記憶體峰值: 逐chunk匯出CSV、gzip CSV與XLSX，與逐檔to_df()合併後用pandas寫檔比較，
+並確認股票數增加4倍時逐chunk匯出的記憶體峰值不變、內容與資料庫相同。
+每種方式在獨立的process執行，記憶體峰值為該process的最大RSS減去開始匯出前的RSS(Linux)。
+
+在專案根目錄執行: python -m benchmarks.bench_export
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import csv
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# 子process沿用父process的暫存資料庫
+os.environ.setdefault('TW_STOCK_DB_PATH', tempfile.mkdtemp() + '/')
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_isin_stream import memory_status  # noqa: E402
+from create_downloaded_stock_price_db import init_db, get_conn  # noqa: E402
+from export_data import export_table, export_backtest, STOCK_PRICE_COLUMNS, STOCK_PRICE_SELECT_COLUMNS, \
+    date_int_to_str  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+
+N_SID = 200
+FROM_YEAR = 2012
+# XLSX較慢，只匯出前面幾檔
+N_XLSX_SID = 30
+
+
+def pandas_export(sids, path):
+    # 沒有匯出功能時的做法: 逐檔to_df()後合併成一個DataFrame再寫檔
+    import pandas as pd
+    from get_stock_price_data import MyStock
+    fetcher = FakeFetcher()
+    today = datetime.today()
+    dfs = []
+    for sid in sids:
+        stock = MyStock(sid, initial_fetch=False, silent=True, db_first=True, fetcher=fetcher)
+        stock.fetch_from_to(FROM_YEAR, 1, today.year, today.month)
+        dfs.append(stock.to_df())
+    pd.concat(dfs).to_csv(path, index=False)
+
+
+def run(mode, sids, path):
+    if mode == 'pandas':
+        pandas_export(sids, path)
+    else:
+        export_table('stock_daily_price', 'xlsx' if mode == 'xlsx' else 'csv', path, sids,
+                     compress=mode == 'gzip')
+
+
+def run_child(mode, sids, path):
+    # 在獨立的process執行，回傳(秒數, 記憶體峰值bytes)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_export', mode, path, *sids],
+                            check=True, capture_output=True, text=True).stdout
+    res = json.loads(output.splitlines()[-1])
+    return res['seconds'], res['peak']
+
+
+def normalize(value):
+    # XLSX的小數最多15位有效數字，整數值的小數讀回來會是int，數字一律比較四捨五入後的float
+    if value is None or value == '':
+        return ''
+    try:
+        return str(round(float(value), 9))
+    except ValueError:
+        return str(value)
+
+
+def expected_rows(sids):
+    rows = get_conn().execute(
+        f"SELECT {STOCK_PRICE_SELECT_COLUMNS} FROM stock_daily_price WHERE sid IN ({', '.join('?' * len(sids))}) "
+        f"ORDER BY sid, date", sids).fetchall()
+    return [[str(value) if value is not None else '' for value in (row[0], date_int_to_str(row[1]), *row[2:])]
+            for row in rows]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        mode, path, *child_sids = sys.argv[1:]
+        baseline = memory_status('VmRSS')
+        start = time.perf_counter()
+        run(mode, child_sids, path)
+        print(json.dumps({'seconds': time.perf_counter() - start, 'peak': memory_status('VmHWM') - baseline}))
+        sys.exit()
+
+    today = datetime.today()
+    sids = fake_universe(N_SID)
+    fetcher = FakeFetcher()
+    init_db()
+    download_stocks(sids, FROM_YEAR, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    directory = tempfile.mkdtemp()
+
+    def report(name, sub_sids, mode, path):
+        seconds, peak = run_child(mode, sub_sids, path)
+        print(f'{name}: {seconds:.2f}秒, 記憶體峰值{peak / 1024 ** 2:.1f}MB, 檔案{os.path.getsize(path) / 1024 ** 2:.1f}MB')
+        return peak
+
+    quarter = sids[:N_SID // 4]
+    n_quarter, n_all = len(expected_rows(quarter)), len(expected_rows(sids))
+    print(f'{len(quarter)}檔 {n_quarter}筆:')
+    small_peak = report('  逐chunk匯出CSV', quarter, 'csv', os.path.join(directory, 'quarter.csv'))
+    print(f'{N_SID}檔 {n_all}筆:')
+    pandas_peak = report('  to_df()合併後寫CSV', sids, 'pandas', os.path.join(directory, 'pandas.csv'))
+    csv_peak = report('  逐chunk匯出CSV', sids, 'csv', os.path.join(directory, 'all.csv'))
+    report('  逐chunk匯出gzip CSV', sids, 'gzip', os.path.join(directory, 'all.csv.gz'))
+    xlsx_sids = sids[:N_XLSX_SID]
+    print(f'{N_XLSX_SID}檔 {len(expected_rows(xlsx_sids))}筆:')
+    report('  逐chunk匯出XLSX', xlsx_sids, 'xlsx', os.path.join(directory, 'part.xlsx'))
+
+    # 內容與資料庫相同
+    expected = expected_rows(sids)
+    with open(os.path.join(directory, 'all.csv'), newline='', encoding='utf_8') as f:
+        assert list(csv.reader(f)) == [STOCK_PRICE_COLUMNS] + expected
+    with gzip.open(os.path.join(directory, 'all.csv.gz'), 'rt', newline='', encoding='utf_8') as f:
+        assert list(csv.reader(f)) == [STOCK_PRICE_COLUMNS] + expected
+    from openpyxl import load_workbook
+    sheet = load_workbook(os.path.join(directory, 'part.xlsx'), read_only=True)['stock_daily_price']
+    assert [[normalize(value) for value in row] for row in sheet.iter_rows(values_only=True)] \
+        == [STOCK_PRICE_COLUMNS] + [[normalize(value) for value in row] for row in expected_rows(xlsx_sids)]
+    print(f'內容與資料庫相同; 股票數4倍時逐chunk匯出的記憶體峰值為{csv_peak / small_peak:.2f}倍, '
+          f'to_df()合併的{pandas_peak / csv_peak:.0f}倍')
+
+    # 回測結果分批匯出
+    start = time.perf_counter()
+    n_rows = export_backtest(sids, ['2020-01-02', '2022-06-01'], path=os.path.join(directory, 'backtest.csv'),
+                             test_day_list=[30, 360], n_daily_average=1, download_missing=False)
+    print(f'回測{N_SID}檔匯出{n_rows}筆: {time.perf_counter() - start:.2f}秒')
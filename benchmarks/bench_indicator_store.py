@@ -0,0 +1,104 @@
+"""
+比較N日均價由指標表索引查詢與原本載入整段股價計算的速度，並確認結果完全相同;
+量測整段建立與股價新增後接續計算的時間，以及舊版逐筆trigger與每批一次作廢指標對股價寫入速度的影響
+
+在專案根目錄執行: python -m benchmarks.bench_indicator_store
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from benchmarks.bench_cal_return import fill_fake_TWII  # noqa: E402
+from create_downloaded_stock_price_db import conn  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock, save_stock_month_data, year_month  # noqa: E402
+from indicator_store import INDICATOR_COLUMNS, refresh_indicators  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+from return_engine import load_average_prices, load_indicator_prices  # noqa: E402
+
+FROM_YEAR = 2010
+
+
+def indicator_rows(sid):
+    return conn.execute(f"SELECT date, {', '.join(INDICATOR_COLUMNS)} FROM stock_indicator WHERE sid = ? "
+                        f"ORDER BY date", (sid,)).fetchall()
+
+
+def run(load_func, stocks, start_dates, test_day_list, n_daily_average):
+    price_cache.clear()
+    res = {}
+    start = time.perf_counter()
+    for stock in stocks:
+        for start_date in start_dates:
+            test_dates = [start_date + timedelta(days=day) for day in test_day_list]
+            res[(stock.sid, start_date)] = load_func(stock, start_date, test_dates, n_daily_average)
+    return res, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(20)
+    today = datetime.today()
+    reset_tables()
+    fill_fake_TWII(fetcher)
+    download_stocks(sids, FROM_YEAR, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+
+    start = time.perf_counter()
+    n_rows = sum(refresh_indicators(sid) for sid in sids)
+    print(f'{len(sids)}檔 {FROM_YEAR}年至今 整段建立指標: {n_rows}筆 {time.perf_counter() - start:.3f}秒')
+
+    # 重抓一個過去的月份(收盤價改變)，之後的指標作廢，接續計算結果要與整段重建相同
+    sid = sids[0]
+    data = fetcher.fetch(2020, 3, sid)['data']
+    save_stock_month_data(sid, year_month(2020, 3), [row._replace(close=row.close + 1) for row in data], True)
+    start = time.perf_counter()
+    n_rows = refresh_indicators(sid)
+    incremental_time = time.perf_counter() - start
+    incremental = indicator_rows(sid)
+    conn.execute("DELETE FROM stock_indicator WHERE sid = ?", (sid,))
+    conn.commit()
+    refresh_indicators(sid)
+    assert indicator_rows(sid) == incremental
+    save_stock_month_data(sid, year_month(2020, 3), data, True)
+    refresh_indicators(sid)
+    print(f'重抓2020/03後接續計算: {n_rows}筆 {incremental_time * 1000:.1f}毫秒，與整段重建相同')
+
+    # 新增當月資料，只計算新的幾天
+    this_month = fetcher.fetch(today.year, today.month, sid)['data']
+    save_stock_month_data(sid, year_month(today.year, today.month), this_month, False)
+    start = time.perf_counter()
+    n_rows = refresh_indicators(sid)
+    print(f'重抓當月後接續計算: {n_rows}筆 {(time.perf_counter() - start) * 1000:.2f}毫秒')
+
+    stocks = [MyStock(sid, initial_fetch=False, silent=True, fetcher=fetcher) for sid in sids]
+    start_dates = [datetime(2012, 1, 4) + timedelta(days=45 * i) for i in range(80)]
+    test_day_list = [10, 30, 60, 120, 180, 360]
+    for n_daily_average in (1, 5, 20, 60):
+        loaded, load_time = run(load_average_prices, stocks, start_dates, test_day_list, n_daily_average)
+        indexed, index_time = run(load_indicator_prices, stocks, start_dates, test_day_list, n_daily_average)
+        assert indexed == loaded
+        print(f'{n_daily_average:>3}日均價 {len(loaded)}次回測: 載入整段計算{load_time:.3f}秒, '
+              f'指標表查詢{index_time:.3f}秒, 快{load_time / index_time:.1f}倍')
+
+    # 作廢指標對寫入的影響: 舊版每筆股價觸發一次DELETE，現在每批(每月)一次
+    backfill = [(sid, year, month, fetcher.fetch(year, month, sid)['data'])
+                for sid in sids[:5] for year in range(2015, 2020) for month in range(1, 13)]
+    for name in ('舊版逐筆trigger', '每批作廢一次'):
+        reset_tables()
+        if name == '舊版逐筆trigger':
+            conn.execute("CREATE TRIGGER stock_indicator_invalidate AFTER INSERT ON stock_daily_price BEGIN "
+                         "DELETE FROM stock_indicator WHERE sid = NEW.sid AND date >= NEW.date; END")
+        start = time.perf_counter()
+        for sid, year, month, data in backfill:
+            save_stock_month_data(sid, year_month(year, month), data, True, commit=False)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        n_rows = sum(len(data) for *_, data in backfill)
+        print(f'{name}: 寫入{n_rows}筆 {n_rows / elapsed:,.0f} rows/sec')
@@ -0,0 +1,50 @@
+"""
+量測instrumentation關閉與開啟時對主要工作的影響，關閉時應與沒有量測點幾乎相同
+
+在專案根目錄執行: python -m benchmarks.bench_instrumentation
+使用暫存資料庫與假資料，不會連網
+"""
+import time
+
+import instrumentation
+from benchmarks.suite import WORKLOADS, clear_caches, prepare
+
+REPEAT = 5
+
+
+def best_time(func, ctx, cold):
+    best = None
+    for _ in range(REPEAT):
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        func(ctx)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    ctx = prepare(50, 3)
+    # 關閉時每個量測點的成本
+    n = 1_000_000
+    start = time.perf_counter()
+    for _ in range(n):
+        pass
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n):
+        with instrumentation.timer('noop') as t:
+            t.set_rows(())
+    print(f'關閉時每個量測點: {(time.perf_counter() - start - loop_time) / n * 1e9:.0f}奈秒')
+
+    for name in ('fetch_from_to', 'cal_return', 'cal_beta', 'get_TWII_data'):
+        for cold in (True, False):
+            disabled = best_time(WORKLOADS[name], ctx, cold)
+            instrumentation.enable()
+            enabled = best_time(WORKLOADS[name], ctx, cold)
+            instrumentation.disable()
+            calls = sum(res['calls'] for res in instrumentation.stats.snapshot().values())
+            instrumentation.stats.reset()
+            print(f'{name:<14}{"冷" if cold else "熱"}: 關閉{disabled * 1000:8.2f}毫秒, 開啟{enabled * 1000:8.2f}毫秒 '
+                  f'({enabled / disabled - 1:+.1%}, 量測{calls // REPEAT}次/每輪)')
@@ -0,0 +1,114 @@
+"""
+比較證券代號清單的兩種解析方式的時間與記憶體峰值:
+原本Selenium取得整頁原始碼後建立lxml樹解析，與直接讀取位元組邊解析邊寫CSV。
+網頁用twstock內附的上市證券CSV產生與ISIN網頁相同格式(MS950編碼)的HTML，存成本機檔案。
+Selenium的部分無法離線執行，只量測取得原始碼之後的解析，另外還有Chrome啟動與固定等待10秒。
+每種方式在獨立的process執行，記憶體峰值為該process的最大RSS減去開始解析前的RSS(Linux)。
+
+在專案根目錄執行: python -m benchmarks.bench_isin_stream
+使用暫存資料夾與本機產生的網頁，不會連網
+"""
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from html import escape
+from itertools import groupby
+
+import twstock
+
+import new_fetch
+
+TWSTOCK_CSV = os.path.join(os.path.dirname(twstock.__file__), 'codes', 'twse_equities.csv')
+
+
+def make_page(path):
+    # 依ISIN網頁的格式: 第一列為表頭，每個種類一列<B>種類<B>，之後為該種類的資料列
+    with open(TWSTOCK_CSV, encoding='utf_8') as f:
+        rows = list(csv.DictReader(f))
+    cell = '<td bgcolor=#FAFAD2>{}</td>'
+    lines = ['<html><head><meta http-equiv="Content-Type" content="text/html; charset=MS950"></head><body>',
+             "<table class='h4' align=center cellSpacing=3 cellPadding=2 width=750 border=0>",
+             '<tr align=center>' + ''.join(f'<td bgcolor=#D5FFD5>{title}</td>' for title in (
+                 '有價證券代號及名稱', '國際證券辨識號碼(ISIN Code)', '上市日', '市場別', '產業別', 'CFICode',
+                 '備註')) + '</tr>']
+    for typ, type_rows in groupby(rows, key=lambda row: row['type']):
+        lines.append(f'<tr><td bgcolor=#FAFAD2 colspan=7 ><B> {escape(typ)} <B> </td></tr>')
+        for row in type_rows:
+            values = [f"{row['code']}　{row['name']}", row['ISIN'], row['start'], row['market'], row['group'],
+                      row['CFI'], '']
+            lines.append('<tr>' + ''.join(cell.format(escape(value)) for value in values) + '</tr>')
+    lines.append('</table></body></html>')
+    with open(path, 'wb') as f:
+        f.write('\n'.join(lines).encode(new_fetch.ISIN_ENCODING, errors='xmlcharrefreplace'))
+    return [new_fetch.ROW(**row) for row in rows]
+
+
+def memory_status(name: str) -> int:
+    # /proc/self/status的VmRSS(目前)、VmHWM(峰值)，單位為kB。ru_maxrss會包含fork時父process的大小，不使用
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(name + ':'):
+                return int(line.split()[1]) * 1024
+    raise KeyError(name)
+
+
+def selenium_parse(page_path, csv_path):
+    # 原本的流程: page_source(整頁字串)建立lxml樹，所有列轉成list後再寫CSV
+    with open(page_path, 'rb') as f:
+        page_source = f.read().decode(new_fetch.ISIN_ENCODING)
+    data = new_fetch.parse_page(page_source)
+    with open(csv_path, 'w', newline='', encoding='utf_8') as csvfile:
+        writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(data[0]._fields)
+        for d in data:
+            writer.writerow([_ for _ in d])
+
+
+def streaming(page_path, csv_path):
+    new_fetch.stream_to_csv(page_path, csv_path)
+
+
+def run_child(mode, page_path, csv_path):
+    # 在獨立的process執行，回傳(秒數, 記憶體峰值bytes)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_isin_stream', mode, page_path, csv_path],
+                            check=True, capture_output=True, text=True).stdout
+    res = json.loads(output)
+    return res['seconds'], res['peak']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        mode, page_path, csv_path = sys.argv[1:]
+        baseline = memory_status('VmRSS')
+        start = time.perf_counter()
+        {'selenium': selenium_parse, 'streaming': streaming}[mode](page_path, csv_path)
+        print(json.dumps({'seconds': time.perf_counter() - start, 'peak': memory_status('VmHWM') - baseline}))
+        sys.exit()
+
+    directory = tempfile.mkdtemp()
+    page_path = os.path.join(directory, 'C_public.html')
+    expected = make_page(page_path)
+    print(f'網頁{os.path.getsize(page_path) / 1024 ** 2:.1f}MB, {len(expected)}筆')
+
+    results = {}
+    for mode in ('selenium', 'streaming'):
+        csv_path = os.path.join(directory, f'{mode}.csv')
+        results[mode] = run_child(mode, page_path, csv_path)
+        with open(csv_path, encoding='utf_8') as f:
+            assert [new_fetch.ROW(**row) for row in csv.DictReader(f)] == expected, mode
+    (selenium_seconds, selenium_peak), (stream_seconds, stream_peak) = results['selenium'], results['streaming']
+    print(f'Selenium取得原始碼後解析: {selenium_seconds:.2f}秒(另有Chrome啟動與等待10秒), '
+          f'記憶體峰值{selenium_peak / 1024 ** 2:.1f}MB(不含Chrome)')
+    print(f'串流解析: {stream_seconds:.2f}秒, 記憶體峰值{stream_peak / 1024 ** 2:.1f}MB, 結果相同')
+
+    # 內容沒變，不更新CSV
+    csv_path = os.path.join(directory, 'streaming.csv')
+    modified = os.path.getmtime(csv_path)
+    start = time.perf_counter()
+    assert not new_fetch.stream_to_csv(page_path, csv_path)
+    assert os.path.getmtime(csv_path) == modified
+    print(f'內容相同再執行一次: {time.perf_counter() - start:.2f}秒，CSV未更新')
@@ -0,0 +1,66 @@
+"""
+比較panel_backtest一次回測多檔股票、多個起始日期，與逐檔建立MyStock呼叫cal_return的速度，並確認結果相同
+
+在專案根目錄執行: python -m benchmarks.bench_panel_backtest
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from benchmarks.bench_cal_return import fill_fake_TWII  # noqa: E402
+from fake_sources import FakeFetcher  # noqa: E402
+from get_stock_price_data import MyStock  # noqa: E402
+from panel_backtest import panel_backtest  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+SIDS = ['2454', '3231', '3702', '3034', '3711', '2385', '6669', '3037', '2379', '2603', '2303', '5483', '3005',
+        '2404', '6176', '3293', '6121']
+
+
+def loop_backtest(sids, start_dates, fetcher, **kwargs):
+    # 原本ETF_analysis.py的做法，逐檔逐日期呼叫cal_return
+    res = {}
+    for sid in sids:
+        for start_date in start_dates:
+            stock = MyStock(sid, initial_fetch=False, silent=True)
+            stock.fetcher = fetcher
+            res[(sid, start_date)] = stock.cal_return(start_date, silent=True, **kwargs)
+    return res
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    reset_tables()
+    fill_fake_TWII(fetcher)
+    today = datetime.today()
+    download_stocks(SIDS, 2018, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    # 36個上市日期
+    start_dates = [datetime(2021, 1, 4) + timedelta(days=30 * i) for i in range(36)]
+    test_day_list = [10, 30, 60, 120]
+
+    for n_daily_average in (1, 5):
+        kwargs = dict(n_daily_average=n_daily_average, test_day_list=test_day_list, adjust_by_taiex=True)
+        price_cache.clear()
+        start = time.perf_counter()
+        loop = loop_backtest(SIDS, start_dates, fetcher, **kwargs)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        panel = panel_backtest(SIDS, start_dates, download_missing=False, **kwargs)
+        panel_time = time.perf_counter() - start
+
+        for row in panel.itertuples():
+            expected = loop[(row.sid, row.start_date)]
+            assert expected[str(row.day)] == row.metric, (row, expected)
+            assert expected[str(row.day) + '_adj'] == row.adj_metric, (row, expected)
+        n_backtest = len(SIDS) * len(start_dates)
+        print(f'{len(SIDS)}檔 x {len(start_dates)}個起始日期, {n_daily_average}日均價: 逐檔cal_return {loop_time:.2f}秒, '
+              f'panel_backtest {panel_time:.3f}秒, 快{loop_time / panel_time:.0f}倍 ({n_backtest}次回測)')
+    print(panel.groupby('day')[['metric', 'adj_metric']].agg('mean'))
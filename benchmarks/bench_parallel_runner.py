@@ -0,0 +1,51 @@
+"""
+測量parallel_runner在1, 2, 4, 8個process下的速度與擴展性(speedup)，並確認結果與單一process相同
+
+在專案根目錄執行: python -m benchmarks.bench_parallel_runner
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from benchmarks.bench_cal_return import fill_fake_TWII  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from parallel_runner import run_stock_method  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+SIDS = fake_universe(32)
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    reset_tables()
+    fill_fake_TWII(fetcher)
+    today = datetime.today()
+    download_stocks(SIDS, 2019, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    print(f'CPU核心數: {os.cpu_count()}')
+
+    workloads = {
+        'cal_beta(3年每日)': (('cal_beta', today - timedelta(days=365 * 3), today), {'interval': 1}),
+        'cal_return(300個測試天數)': (('cal_return', datetime(2019, 6, 3)),
+                                   {'n_daily_average': 20, 'test_day_list': list(range(5, 1500, 5)),
+                                    'silent': True, 'adjust_by_taiex': True}),
+        'recent_fluctuation': (('recent_fluctuation',), {}),
+    }
+    for name, (args, kwargs) in workloads.items():
+        base_time = None
+        base_res = None
+        for max_workers in (1, 2, 4, 8):
+            # fork出來的worker會繼承主process的快取，每次都清空才公平
+            price_cache.clear()
+            start = time.perf_counter()
+            res = run_stock_method(SIDS, *args, max_workers=max_workers, **kwargs)
+            elapsed = time.perf_counter() - start
+            if base_time is None:
+                base_time, base_res = elapsed, res
+            assert res == base_res
+            print(f'{name} {len(SIDS)}檔, process數{max_workers}: {elapsed:.2f}秒, speedup {base_time / elapsed:.2f}x')
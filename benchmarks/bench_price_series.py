@@ -0,0 +1,95 @@
+"""
+比較DATATUPLE2 list與PriceSeries(欄位陣列)的記憶體(每1萬筆)、讀取與轉換速度，並確認相容的.price/.data結果相同
+
+在專案根目錄執行: python -m benchmarks.bench_price_series
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from create_downloaded_stock_price_db import conn  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock, PRICE_SELECT_COLUMNS, to_datatuple  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+from price_series import PriceSeries  # noqa: E402
+
+FROM_YEAR = 2000
+
+
+def traced_size(func):
+    # func回傳的物件佔用的記憶體(tracemalloc)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    res = func()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return res, size
+
+
+def best_time(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, list_time, series_time):
+    print(f'{name:<16}: DATATUPLE2 list {list_time * 1000:8.2f}毫秒, PriceSeries {series_time * 1000:8.3f}毫秒, '
+          f'快{list_time / max(series_time, 1e-9):.0f}倍')
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sid = fake_universe(1)[0]
+    today = datetime.today()
+    reset_tables()
+    download_stocks([sid], FROM_YEAR, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    stock = MyStock(sid, initial_fetch=False, silent=True)
+    data = stock.fetch_from_to(FROM_YEAR, 1, today.year, today.month)
+    series = stock.fetch_series(FROM_YEAR, 1, today.year, today.month, fetch_missing=False)
+
+    # 相容性
+    assert len(series) == len(data)
+    assert series.price == stock.price
+    assert list(series.data) == data
+    assert list(stock.to_series().data) == data
+
+    # 記憶體
+    rows = conn.execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price WHERE sid = ? ORDER BY date",
+                        (sid,)).fetchall()
+    list_data, list_size = traced_size(lambda: [to_datatuple(row) for row in rows])
+    series_data, series_size = traced_size(lambda: PriceSeries.from_db_rows(sid, rows))
+    per_10k = 10000 / len(rows)
+    print(f'{len(rows)}筆, 每1萬筆記憶體: DATATUPLE2 list {list_size * per_10k / 2 ** 20:.2f}MB, '
+          f'PriceSeries {series_size * per_10k / 2 ** 20:.2f}MB (陣列{series.nbytes * per_10k / 2 ** 20:.2f}MB)')
+
+    def load_list():
+        price_cache.clear()
+        return stock.fetch_from_to(FROM_YEAR, 1, today.year, today.month)
+
+    report('從DB讀取', best_time(load_list),
+           best_time(lambda: stock.fetch_series(FROM_YEAR, 1, today.year, today.month, fetch_missing=False)))
+    report('轉DataFrame', best_time(lambda: pd.DataFrame(data)), best_time(series.to_df))
+    report('收盤價轉numpy', best_time(lambda: np.array([np.nan if row.close is None else row.close for row in data])),
+           best_time(lambda: series.to_numpy()['close']))
+    from_date, to_date = datetime(2015, 1, 1), datetime(2015, 12, 31)
+    sliced = [row for row in data if from_date <= row.date <= to_date]
+    assert list(series.between(from_date, to_date).data) == sliced
+    report('日期區間切片', best_time(lambda: [row for row in data if from_date <= row.date <= to_date]),
+           best_time(lambda: series.between(from_date, to_date)))
+    df = series.to_df()
+    assert np.shares_memory(df['close'].values, series.close) and np.shares_memory(df['date'].values, series.date)
@@ -0,0 +1,112 @@
+"""
+比較全部股票全部歷史計算20日均價的記憶體峰值(tracemalloc):
+fetch_from_to把整段歷史放進self.data再計算，與iter_universe_batches/MyStock.iter_batches逐批串流計算，
+歷史長度加倍時串流的記憶體峰值應維持不變，並確認結果相同
+
+在專案根目錄執行: python -m benchmarks.bench_price_stream
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+from price_stream import iter_universe_batches, rolling_by_sid, RollingMean  # noqa: E402
+
+N = 20
+
+
+class Collector:
+    """
+    收集計算結果，collect為False時只累計筆數與總和，量測記憶體時不把結果算進去
+    """
+
+    def __init__(self, collect: bool):
+        self.res = {} if collect else None
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, sid, date, value):
+        self.count += 1
+        self.total += value
+        if self.res is not None:
+            self.res[(sid, date)] = value
+
+
+def list_moving_average(sids, from_year, today, collector):
+    # 原本的做法: 整段歷史放進self.data，再用twstock的moving_average
+    for sid in sids:
+        stock = MyStock(sid, initial_fetch=False, silent=True)
+        data = [row for row in stock.fetch_from_to(from_year, 1, today.year, today.month) if row.close is not None]
+        ma = stock.moving_average([row.close for row in data], N)
+        for row, value in zip(data[N - 1:], ma):
+            collector.add(sid, row.date, value)
+
+
+def stream_moving_average(sids, from_year, today, collector):
+    batches = iter_universe_batches(sids, datetime(from_year, 1, 1), today, batch='month')
+    for values in rolling_by_sid(batches, lambda: RollingMean(N)):
+        for sid, date, value in values:
+            if value is not None:
+                collector.add(sid, date, value)
+
+
+def stream_stock_moving_average(sids, from_year, today, collector):
+    for sid in sids:
+        stock = MyStock(sid, initial_fetch=False, silent=True)
+        batches = stock.iter_batches(from_year, 1, today.year, today.month, batch='year', fetch_missing=False)
+        for values in rolling_by_sid(batches, lambda: RollingMean(N)):
+            for sid, date, value in values:
+                if value is not None:
+                    collector.add(sid, date, value)
+
+
+def measure(func, *args):
+    # 量測記憶體峰值(包含fetch_from_to放進price_cache的部分)，不保留結果
+    price_cache.clear()
+    collector = Collector(collect=False)
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, collector)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (collector.count, round(collector.total, 2)), peak, elapsed
+
+
+def collect(func, *args):
+    price_cache.clear()
+    collector = Collector(collect=True)
+    func(*args, collector)
+    return collector.res
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(10)
+    today = datetime.today()
+    reset_tables()
+    download_stocks(sids, 2005, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+
+    expected = collect(list_moving_average, sids, 2005, today)
+    assert collect(stream_moving_average, sids, 2005, today) == expected
+    assert collect(stream_stock_moving_average, sids, 2005, today) == expected
+
+    for from_year in (2016, 2005):
+        list_res, list_peak, list_time = measure(list_moving_average, sids, from_year, today)
+        stream_res, stream_peak, stream_time = measure(stream_moving_average, sids, from_year, today)
+        stock_res, stock_peak, stock_time = measure(stream_stock_moving_average, sids, from_year, today)
+        assert list_res == stream_res == stock_res
+        print(f'{len(sids)}檔 {from_year}年至今({list_res[0]}個均價): '
+              f'fetch_from_to {list_peak / 2 ** 20:.1f}MB {list_time:.2f}秒, '
+              f'iter_universe_batches {stream_peak / 2 ** 20:.2f}MB {stream_time:.2f}秒, '
+              f'MyStock.iter_batches(每年) {stock_peak / 2 ** 20:.2f}MB {stock_time:.2f}秒')
@@ -0,0 +1,89 @@
+"""
+比較cal_return、cal_beta沒有快取、第一次(寫入快取)與第二次(讀取快取)的時間，確認結果相同;
+重抓當月不完整資料、大盤更新後舊結果作廢，以及超過上限時的剔除
+
+在專案根目錄執行: python -m benchmarks.bench_result_cache
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+import result_cache  # noqa: E402
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_cal_return import fill_fake_TWII  # noqa: E402
+from create_downloaded_stock_price_db import init_db, get_conn  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock, save_stock_month_data, year_month  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+START_DATES = [datetime(2016, 1, 4) + timedelta(days=60 * i) for i in range(40)]
+
+
+def run(stocks):
+    # 每次從空的股價快取開始，同重新執行notebook
+    price_cache.clear()
+    res = {}
+    start = time.perf_counter()
+    for stock in stocks:
+        for start_date in START_DATES:
+            res[(stock.sid, 'cal_return', start_date)] = stock.cal_return(start_date, 5, silent=True,
+                                                                          adjust_by_taiex=True)
+        res[(stock.sid, 'cal_beta')] = stock.cal_beta(datetime(2016, 1, 1), datetime(2022, 12, 31), interval=7)
+    return res, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(20)
+    today = datetime.today()
+    init_db()
+    fill_fake_TWII(fetcher)
+    download_stocks(sids, 2015, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    # 版本的更新時間只到秒，剛寫入的資料不會存入快取
+    time.sleep(1)
+    stocks = [MyStock(sid, initial_fetch=False, silent=True, fetcher=fetcher) for sid in sids]
+
+    expected, no_cache_time = run(stocks)
+    cache = result_cache.enable()
+    first, first_time = run(stocks)
+    second, second_time = run(stocks)
+    assert first == expected and second == expected
+    stats = cache.stats()
+    assert stats['hits'] == len(expected), stats
+    print(f'{len(expected)}次計算: 沒有快取{no_cache_time:.3f}秒, 第一次(寫入){first_time:.3f}秒, '
+          f'第二次(讀取){second_time:.3f}秒, 快{no_cache_time / second_time:.1f}倍, 快取{stats["bytes"] / 1024:.0f}KB')
+
+    # 重抓當月(不完整)資料，該股票的結果作廢，其他股票仍然命中
+    sid = sids[0]
+    this_month = fetcher.fetch(today.year, today.month, sid)['data']
+    save_stock_month_data(sid, year_month(today.year, today.month), this_month, False)
+    time.sleep(1)
+    cache.reset_stats()
+    res, _ = run(stocks)
+    assert res == expected
+    stats = cache.stats()
+    assert stats['expired'] == len(START_DATES) + 1 and stats['hits'] == len(expected) - stats['expired'], stats
+    print(f'重抓{sid}當月: {stats["expired"]}筆作廢重算，其他{stats["hits"]}筆命中')
+
+    # 大盤更新(這裡改寫最後一天的更新時間)，有用到大盤的結果全部作廢
+    conn = get_conn()
+    conn.execute("UPDATE TWII_daily_price SET updated_date = datetime(updated_date, '+1 second') "
+                 "WHERE date = (SELECT MAX(date) FROM TWII_daily_price)")
+    conn.commit()
+    time.sleep(1)
+    cache.reset_stats()
+    run(stocks)
+    print(f'大盤更新後: {cache.stats()["expired"]}筆作廢重算')
+
+    # 上限
+    cache = result_cache.enable(os.environ['TW_STOCK_DB_PATH'] + 'small_cache.db', max_entries=100)
+    run(stocks)
+    stats = cache.stats()
+    assert stats['entries'] == 100, stats
+    print(f'上限100筆: 剔除{stats["evictions"]}筆')
+    result_cache.disable()
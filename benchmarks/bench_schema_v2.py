@@ -0,0 +1,126 @@
+"""
+比較資料庫結構version 1(TIMESTAMP字串日期)與version 2(整數日期、WITHOUT ROWID)的範圍查詢速度，
+並測試migrate_to_v2原地轉換
+
+在專案根目錄執行: python -m benchmarks.bench_schema_v2
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from connection_manager import connect  # noqa: E402
+from create_downloaded_stock_price_db import (db_file_name, get_schema_version, migrate_to_v2,  # noqa: E402
+                                              from_date_int, to_date_int)
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import PRICE_SELECT_COLUMNS, year_month  # noqa: E402
+
+FROM_YEAR = 2005
+# get_conn()遇到舊版資料庫會報錯要求先轉換，模擬舊版資料庫用自己的連線
+conn = connect(db_file_name)
+
+# 舊版結構
+V1_TABLES_SQL = ["""
+CREATE TABLE stock_daily_price (
+    sid TEXT, month TEXT, date TIMESTAMP, capacity INTEGER, turnover INTEGER, previous_close REAL, open REAL,
+    high REAL, low REAL, close REAL, change REAL, "transaction" INTEGER,
+    updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (sid, date))
+""", """
+CREATE TABLE stock_header (
+    sid TEXT, month TEXT, updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_full_data INTEGER,
+    PRIMARY KEY (sid, month))
+"""]
+
+
+def fill_v1(fetcher, sids, today):
+    for sql in V1_TABLES_SQL:
+        conn.execute(sql)
+    for sid in sids:
+        for year in range(FROM_YEAR, today.year + 1):
+            for month in range(1, 13 if year < today.year else today.month + 1):
+                year_month_str = year_month(year, month)
+                data = fetcher.fetch(year, month, sid)['data']
+                conn.execute("INSERT INTO stock_header VALUES (?, ?, CURRENT_TIMESTAMP, ?)",
+                             (sid, year_month_str, int(year_month_str != year_month(today.year, today.month))))
+                conn.executemany(
+                    "INSERT INTO stock_daily_price VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                    [(sid, year_month_str, str(d.date), d.capacity, d.turnover, d.close - d.change, d.open, d.high,
+                      d.low, d.close, d.change, d.transaction) for d in data])
+    conn.commit()
+
+
+def read_range_v1(sid, from_date, to_date):
+    # 原本的讀法: 字串比較日期，每筆strptime
+    rows = conn.execute("SELECT * FROM stock_daily_price WHERE sid = ? AND date >= ? AND date <= ? ORDER BY date",
+                        (sid, str(from_date), str(to_date))).fetchall()
+    return [(datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S'), row[9]) for row in rows]
+
+
+def read_range_v2(sid, from_date, to_date):
+    rows = conn.execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price WHERE sid = ? AND date BETWEEN ? AND ? "
+                        f"ORDER BY date", (sid, to_date_int(from_date), to_date_int(to_date))).fetchall()
+    return [(from_date_int(row[2]), row[9]) for row in rows]
+
+
+def read_day_v1(date):
+    return conn.execute("SELECT sid, close FROM stock_daily_price WHERE date = ? ORDER BY sid", (str(date),)).fetchall()
+
+
+def read_day_v2(date):
+    return conn.execute("SELECT sid, close FROM stock_daily_price WHERE date = ? ORDER BY sid",
+                        (to_date_int(date),)).fetchall()
+
+
+def timeit(func, queries, repeat=3):
+    best = None
+    res = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = [func(*query) for query in queries]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(30)
+    today = datetime.today()
+    fill_v1(fetcher, sids, today)
+    n_rows = conn.execute('SELECT COUNT(*) FROM stock_daily_price').fetchone()[0]
+    v1_size = os.path.getsize(db_file_name)
+
+    random.seed(0)
+    days = [datetime(day.year, day.month, day.day) for day in fetcher.price_path(sids[0]).days.astype(object)]
+    # 每檔隨機一年的區間
+    range_queries = []
+    for sid in sids * 5:
+        i = random.randrange(len(days) - 250)
+        range_queries.append((sid, days[i], days[i + 250]))
+    day_queries = [(days[random.randrange(len(days))],) for _ in range(50)]
+
+    v1_range_time, v1_range = timeit(read_range_v1, range_queries)
+    v1_day_time, v1_day = timeit(read_day_v1, day_queries)
+
+    start = time.perf_counter()
+    migrate_to_v2(conn)
+    migrate_time = time.perf_counter() - start
+    assert get_schema_version(conn) == 2
+    assert conn.execute('SELECT COUNT(*) FROM stock_daily_price').fetchone()[0] == n_rows
+    v2_size = os.path.getsize(db_file_name)
+
+    v2_range_time, v2_range = timeit(read_range_v2, range_queries)
+    v2_day_time, v2_day = timeit(read_day_v2, day_queries)
+    assert v1_range == v2_range
+    assert v1_day == v2_day
+
+    print(f'{len(sids)}檔共{n_rows}筆, 轉換耗時{migrate_time:.2f}秒, 檔案大小{v1_size / 2 ** 20:.1f}MB -> '
+          f'{v2_size / 2 ** 20:.1f}MB')
+    print(f'單檔一年區間x{len(range_queries)}: v1 {v1_range_time * 1000:.1f}毫秒, v2 {v2_range_time * 1000:.1f}毫秒, '
+          f'快{v1_range_time / v2_range_time:.1f}倍')
+    print(f'單日所有股票x{len(day_queries)}: v1 {v1_day_time * 1000:.1f}毫秒, v2 {v2_day_time * 1000:.1f}毫秒, '
+          f'快{v1_day_time / v2_day_time:.1f}倍')
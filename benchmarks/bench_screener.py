@@ -0,0 +1,62 @@
+"""
+全市場選股一次向量化計算，與逐檔建立MyStock呼叫recent_fluctuation比較速度，並確認漲跌幅與均線結果相同
+
+在專案根目錄執行: python -m benchmarks.bench_screener
+使用暫存資料庫與FakeFetcher，不會連網
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_cal_return import fill_fake_TWII  # noqa: E402
+from create_downloaded_stock_price_db import init_db  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock  # noqa: E402
+from indicator_store import load_indicators  # noqa: E402
+from screener import screen  # noqa: E402
+
+N_SID = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+N_LOOP = 50
+
+if __name__ == '__main__':
+    fetcher = FakeFetcher()
+    sids = fake_universe(N_SID)
+    today = datetime.today()
+    init_db()
+    fill_fake_TWII(fetcher)
+    start = time.perf_counter()
+    download_stocks(sids, today.year - 2, 1, today.year, today.month, requests_per_second=None,
+                    fetcher_factory=lambda sid: fetcher, silent=True)
+    print(f'準備{len(sids)}檔股票: {time.perf_counter() - start:.1f}秒')
+
+    start = time.perf_counter()
+    res = screen(sids)
+    screen_time = time.perf_counter() - start
+    assert len(res) == len(sids)
+    print(f'選股{len(res)}檔: {screen_time:.2f}秒')
+    start = time.perf_counter()
+    screen(sids, min_turnover=res['turnover_ma20'].median(), cross='golden', sort_by='return_60', top=20)
+    print(f'篩選加排序: {time.perf_counter() - start:.2f}秒')
+
+    # 逐檔計算同樣的指標: recent_fluctuation、指標表的均線與成交金額、cal_beta，只跑前N_LOOP檔再換算全部
+    rows = res.set_index('sid')
+    start = time.perf_counter()
+    for sid in sids[:N_LOOP]:
+        stock = MyStock(sid, initial_fetch=False, silent=True, fetcher=fetcher)
+        fluctuation = stock.recent_fluctuation()
+        indicators = load_indicators(sid, today - timedelta(days=60), today)
+        stock.cal_beta(today - timedelta(days=365), today)
+        for day, value in fluctuation.items():
+            expected = rows.at[sid, f'return_{day}']
+            assert value == expected or (math.isnan(value) and math.isnan(expected)), (sid, day, value, expected)
+        for column in ('ma5', 'ma20', 'turnover_ma20'):
+            assert indicators[column][-1] == rows.at[sid, column], (sid, column)
+    loop_time = (time.perf_counter() - start) / N_LOOP * len(sids)
+    print(f'逐檔計算(換算{len(sids)}檔): {loop_time:.2f}秒, 選股快{loop_time / screen_time:.1f}倍，'
+          f'漲跌幅、5/20日均線與平均成交金額相同')
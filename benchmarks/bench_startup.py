@@ -0,0 +1,79 @@
+"""
+量測import get_stock_price_data的時間，以及MyStock初始化(讀取近兩個月股價)的時間，
+比較預設模式與db_first模式，cold為清空快取(從DB讀取)，warm為快取已有資料
+
+在專案根目錄執行: python -m benchmarks.bench_startup
+使用暫存資料庫與FakeFetcher(每次請求延遲模擬連網)，不會連網
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from create_downloaded_stock_price_db import conn  # noqa: E402
+from fake_sources import FakeFetcher, fake_universe  # noqa: E402
+from get_stock_price_data import MyStock, year_month  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import get_stock_price_data
+print(time.perf_counter() - start, int('pandas' in sys.modules), int('yfinance' in sys.modules))
+"""
+
+
+def measure_import(repeat=5):
+    # 每次開新的python process，第一次為cold(含磁碟快取等因素)
+    res = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], capture_output=True, text=True, check=True,
+                             env={**os.environ, 'TW_STOCK_DB_PATH': os.path.join(tempfile.mkdtemp(), 'no_db', '')})
+        seconds, has_pandas, has_yfinance = out.stdout.split()
+        res.append(float(seconds))
+    return res, has_pandas == '1', has_yfinance == '1'
+
+
+def mark_this_month_stale(sids, today):
+    # 模擬當月資料是昨天抓的
+    conn.executemany("UPDATE stock_header SET updated_date = datetime('now', '-1 day') WHERE sid = ? AND month = ?",
+                     [(sid, year_month(today.year, today.month)) for sid in sids])
+    conn.commit()
+
+
+def construct_all(sids, fetcher, **kwargs):
+    start = time.perf_counter()
+    fetch_count = fetcher.fetch_count
+    for sid in sids:
+        MyStock(sid, silent=True, fetcher=fetcher, **kwargs)
+    return time.perf_counter() - start, fetcher.fetch_count - fetch_count
+
+
+if __name__ == '__main__':
+    import_times, has_pandas, has_yfinance = measure_import()
+    print(f'import get_stock_price_data: cold {import_times[0]:.3f}秒, warm中位數 '
+          f'{statistics.median(import_times[1:]):.3f}秒 (載入pandas: {has_pandas}, 載入yfinance: {has_yfinance}, '
+          f'import時不開啟資料庫)')
+
+    fetcher = FakeFetcher(latency=0.2)
+    sids = fake_universe(20)
+    today = datetime.today()
+    reset_tables()
+    before = today - timedelta(days=60)
+    download_stocks(sids, before.year, before.month, today.year, today.month, requests_per_second=None,
+                    max_workers=16, fetcher_factory=lambda sid: fetcher, silent=True)
+
+    for name, kwargs in (('預設', {}), ('db_first', {'db_first': True})):
+        mark_this_month_stale(sids, today)
+        price_cache.clear()
+        cold_time, cold_fetch = construct_all(sids, fetcher, **kwargs)
+        warm_time, warm_fetch = construct_all(sids, fetcher, **kwargs)
+        print(f'{name:>8}模式建立{len(sids)}個MyStock: cold {cold_time:.3f}秒(線上抓取{cold_fetch}次), '
+              f'warm {warm_time:.4f}秒(線上抓取{warm_fetch}次)')
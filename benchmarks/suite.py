@@ -0,0 +1,224 @@
+"""
+離線benchmark套件: 用FakeFetcher/FakeTicker產生數百檔、多年的假股價，量測主要工作冷(清空price_cache與TWII快取)
+與熱(快取已有資料)的耗時，結果寫成JSON，可以跟之前版本的結果比較找出變慢的地方
+
+在專案根目錄執行:
+python -m benchmarks.suite --output bench_results.json
+python -m benchmarks.suite --sids 50 --years 3 --only fetch_from_to cal_beta
+python -m benchmarks.suite --output new.json --compare bench_results.json
+使用暫存資料庫，fetcher與TWII來源都換成假資料，不會連網
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TW_STOCK_DB_PATH'] = tempfile.mkdtemp() + '/'
+
+from batch_downloader import download_stocks  # noqa: E402
+from benchmarks.bench_bulk_insert import reset_tables  # noqa: E402
+from fake_sources import FakeFetcher, FakeTicker, fake_universe  # noqa: E402
+from get_TWII_price import get_TWII_data, reset_TWII_index, set_TWII_ticker_factory, update_TWII_data  # noqa: E402
+from get_stock_price_data import MyStock, set_fetcher_factory  # noqa: E402
+from panel_backtest import panel_backtest  # noqa: E402
+from price_cache import price_cache  # noqa: E402
+
+# 比之前的結果慢超過這個倍數就標示出來
+REGRESSION_RATIO = 1.2
+# ETF_analysis的成分股數量與平均成交金額天數
+ETF_SIZE = 10
+N_DAY = 5
+
+
+class Context:
+    """
+    每個workload共用的設定
+    """
+
+    def __init__(self, sids, years, fetcher):
+        self.sids = sids
+        self.years = years
+        self.fetcher = fetcher
+        self.today = datetime.today()
+        self.from_year = self.today.year - years
+        rng = random.Random(0)
+        first_day = datetime(self.from_year, 1, 1)
+        self.TWII_dates = [(first_day + timedelta(days=rng.randrange((self.today - first_day).days))).strftime('%Y-%m-%d')
+                           for _ in range(2000)]
+
+
+def construct(ctx):
+    # MyStock初始化(讀取近兩個月)
+    for sid in ctx.sids:
+        MyStock(sid, silent=True)
+    return len(ctx.sids)
+
+
+def fetch_from_to(ctx):
+    for sid in ctx.sids:
+        MyStock(sid, initial_fetch=False, silent=True).fetch_from_to(ctx.from_year, 1, ctx.today.year, ctx.today.month)
+    return len(ctx.sids)
+
+
+def cal_return(ctx):
+    start_date = datetime(ctx.today.year - 1, 1, 5)
+    for sid in ctx.sids:
+        MyStock(sid, initial_fetch=False, silent=True).cal_return(start_date, silent=True, adjust_by_taiex=True)
+    return len(ctx.sids)
+
+
+def cal_beta(ctx):
+    start_date = ctx.today - timedelta(days=365 * min(ctx.years, 3))
+    for sid in ctx.sids:
+        MyStock(sid, initial_fetch=False, silent=True).cal_beta(start_date, ctx.today, interval=7)
+    return len(ctx.sids)
+
+
+def recent_fluctuation(ctx):
+    for sid in ctx.sids:
+        MyStock(sid, initial_fetch=False, silent=True).recent_fluctuation()
+    return len(ctx.sids)
+
+
+def TWII_lookup(ctx):
+    for date in ctx.TWII_dates:
+        get_TWII_data(date)
+    return len(ctx.TWII_dates)
+
+
+def etf_workflow(ctx):
+    # 同ETF_analysis.py: 成分股近N日平均成交金額占比，加上成分股上市前後漲幅一次回測
+    constituents = ctx.sids[:ETF_SIZE]
+    for sid in constituents:
+        stock_df = MyStock(sid, silent=True).to_df()
+        sum(stock_df.tail(N_DAY)['turnover']) / N_DAY
+    listing_date = datetime(ctx.today.year - 1, 2, 1)
+    res_df = panel_backtest(constituents, listing_date, test_day_list=[30], adjust_by_taiex=True, n_daily_average=1)
+    res_df['metric'].mean()
+    res_df['adj_metric'].mean()
+    return len(constituents)
+
+
+WORKLOADS = {
+    'construct': construct,
+    'fetch_from_to': fetch_from_to,
+    'cal_return': cal_return,
+    'cal_beta': cal_beta,
+    'recent_fluctuation': recent_fluctuation,
+    'get_TWII_data': TWII_lookup,
+    'etf_workflow': etf_workflow,
+}
+
+
+def clear_caches():
+    price_cache.clear()
+    reset_TWII_index()
+
+
+def timings(func, ctx, repeat, cold):
+    res = []
+    for _ in range(repeat):
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        func(ctx)
+        res.append(time.perf_counter() - start)
+    return {'best': round(min(res), 6), 'median': round(statistics.median(res), 6)}
+
+
+def run_workload(func, ctx, repeat):
+    fetch_count = ctx.fetcher.fetch_count
+    cold = timings(func, ctx, repeat, cold=True)
+    # 冷的最後一次跑完快取已有資料
+    warm = timings(func, ctx, repeat, cold=False)
+    return {'n': func(ctx), 'cold': cold, 'warm': warm, 'fetches': ctx.fetcher.fetch_count - fetch_count}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare(n_sid, years):
+    """
+    建立暫存DB並寫入假股價與假大盤，之後所有線上抓取都使用假資料
+    """
+    fetcher = FakeFetcher()
+    set_fetcher_factory(lambda sid: fetcher)
+    set_TWII_ticker_factory(lambda: FakeTicker(fetcher.end_date))
+    reset_tables()
+    update_TWII_data()
+    ctx = Context(fake_universe(n_sid), years, fetcher)
+    download_stocks(ctx.sids, ctx.from_year, 1, ctx.today.year, ctx.today.month, requests_per_second=None,
+                    silent=True)
+    return ctx
+
+
+def print_results(results, previous=None):
+    previous = (previous or {}).get('results', {})
+    for name, res in results.items():
+        line = f'{name:<20} n={res["n"]:<5}'
+        for mode in ('cold', 'warm'):
+            seconds = res[mode]['best']
+            line += f' {mode} {seconds * 1000:10.2f}毫秒'
+            old = previous.get(name, {}).get(mode)
+            if old:
+                ratio = seconds / max(old['best'], 1e-9)
+                line += f' ({ratio:5.2f}x{" 變慢" if ratio > REGRESSION_RATIO else ""})'
+        if res['fetches']:
+            line += f' 線上抓取{res["fetches"]}次'
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='離線benchmark套件')
+    parser.add_argument('--sids', type=int, default=200, help='股票數量')
+    parser.add_argument('--years', type=int, default=5, help='假股價年數')
+    parser.add_argument('--repeat', type=int, default=3, help='冷、熱各跑幾次')
+    parser.add_argument('--only', nargs='+', choices=list(WORKLOADS), help='只跑指定的workload')
+    parser.add_argument('--output', help='結果寫入的JSON檔')
+    parser.add_argument('--compare', help='之前的結果JSON檔，顯示與之前的倍數')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    ctx = prepare(args.sids, args.years)
+    setup_seconds = time.perf_counter() - start
+    print(f'準備{len(ctx.sids)}檔 {ctx.from_year}年至今的假股價: {setup_seconds:.1f}秒')
+
+    results = {name: run_workload(WORKLOADS[name], ctx, args.repeat) for name in (args.only or WORKLOADS)}
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'sids': len(ctx.sids),
+            'years': args.years,
+            'repeat': args.repeat,
+            'setup_seconds': round(setup_seconds, 3),
+        },
+        'results': results,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+把stock_daily_price轉成每檔股票一個資料夾、每個欄位一個.npy檔的欄位式儲存，
+讀取時用memory-map直接對應成numpy陣列，長期歷史資料的掃描不用經過SQL與逐筆轉換。
+
+資料夾結構
+{npy_path}{sid}/date.npy, close.npy, ...
+{npy_path}{sid}/meta.json: 已同步的月份與該月stock_header的updated_date
+
+使用方式
+python columnar_store.py              # 同步DB內所有股票
+python columnar_store.py 2330 2454    # 只同步指定股票
+
+from columnar_store import load_columnar, load_columnar_df
+arrays = load_columnar('2330')
+"""
+import json
+import os
+import sys
+from typing import List, Dict
+
+import numpy as np
+import pandas as pd
+
+from config import npy_path
+from create_downloaded_stock_price_db import get_conn
+
+# 欄位名稱與dtype，順序同stock_daily_price(不含sid, updated_date)
+COLUMNS = {
+    'date': 'datetime64[D]',
+    'capacity': 'int64',
+    'turnover': 'int64',
+    'previous_close': 'float64',
+    'open': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'close': 'float64',
+    'change': 'float64',
+    'transaction': 'int64',
+}
+SELECT_COLUMNS = ', '.join(f'"{column}"' for column in COLUMNS)
+
+
+def sid_dir(sid: str, root: str = None) -> str:
+    return os.path.join(root or npy_path, sid)
+
+
+def read_meta(sid: str, root: str = None) -> dict:
+    meta_file = os.path.join(sid_dir(sid, root), 'meta.json')
+    if not os.path.exists(meta_file):
+        return {'sid': sid, 'rows': 0, 'months': {}}
+    with open(meta_file, encoding='utf_8') as f:
+        return json.load(f)
+
+
+def rows_to_arrays(rows: List[tuple]) -> Dict[str, np.ndarray]:
+    """
+    stock_daily_price的資料列(SELECT_COLUMNS順序)轉成欄位陣列，整數日期yyyymmdd一次轉成datetime64
+    沒有成交的價格(None)為nan，數量欄位為0
+    """
+    res = {'date': pd.to_datetime(np.array([row[0] for row in rows], dtype=np.int64).astype(str),
+                                  format='%Y%m%d').values.astype('datetime64[D]')}
+    for i, (column, dtype) in enumerate(list(COLUMNS.items())[1:], start=1):
+        values = [row[i] for row in rows]
+        if dtype == 'float64':
+            res[column] = np.array([np.nan if value is None else value for value in values], dtype=dtype)
+        else:
+            res[column] = np.array([0 if value is None else value for value in values], dtype=dtype)
+    return res
+
+
+def write_arrays(sid: str, arrays: Dict[str, np.ndarray], meta: dict, root: str = None):
+    """
+    先寫到暫存檔再rename取代，寫到一半失敗不會留下壞掉的檔案，meta.json最後寫
+    注意: Windows上若有其他程式正在memory-map這些檔案，rename會失敗
+    """
+    folder = sid_dir(sid, root)
+    os.makedirs(folder, exist_ok=True)
+    for column, values in arrays.items():
+        tmp_file = os.path.join(folder, f'{column}.tmp.npy')
+        np.save(tmp_file, values)
+        os.replace(tmp_file, os.path.join(folder, f'{column}.npy'))
+    tmp_file = os.path.join(folder, 'meta.tmp.json')
+    with open(tmp_file, 'w', encoding='utf_8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, os.path.join(folder, 'meta.json'))
+
+
+def sync_sid(sid: str, root: str = None) -> int:
+    """
+    同步單一股票。比對stock_header每個月的updated_date與上次同步的紀錄，
+    只從最早有變動的月份開始重新讀取DB，之前的資料沿用既有的.npy
+    :return: 從DB讀取的筆數，0代表沒有變動
+    """
+    conn = get_conn()
+    meta = read_meta(sid, root)
+    header = dict(conn.execute("SELECT month, updated_date FROM stock_header WHERE sid = ?", (sid,)).fetchall())
+    changed_months = sorted(month for month, updated_date in header.items()
+                            if meta['months'].get(month) != updated_date)
+    if not changed_months:
+        return 0
+    first_month = changed_months[0]
+    rows = conn.execute(f"SELECT {SELECT_COLUMNS} FROM stock_daily_price WHERE sid = ? AND date > ? ORDER BY date",
+                        (sid, int(first_month) * 100)).fetchall()
+    new_arrays = rows_to_arrays(rows)
+
+    if meta['rows']:
+        # 沿用變動月份之前的資料
+        old_arrays = load_columnar(sid, root=root, mmap=False)
+        month_start = np.datetime64(f'{first_month[:4]}-{first_month[4:]}-01')
+        keep = int(np.searchsorted(old_arrays['date'], month_start))
+        new_arrays = {column: np.concatenate([old_arrays[column][:keep], new_arrays[column]])
+                      for column in COLUMNS}
+    meta = {'sid': sid, 'rows': len(new_arrays['date']), 'months': header}
+    write_arrays(sid, new_arrays, meta, root)
+    return len(rows)
+
+
+def sync_columnar_store(sids: List[str] = None, root: str = None, silent=False) -> dict:
+    """
+    同步多檔股票，sids為None時同步stock_header內所有股票
+    :return: {sid: 從DB讀取的筆數}
+    """
+    if sids is None:
+        sids = [row[0] for row in get_conn().execute("SELECT DISTINCT sid FROM stock_header ORDER BY sid")]
+    res = {}
+    for sid in sids:
+        res[sid] = sync_sid(sid, root)
+        if not silent and res[sid]:
+            print(f'股票代碼{sid}同步{res[sid]}筆')
+    return res
+
+
+def load_columnar(sid: str, columns: List[str] = None, root: str = None, mmap=True) -> Dict[str, np.ndarray]:
+    """
+    讀取單一股票的欄位式股價
+    :param columns: 要讀取的欄位，None為全部
+    :param mmap: True時用memory-map唯讀對應檔案，不複製到記憶體
+    :return: {欄位: 陣列}，依日期排序
+    """
+    folder = sid_dir(sid, root)
+    if not os.path.exists(os.path.join(folder, 'meta.json')):
+        raise FileNotFoundError(f'股票代碼{sid}尚未同步欄位式資料，請先執行sync_columnar_store')
+    return {column: np.load(os.path.join(folder, f'{column}.npy'), mmap_mode='r' if mmap else None)
+            for column in (columns or COLUMNS)}
+
+
+def load_columnar_df(sid: str, columns: List[str] = None, root: str = None) -> pd.DataFrame:
+    """
+    讀取單一股票的欄位式股價成DataFrame，欄位直接使用memory-map的陣列不複製
+    """
+    return pd.DataFrame(load_columnar(sid, columns, root), copy=False)
+
+
+if __name__ == '__main__':
+    sync_columnar_store(sys.argv[1:] or None)
@@ -1,3 +1,8 @@
-db_path = "C:/Users/User/iCloudDrive/share_data/db/"
+import os
+
+# 可用環境變數 TW_STOCK_DB_PATH 指定其他資料庫資料夾(結尾需有/)，benchmark會用暫存資料夾避免動到正式資料
+db_path = os.environ.get('TW_STOCK_DB_PATH', "C:/Users/User/iCloudDrive/share_data/db/")
 csv_path = "C:/Users/User/iCloudDrive/share_data/csv/"
-xlsx_path = "C:/Users/User/iCloudDrive/share_data/xlsx/"
\ No newline at end of file
+xlsx_path = "C:/Users/User/iCloudDrive/share_data/xlsx/"
+# 每檔股票欄位式(.npy)股價的資料夾，可用環境變數 TW_STOCK_NPY_PATH 覆寫(結尾需有/)
+npy_path = os.environ.get('TW_STOCK_NPY_PATH', "C:/Users/User/iCloudDrive/share_data/npy/")
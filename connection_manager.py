@@ -0,0 +1,196 @@
+"""
+SQLite連線管理: 每個thread各自一條連線(sqlite3的連線不能跨thread使用)，資料庫使用WAL模式，
+寫入時其他連線仍可讀取，下載股價的同時可以跑回測。
+另外提供唯讀連線與單一writer thread的寫入佇列，多個thread要寫入時由writer依序執行，不會互相等待lock。
+
+使用方式(一般透過create_downloaded_stock_price_db.get_conn()取得目前thread的連線)
+from create_downloaded_stock_price_db import get_manager
+manager = get_manager()
+manager.reader().execute('SELECT ...')
+future = manager.writer().submit(save_stock_month_data, '2330', '202401', data, True)
+future.result()
+"""
+import os
+import queue
+import sqlite3
+import threading
+import weakref
+from concurrent.futures import Future
+from pathlib import Path
+
+# journal_mode: WAL讓讀取不被寫入擋住，設定後會記錄在資料庫檔案
+# synchronous: WAL模式下NORMAL只在checkpoint時fsync，斷電最多遺失最後幾個transaction，不會損毀
+# cache_size: 負數為KB，每條連線64MB
+# mmap_size: 用記憶體映射讀取資料庫檔案，減少read系統呼叫與複製
+# busy_timeout: 遇到lock時最多等待的毫秒數
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 ** 2,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 30000,
+}
+# 唯讀連線不能設定journal_mode
+READER_PRAGMAS = {key: value for key, value in DEFAULT_PRAGMAS.items() if key != 'journal_mode'}
+# writer thread所屬的ConnectionManager，工作函式內的get_conn()與失敗時的rollback用同一條連線
+_writer_state = threading.local()
+# 目前存在的ConnectionManager，fork出的子process不能沿用父process的連線，在子process內全部重設
+_managers = weakref.WeakSet()
+
+
+def _reset_managers():
+    for manager in list(_managers):
+        manager._reset()
+
+
+# Windows沒有fork，也沒有os.register_at_fork
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_managers)
+
+
+def current_writer_connection():
+    """
+    在writer thread內回傳該writer的ConnectionManager的連線，其他thread回傳None
+    """
+    manager = getattr(_writer_state, 'manager', None)
+    return None if manager is None else manager.connection()
+
+
+def apply_pragmas(conn: sqlite3.Connection, pragmas: dict) -> sqlite3.Connection:
+    for key, value in pragmas.items():
+        conn.execute(f'PRAGMA {key} = {value}')
+    return conn
+
+
+def connect(db_file: str, pragmas: dict = None) -> sqlite3.Connection:
+    # 開啟讀寫連線並設定pragma
+    return apply_pragmas(sqlite3.connect(db_file, timeout=30), DEFAULT_PRAGMAS if pragmas is None else pragmas)
+
+
+def connect_read_only(db_file: str, pragmas: dict = None) -> sqlite3.Connection:
+    # 用URI的mode=ro開啟唯讀連線
+    conn = sqlite3.connect(Path(db_file).absolute().as_uri() + '?mode=ro', uri=True, timeout=30)
+    return apply_pragmas(conn, READER_PRAGMAS if pragmas is None else pragmas)
+
+
+class WriterQueue:
+    """
+    單一writer thread依序執行寫入工作，工作函式在writer thread內用get_conn()寫入並commit，
+    get_conn()在writer thread內回傳這個manager的連線，失敗時rollback的也是同一條連線
+    """
+
+    def __init__(self, manager: 'ConnectionManager'):
+        self.manager = manager
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        _writer_state.manager = self.manager
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            future, func, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                # 寫到一半失敗，未commit的部分放棄
+                self.manager.connection().rollback()
+                future.set_exception(e)
+        self.manager.close_thread_connections()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """
+        把寫入工作排進佇列
+        :param func: 在writer thread執行的函式，例如save_stock_month_data
+        :return: Future，result()為func的回傳值
+        """
+        if not self._thread.is_alive():
+            raise RuntimeError('writer已關閉')
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def execute(self, sql: str, params=()) -> Future:
+        # 執行一個SQL並commit
+        return self.submit(self._execute, sql, params, many=False)
+
+    def executemany(self, sql: str, seq_of_params) -> Future:
+        return self.submit(self._execute, sql, list(seq_of_params), many=True)
+
+    def _execute(self, sql, params, many):
+        conn = self.manager.connection()
+        with conn:
+            cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+            return cursor.rowcount
+
+    def flush(self):
+        # 等待目前佇列內的工作全部寫完
+        self.submit(lambda: None).result()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class ConnectionManager:
+    """
+    管理同一個資料庫檔案的連線
+    connection(): 目前thread的讀寫連線
+    reader(): 目前thread的唯讀連線
+    writer(): 共用的寫入佇列
+    """
+
+    def __init__(self, db_file: str, pragmas: dict = None):
+        self.db_file = db_file
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self._local = threading.local()
+        self._writer = None
+        self._lock = threading.Lock()
+        _managers.add(self)
+
+    def _reset(self):
+        # fork後的子process: 父process的連線、writer thread與lock都不能沿用
+        self._local = threading.local()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_file, self.pragmas)
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'reader', None)
+        if conn is None:
+            reader_pragmas = {key: value for key, value in self.pragmas.items() if key != 'journal_mode'}
+            conn = self._local.reader = connect_read_only(self.db_file, reader_pragmas)
+        return conn
+
+    def writer(self) -> WriterQueue:
+        with self._lock:
+            if self._writer is None:
+                self._writer = WriterQueue(self)
+            return self._writer
+
+    def close_thread_connections(self):
+        # 關閉目前thread的連線，thread結束前呼叫(沒呼叫的話連線在thread結束後被回收時關閉)
+        for name in ('conn', 'reader'):
+            conn = getattr(self._local, name, None)
+            if conn is not None:
+                conn.close()
+                setattr(self._local, name, None)
+
+    def close(self):
+        # 關閉writer與目前thread的連線
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        self.close_thread_connections()
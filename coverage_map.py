@@ -0,0 +1,97 @@
+"""
+每檔股票每個月份的抓取狀態(完整、不完整及最後更新時間)，從stock_header一次查詢建立，
+用來找出真正需要線上抓取的月份，不用每個月各查一次DB。
+
+使用方式
+from coverage_map import load_coverage
+coverage = load_coverage('2330')
+coverage.missing_months(['202401', '202402'])
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import List, Dict, Tuple
+
+from create_downloaded_stock_price_db import get_conn
+
+# is_full_data: 該月資料是否完整
+# updated_date: 最後抓取時間(UTC，同stock_header.updated_date)
+MONTH_STATUS = namedtuple('MonthStatus', ['is_full_data', 'updated_date'])
+
+
+def utc_today() -> str:
+    # stock_header.updated_date為UTC的CURRENT_TIMESTAMP，今天也用UTC的yyyy-mm-dd比較
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+def month_ranges(months: List[str]) -> List[Tuple[str, str]]:
+    """
+    把排序好的月份合併成連續區間，例如['202401', '202402', '202405'] -> [('202401', '202402'), ('202405', '202405')]
+    """
+    res = []
+    for month in months:
+        ym = int(month[:4]) * 12 + int(month[4:])
+        if res and ym == res[-1][2] + 1:
+            res[-1][1], res[-1][2] = month, ym
+        else:
+            res.append([month, month, ym])
+    return [(start, end) for start, end, _ in res]
+
+
+class CoverageMap:
+    """
+    單一股票已抓取月份的狀態
+    months: {月份: MONTH_STATUS}
+    """
+    __slots__ = ('sid', 'months')
+
+    def __init__(self, sid: str, months: Dict[str, MONTH_STATUS] = None):
+        self.sid = sid
+        self.months = months or {}
+
+    def is_fresh(self, year_month_str: str, allow_partial=False, today: str = None) -> bool:
+        """
+        該月是否不用重抓，條件同MyStock.check_stock_data_in_db: 資料完整或今天已經抓過，
+        allow_partial為True時只要抓過就算
+        :param today: UTC的yyyy-mm-dd，None為現在
+        """
+        status = self.months.get(year_month_str)
+        if status is None:
+            return False
+        if status.is_full_data or allow_partial:
+            return True
+        return status.updated_date >= (today or utc_today())
+
+    def missing_months(self, months: List[str], partial_ok: List[str] = ()) -> List[str]:
+        """
+        需要線上抓取的月份
+        :param months: 要檢查的月份
+        :param partial_ok: 不完整也可以直接使用的月份(MyStock db_first模式的當月)
+        """
+        today = utc_today()
+        return [month for month in months if not self.is_fresh(month, month in partial_ok, today)]
+
+
+def load_coverage(sid: str, from_month: str = None, to_month: str = None) -> CoverageMap:
+    """
+    一次查詢建立單一股票的CoverageMap，可限制月份範圍
+    """
+    rows = get_conn().execute("SELECT month, is_full_data, updated_date FROM stock_header WHERE sid = ? "
+                              "AND month BETWEEN ? AND ?",
+                              (sid, from_month or '000000', to_month or '999999')).fetchall()
+    return CoverageMap(sid, {month: MONTH_STATUS(bool(is_full_data), updated_date)
+                             for month, is_full_data, updated_date in rows})
+
+
+def load_coverages(sids: List[str], from_month: str = None, to_month: str = None) -> Dict[str, CoverageMap]:
+    """
+    一次查詢建立多檔股票的CoverageMap，可限制月份範圍
+    :return: {sid: CoverageMap}，DB沒有資料的股票也會有空的CoverageMap
+    """
+    res = {sid: CoverageMap(sid) for sid in sids}
+    placeholders = ', '.join('?' * len(sids))
+    rows = get_conn().execute(
+        f"SELECT sid, month, is_full_data, updated_date FROM stock_header WHERE sid IN ({placeholders}) "
+        f"AND month BETWEEN ? AND ?", (*sids, from_month or '000000', to_month or '999999')).fetchall()
+    for sid, month, is_full_data, updated_date in rows:
+        res[sid].months[month] = MONTH_STATUS(bool(is_full_data), updated_date)
+    return res
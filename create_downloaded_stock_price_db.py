@@ -1,49 +1,208 @@
 import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
 
 from config import db_path
+from connection_manager import ConnectionManager, connect_read_only, current_writer_connection
 
 db_file_name = db_path + "stock_data.db"
-conn = sqlite3.connect(db_file_name)
+# 連線由ConnectionManager管理，每個thread各自一條連線，第一次使用時才開啟，import時不碰資料庫
+# 外部仍可用 from create_downloaded_stock_price_db import conn 取得目前thread的連線
+_manager = None
+# parallel_runner的worker process使用自己的唯讀連線，不共用主process的conn
+_worker_conn = None
+# read_only_connection()的唯讀連線只給進入with區塊的thread使用，其他thread照常使用自己的連線
+_thread_override = threading.local()
+
+# 資料庫結構版本，記錄在PRAGMA user_version
+# 1: 日期存TIMESTAMP字串，stock_header沒有is_full_data欄位(舊版，user_version為0)
+# 2: 日期存整數yyyymmdd，(sid, date)為WITHOUT ROWID主鍵，stock_header有is_full_data欄位
+SCHEMA_VERSION = 2
+
+STOCK_PRICE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stock_daily_price (
+    sid TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    capacity INTEGER,
+    turnover INTEGER,
+    previous_close REAL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    change REAL,
+    "transaction" INTEGER,
+    updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sid, date)
+) WITHOUT ROWID
+"""
+# 依日期查詢所有股票收盤價(選股、panel回測)用，WITHOUT ROWID的索引會自帶主鍵(sid, date)，不用回表
+STOCK_PRICE_DATE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS stock_daily_price_date_close ON stock_daily_price (date, close)
+"""
+STOCK_HEADER_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stock_header (
+    sid TEXT NOT NULL,
+    month TEXT NOT NULL,
+    updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_full_data INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sid, month)
+) WITHOUT ROWID
+"""
+# 由股價算出的技術指標(indicator_store維護)，均價四捨五入到小數第二位同twstock的moving_average
+STOCK_INDICATOR_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stock_indicator (
+    sid TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    ma5 REAL,
+    ma20 REAL,
+    ma60 REAL,
+    turnover_ma5 REAL,
+    turnover_ma20 REAL,
+    daily_return REAL,
+    PRIMARY KEY (sid, date)
+) WITHOUT ROWID
+"""
+# 舊版用trigger在每筆股價寫入時讓之後的指標作廢，大量寫入時每筆多一次DELETE，
+# 改由save_stock_month_data每批寫入只作廢一次(indicator_store.invalidate_indicators)
+DROP_INDICATOR_TRIGGER_SQL = "DROP TRIGGER IF EXISTS stock_indicator_invalidate"
+
+
+def to_date_int(date: datetime) -> int:
+    # datetime轉為DB存的整數日期yyyymmdd
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def from_date_int(date_int: int) -> datetime:
+    # DB存的整數日期yyyymmdd轉為datetime
+    return datetime(date_int // 10000, date_int // 100 % 100, date_int % 100)
+
+
+def get_manager() -> ConnectionManager:
+    # 取得(第一次使用時建立)資料庫的連線管理，第一次開啟時先確認資料庫結構版本
+    global _manager
+    if _manager is None:
+        manager = ConnectionManager(db_file_name)
+        try:
+            check_schema(manager.connection())
+        except BaseException:
+            manager.close()
+            raise
+        _manager = manager
+    return _manager
+
+
+def check_schema(db_conn: sqlite3.Connection, read_only=False):
+    """
+    確認資料庫結構為目前版本，在任何讀寫之前呼叫
+    新的(還沒有資料表的)資料庫直接建立資料表，舊版資料庫不自動轉換(轉換前應先備份)，直接報錯，
+    避免用新版的SQL讀到空結果、或把新格式的資料寫進舊的資料表
+    :param read_only: 唯讀連線不能建立資料表，新的資料庫也報錯
+    """
+    version = get_schema_version(db_conn)
+    if version == SCHEMA_VERSION:
+        return
+    if version == 1:
+        raise RuntimeError(f'{db_conn_file(db_conn)}為舊版結構(version 1)，請先備份後執行 '
+                           f'python create_downloaded_stock_price_db.py 或 migrate_to_v2() 轉換成version {SCHEMA_VERSION}')
+    if version == 0 and not read_only:
+        init_db(db_conn)
+        return
+    raise RuntimeError(f'{db_conn_file(db_conn)}的結構版本為{version}，需要version {SCHEMA_VERSION}')
+
+
+def db_conn_file(db_conn: sqlite3.Connection) -> str:
+    # 連線開啟的資料庫檔案
+    return db_conn.execute('PRAGMA database_list').fetchone()[2]
+
+
+def open_read_only_connection(db_file: str = db_file_name) -> sqlite3.Connection:
+    conn = connect_read_only(db_file)
+    try:
+        check_schema(conn, read_only=True)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def use_read_only_connection(db_file: str = db_file_name):
+    """
+    這個process之後的查詢都改用唯讀連線，給parallel_runner的worker初始化使用
+    """
+    global _worker_conn
+    _worker_conn = open_read_only_connection(db_file)
+
+
+@contextmanager
+def read_only_connection(db_file: str = db_file_name):
+    """
+    with區塊內目前thread的查詢改用唯讀連線，結束後恢復，給parallel_runner不開process時使用，
+    與worker process一樣不會寫入DB，不影響其他thread
+    """
+    previous = getattr(_thread_override, 'conn', None)
+    conn = _thread_override.conn = open_read_only_connection(db_file)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        _thread_override.conn = previous
+
+
+def open_connection() -> sqlite3.Connection:
+    # 開啟(或取得已開啟的)目前thread的連線
+    return get_manager().connection()
+
+
+def __getattr__(name):
+    # 讓 create_downloaded_stock_price_db.conn 在第一次使用時才開啟連線
+    if name == 'conn':
+        return open_connection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_conn() -> sqlite3.Connection:
+    """
+    取得目前thread應該使用的連線，一般為該thread自己的讀寫連線，worker process為自己的唯讀連線，
+    WriterQueue的writer thread為該writer所屬ConnectionManager的連線，read_only_connection()區塊內為該區塊的唯讀連線
+    """
+    writer_conn = current_writer_connection()
+    if writer_conn is not None:
+        return writer_conn
+    override_conn = getattr(_thread_override, 'conn', None)
+    if override_conn is not None:
+        return override_conn
+    return get_manager().connection() if _worker_conn is None else _worker_conn
 
 
 def create_stock_price_table():
     # 建立股價資料表
-    conn.execute("""
-    CREATE TABLE IF NOT EXISTS stock_daily_price (
-        sid TEXT,
-        month TEXT,
-        date TIMESTAMP,
-        capacity INTEGER,
-        turnover INTEGER,
-        previous_close REAL,
-        open REAL,
-        high REAL,
-        low REAL,
-        close REAL,
-        change REAL,
-        "transaction" INTEGER,
-        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (sid, date)
-    )
-    """)
+    conn = get_conn()
+    conn.execute(STOCK_PRICE_TABLE_SQL)
+    conn.execute(STOCK_PRICE_DATE_INDEX_SQL)
+    conn.commit()
+    create_indicator_table()
+
 
+def create_indicator_table():
+    # 建立技術指標資料表，移除舊版逐筆作廢指標的trigger
+    conn = get_conn()
+    conn.execute(STOCK_INDICATOR_TABLE_SQL)
+    conn.execute(DROP_INDICATOR_TRIGGER_SQL)
     conn.commit()
 
 
 def create_stock_header_table():
     # 建立股票標頭資料表，確認每個月的股票資料是否已經抓取
-    conn.execute("""
-    CREATE TABLE IF NOT EXISTS stock_header (
-        sid TEXT ,
-        month TEXT,
-        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (sid, month)
-    )
-    """)
+    conn = get_conn()
+    conn.execute(STOCK_HEADER_TABLE_SQL)
     conn.commit()
 
 
 def create_TWII_table():
+    conn = get_conn()
     conn.execute("""
     CREATE TABLE IF NOT EXISTS TWII_daily_price (
         date DATE,
@@ -60,10 +219,127 @@ def create_TWII_table():
         PRIMARY KEY (date)
     )
     """)
+    # result_cache用大盤最後更新時間當作資料版本
+    conn.execute("CREATE INDEX IF NOT EXISTS TWII_daily_price_updated_date ON TWII_daily_price (updated_date)")
+    conn.commit()
+
+
+def create_update_status_table():
+    # 記錄每種資料最後一次檢查更新的時間，資料沒有變動(例如假日)也要記錄，避免重複下載
+    conn = get_conn()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS update_status (
+        name TEXT PRIMARY KEY,
+        checked_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+
+
+def create_daily_update_table():
+    # daily_update每天的工作清單與進度，中斷(當機、被限制請求)後重新執行可以從未完成的工作接續
+    conn = get_conn()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS daily_update_task (
+        run_date TEXT NOT NULL,
+        sid TEXT NOT NULL,
+        month TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        rows INTEGER,
+        seconds REAL,
+        error TEXT,
+        updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (run_date, sid, month)
+    ) WITHOUT ROWID
+    """)
     conn.commit()
 
 
+def get_schema_version(db_conn: sqlite3.Connection = None) -> int:
+    db_conn = db_conn or get_conn()
+    version = db_conn.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0 and table_columns('stock_daily_price', db_conn):
+        # 舊版沒有設定user_version
+        return 1
+    return version
+
+
+def table_columns(table: str, db_conn: sqlite3.Connection = None) -> list:
+    # 資料表的欄位名稱，資料表不存在時為空list
+    return [row[1] for row in (db_conn or get_conn()).execute(f'PRAGMA table_info({table})')]
+
+
+def migrate_to_v2(db_conn: sqlite3.Connection = None, vacuum=True):
+    """
+    把舊版(version 1)的stock_daily_price、stock_header原地轉換成version 2，整個轉換在同一個transaction內，
+    失敗時資料庫維持原狀。轉換前建議先備份stock_data.db
+    舊版stock_header若沒有is_full_data欄位，以更新時間是否已過該月判斷資料是否完整
+    :param vacuum: 轉換完是否VACUUM回收舊資料表的空間
+    """
+    db_conn = db_conn or get_conn()
+    if get_schema_version(db_conn) >= 2:
+        return
+    if 'is_full_data' in table_columns('stock_header', db_conn):
+        is_full_data = 'COALESCE(is_full_data, 0)'
+    else:
+        is_full_data = "CASE WHEN strftime('%Y%m', updated_date) > month THEN 1 ELSE 0 END"
+    try:
+        db_conn.execute('BEGIN')
+        db_conn.execute('ALTER TABLE stock_daily_price RENAME TO stock_daily_price_v1')
+        db_conn.execute('ALTER TABLE stock_header RENAME TO stock_header_v1')
+        db_conn.execute(STOCK_PRICE_TABLE_SQL)
+        db_conn.execute(STOCK_HEADER_TABLE_SQL)
+        db_conn.execute("""
+        INSERT OR REPLACE INTO stock_daily_price
+        SELECT sid, CAST(replace(substr(date, 1, 10), '-', '') AS INTEGER), capacity, turnover, previous_close,
+               open, high, low, close, change, "transaction", updated_date
+        FROM stock_daily_price_v1 ORDER BY 1, 2
+        """)
+        db_conn.execute(f"""
+        INSERT OR REPLACE INTO stock_header
+        SELECT sid, month, updated_date, {is_full_data} FROM stock_header_v1 ORDER BY sid, month
+        """)
+        # 資料寫完再建索引比較快
+        db_conn.execute(STOCK_PRICE_DATE_INDEX_SQL)
+        db_conn.execute('DROP TABLE stock_daily_price_v1')
+        db_conn.execute('DROP TABLE stock_header_v1')
+        db_conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        db_conn.commit()
+    except BaseException:
+        db_conn.rollback()
+        raise
+    if vacuum:
+        db_conn.execute('VACUUM')
+
+
+def init_db(db_conn: sqlite3.Connection = None):
+    """
+    建立資料表，舊版資料庫則原地轉換成目前版本
+    get_conn()遇到舊版資料庫會報錯，轉換舊版時要傳入自己開啟的連線，或執行 python create_downloaded_stock_price_db.py
+    """
+    db_conn = db_conn or get_conn()
+    if get_schema_version(db_conn) == 1:
+        print('資料庫為舊版結構，轉換中...')
+        migrate_to_v2(db_conn)
+    db_conn.execute(STOCK_PRICE_TABLE_SQL)
+    db_conn.execute(STOCK_PRICE_DATE_INDEX_SQL)
+    db_conn.execute(STOCK_HEADER_TABLE_SQL)
+    db_conn.execute(STOCK_INDICATOR_TABLE_SQL)
+    db_conn.execute(DROP_INDICATOR_TRIGGER_SQL)
+    db_conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    db_conn.commit()
+
+
 if __name__ == '__main__':
-    create_stock_price_table()
-    create_stock_header_table()
-    create_TWII_table()
+    # python create_downloaded_stock_price_db.py [其他stock_data.db路徑]
+    if len(sys.argv) > 1:
+        init_db(sqlite3.connect(sys.argv[1]))
+    else:
+        # 舊版資料庫要先轉換，不經過get_conn()的版本檢查
+        db_conn = sqlite3.connect(db_file_name)
+        init_db(db_conn)
+        db_conn.close()
+        create_TWII_table()
+        create_update_status_table()
+        create_daily_update_table()
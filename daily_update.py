@@ -0,0 +1,254 @@
+"""
+每日更新: 所有已追蹤(stock_header內有資料)的股票補抓到當月，並更新TWII。
+1. 規劃: 每檔股票從DB內最後一個月份開始，找出沒抓過或不完整且今天還沒抓的月份，連同TWII寫入daily_update_task
+2. TWII: 依DB內最後日期增量更新
+3. 股價: 依優先順序(舊的月份先抓，同月份依代碼)下載，每個月份的股價與進度在同一個transaction寫入
+4. 指標: 已建立指標的股票接續計算
+每完成一個工作就記錄進度，當機或連續失敗(通常是被限制請求)停止後重新執行，只會做今天還沒完成的工作。
+最後印出各階段的筆數與耗時。
+
+使用方式
+python daily_update.py                      # 所有已追蹤的股票
+python daily_update.py --sids 2330 2454 --from-month 202401   # 指定股票，沒抓過的從202401開始
+python daily_update.py --fake --sids 1101 1102               # 使用假資料來源，不會連網
+from daily_update import run_daily_update
+summary = run_daily_update(fetcher_factory=lambda sid: FakeFetcher(), ticker=FakeTicker())
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import List, Callable
+
+import indicator_store
+from batch_downloader import RateLimiter, create_fetchers, fetch_with_retry, plan_missing_months
+from coverage_map import utc_today
+from create_downloaded_stock_price_db import get_conn, init_db, create_daily_update_table, \
+    create_update_status_table
+from get_stock_price_data import get_fetcher, set_fetcher_factory, save_stock_month_data, year_month
+from get_TWII_price import update_TWII_data, set_TWII_ticker_factory
+
+# TWII在工作清單中的代碼
+TWII_TASK = 'TWII'
+STAGES = ['plan', 'TWII', 'fetch', 'db_write', 'indicators']
+
+
+def tracked_sids() -> List[str]:
+    # stock_header內有資料的股票
+    return [row[0] for row in get_conn().execute("SELECT DISTINCT sid FROM stock_header ORDER BY sid")]
+
+
+def plan_tasks(sids: List[str], from_month: str = None, update_TWII=True) -> List[tuple]:
+    """
+    規劃今天要做的工作
+    :param from_month: DB內沒有資料的股票從這個月份(yyyymm)開始，預設為當月
+    :return: [(sid, 月份, 優先順序)]，TWII的月份為空字串、優先順序最前面
+    """
+    today = datetime.today()
+    from_month = from_month or year_month(today.year, today.month)
+    # 每檔股票從最後一個月份開始(不完整的月份要重抓，完整的則從下個月開始)
+    placeholders = ', '.join('?' * len(sids))
+    last_months = dict(get_conn().execute(
+        f"SELECT sid, MAX(month) FROM stock_header WHERE sid IN ({placeholders}) GROUP BY sid", sids).fetchall()) \
+        if sids else {}
+    start_months = {}
+    for sid in sids:
+        start_months.setdefault(last_months.get(sid, from_month), []).append(sid)
+    missing = []
+    for start_month, month_sids in start_months.items():
+        missing.extend(plan_missing_months(month_sids, int(start_month[:4]), int(start_month[4:]),
+                                           today.year, today.month))
+    # 舊的月份先抓，中途停止時每檔股票的資料仍然是連續的
+    missing.sort(key=lambda task: (task[1], task[2], task[0]))
+    tasks = [(TWII_TASK, '', 0)] if update_TWII else []
+    tasks.extend((sid, year_month(year, month), i + 1) for i, (sid, year, month) in enumerate(missing))
+    return tasks
+
+
+def load_pending(run_date: str) -> List[tuple]:
+    # 今天還沒完成的工作，依優先順序
+    return get_conn().execute("SELECT sid, month FROM daily_update_task WHERE run_date = ? AND status != 'done' "
+                              "ORDER BY priority", (run_date,)).fetchall()
+
+
+def mark_task(run_date: str, sid: str, month: str, status: str, rows: int = None, seconds: float = None,
+              error: str = None):
+    # 只執行UPDATE，由呼叫端commit，與資料寫入在同一個transaction
+    get_conn().execute("UPDATE daily_update_task SET status = ?, rows = ?, seconds = ?, error = ?, "
+                       "updated_date = CURRENT_TIMESTAMP WHERE run_date = ? AND sid = ? AND month = ?",
+                       (status, rows, seconds, error, run_date, sid, month))
+
+
+def run_daily_update(sids: List[str] = None, from_month: str = None, max_workers: int = 4,
+                     requests_per_second: float = 0.6, max_retries: int = 3, backoff: float = 2.0,
+                     max_failures: int = 5, fetcher_factory: Callable = None, ticker=None, update_TWII=True,
+                     restart=False, silent=False) -> dict:
+    """
+    執行(或接續)今天的更新
+    :param sids: 要更新的股票，預設為所有已追蹤的股票
+    :param from_month: DB內沒有資料的股票從這個月份(yyyymm)開始，預設為當月
+    :param max_failures: 連續失敗幾個月份就停止(通常是被限制請求)，剩下的工作下次執行再做
+    :param fetcher_factory: 依sid產生fetcher的函式，預設使用set_fetcher_factory設定的來源
+    :param ticker: TWII資料來源，預設使用set_TWII_ticker_factory設定的來源
+    :param restart: 捨棄今天的進度重新規劃
+    :return: {'run_date', 'resumed': 是否接續之前的進度, 'stopped': 是否因連續失敗停止, 'tasks': 今天的工作數,
+        'done', 'failed', 'pending': 各狀態的工作數, 'rows': {階段: 這次寫入筆數}, 'seconds': {階段: 這次耗時}}
+    """
+    start_time = time.perf_counter()
+    fetcher_factory = fetcher_factory or get_fetcher
+    run_date = utc_today()
+    rows = dict.fromkeys(['TWII', 'fetch', 'indicators'], 0)
+    seconds = dict.fromkeys(STAGES, 0.0)
+
+    # 規劃
+    init_db()
+    create_update_status_table()
+    create_daily_update_table()
+    conn = get_conn()
+    if restart:
+        with conn:
+            conn.execute("DELETE FROM daily_update_task WHERE run_date = ?", (run_date,))
+    resumed = conn.execute("SELECT 1 FROM daily_update_task WHERE run_date = ? LIMIT 1",
+                           (run_date,)).fetchone() is not None
+    if not resumed:
+        tasks = plan_tasks(tracked_sids() if sids is None else sids, from_month, update_TWII)
+        with conn:
+            conn.executemany("INSERT INTO daily_update_task (run_date, sid, month, priority) VALUES (?, ?, ?, ?)",
+                             [(run_date, *task) for task in tasks])
+    pending = load_pending(run_date)
+    seconds['plan'] = time.perf_counter() - start_time
+    if not silent:
+        print(f"{'接續' if resumed else '開始'}{run_date}的更新，{len(pending)}個工作")
+
+    # TWII
+    stage_start = time.perf_counter()
+    if (TWII_TASK, '') in pending:
+        pending.remove((TWII_TASK, ''))
+        try:
+            rows['TWII'] = update_TWII_data(ticker=ticker)
+            with conn:
+                # 同check_TWII_data_updated，今天不用再檢查
+                conn.execute("INSERT OR REPLACE INTO update_status (name, checked_date) "
+                             "VALUES ('TWII', CURRENT_TIMESTAMP)")
+                mark_task(run_date, TWII_TASK, '', 'done', rows['TWII'], time.perf_counter() - stage_start)
+        except Exception as e:
+            with conn:
+                mark_task(run_date, TWII_TASK, '', 'failed', error=repr(e))
+            if not silent:
+                print(f'TWII更新失敗，錯誤訊息: {e}')
+    seconds['TWII'] = time.perf_counter() - stage_start
+
+    # 股價: 多個thread下載，這個thread依序寫入
+    stage_start = time.perf_counter()
+    stopped = False
+    updated_sids = set()
+    if pending:
+        today = datetime.today()
+        this_month = year_month(today.year, today.month)
+        fetchers, fetcher_errors = create_fetchers(fetcher_factory, sorted({sid for sid, _ in pending}))
+        if fetcher_errors:
+            # 無法建立fetcher(例如twstock已不再列出的股票)只有該檔失敗，不算在連續失敗內，其他股票照常更新
+            with conn:
+                for sid, month in pending:
+                    if sid in fetcher_errors:
+                        mark_task(run_date, sid, month, 'failed', error=fetcher_errors[sid])
+            if not silent:
+                for sid, error in fetcher_errors.items():
+                    print(f'股票代碼{sid}無法建立fetcher，錯誤訊息: {error}')
+        rate_limiter = RateLimiter(requests_per_second)
+        n_failures = 0
+        queue = iter([task for task in pending if task[0] in fetchers])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+
+            def submit_next():
+                # 依優先順序送出下一個工作，同時進行的工作不超過thread數的兩倍，停止時剩下的留到下次執行
+                task = next(queue, None)
+                if task is not None:
+                    sid, month = task
+                    future = executor.submit(fetch_with_retry, fetchers[sid], sid, int(month[:4]), int(month[4:]),
+                                             rate_limiter, max_retries, backoff)
+                    futures[future] = (sid, month, time.perf_counter())
+
+            for _ in range(max_workers * 2):
+                submit_next()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sid, month, task_start = futures.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        with conn:
+                            mark_task(run_date, sid, month, 'failed', error=repr(e))
+                        if not silent:
+                            print(f'股票代碼{sid} {month}抓取失敗，錯誤訊息: {e}')
+                        n_failures += 1
+                        stopped = stopped or n_failures >= max_failures
+                    else:
+                        n_failures = 0
+                        write_start = time.perf_counter()
+                        save_stock_month_data(sid, month, data, is_full_data=month != this_month, commit=False)
+                        mark_task(run_date, sid, month, 'done', len(data), time.perf_counter() - task_start)
+                        conn.commit()
+                        seconds['db_write'] += time.perf_counter() - write_start
+                        rows['fetch'] += len(data)
+                        updated_sids.add(sid)
+                    if not stopped:
+                        submit_next()
+    seconds['fetch'] = time.perf_counter() - stage_start - seconds['db_write']
+
+    # 指標
+    stage_start = time.perf_counter()
+    for sid in sorted(updated_sids):
+        rows['indicators'] += indicator_store.extend_indicators(sid)
+    seconds['indicators'] = time.perf_counter() - stage_start
+
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM daily_update_task WHERE run_date = ? GROUP BY status",
+                               (run_date,)).fetchall())
+    summary = {'run_date': run_date, 'resumed': resumed, 'stopped': stopped, 'tasks': sum(counts.values()),
+               'done': counts.get('done', 0), 'failed': counts.get('failed', 0),
+               'pending': counts.get('pending', 0), 'rows': rows, 'seconds': seconds}
+    if not silent:
+        print_summary(summary)
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"{summary['run_date']}: 完成{summary['done']}/{summary['tasks']}個工作, 失敗{summary['failed']}, "
+          f"未執行{summary['pending']}" + (', 連續失敗已停止，重新執行可接續' if summary['stopped'] else ''))
+    print(f"{'stage':<12}{'rows':>10}{'秒':>10}")
+    for stage in STAGES:
+        stage_rows = summary['rows'].get(stage)
+        print(f"{stage:<12}{'' if stage_rows is None else stage_rows:>10}{summary['seconds'][stage]:>10.2f}")
+    print(f"{'total':<12}{sum(summary['rows'].values()):>10}{sum(summary['seconds'].values()):>10.2f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='每日更新所有已追蹤股票的當月股價與TWII，中斷後重新執行可接續')
+    parser.add_argument('--sids', nargs='+', help='要更新的股票，預設為所有已追蹤的股票')
+    parser.add_argument('--from-month', help='DB內沒有資料的股票從這個月份(yyyymm)開始，預設為當月')
+    parser.add_argument('--workers', type=int, default=4, help='同時下載的thread數')
+    parser.add_argument('--rps', type=float, default=0.6, help='每秒最多幾次請求，0代表不限制')
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--max-failures', type=int, default=5, help='連續失敗幾個月份就停止')
+    parser.add_argument('--no-twii', action='store_true', help='不更新TWII')
+    parser.add_argument('--restart', action='store_true', help='捨棄今天的進度重新規劃')
+    parser.add_argument('--fake', action='store_true', help='使用FakeFetcher與FakeTicker，不會連網')
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        # 只有離線執行才需要假資料來源
+        from fake_sources import FakeFetcher, FakeTicker
+        fetcher = FakeFetcher()
+        set_fetcher_factory(lambda sid: fetcher)
+        set_TWII_ticker_factory(lambda: FakeTicker(fetcher.end_date))
+    summary = run_daily_update(args.sids, args.from_month, args.workers, args.rps or None, args.max_retries,
+                               max_failures=args.max_failures, update_TWII=not args.no_twii, restart=args.restart)
+    # 還有沒完成的工作時回傳1，排程可以稍後重新執行
+    return 0 if summary['done'] == summary['tasks'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
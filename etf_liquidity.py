@@ -0,0 +1,90 @@
+"""
+多檔ETF一起估算買進成分股對市場流動性的影響:
+ETF購買金額(規模 * 權重)占成分股近N個交易日平均成交金額的比例。
+所有ETF的成分股先去除重複，每檔股票用一次SQL(window function)只讀最後N筆成交金額，
+結果同時列出各ETF的占比與重複成分股加總後的占比。
+
+使用方式
+from etf_liquidity import liquidity_impact
+df = liquidity_impact({'00939': (etf00939_constituent_stocks, 5 * 10 ** 10),
+                       '00940': (etf00940_constituent_stocks, 1.7 * 10 ** 11)}, n_day=5)
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from twstock.codes import codes
+
+from batch_downloader import download_stocks
+from create_downloaded_stock_price_db import get_conn, to_date_int
+
+# 成分股: {股票代碼: (權重%, 股票名稱)}
+ConstituentStocks = Dict[str, Tuple[float, str]]
+# 最近N個交易日換算日曆日時多加的天數，過年連假約10天
+LOOKBACK_BUFFER_DAYS = 20
+
+
+def query_recent_turnover(sids: List[str], n_day: int, as_of: datetime, from_date: datetime = None) \
+        -> Dict[str, Tuple[float, int]]:
+    # window function依日期由新到舊編號，只取每檔股票前n_day筆
+    placeholders = ', '.join('?' * len(sids))
+    rows = get_conn().execute(
+        f"SELECT sid, SUM(turnover), COUNT(*) FROM ("
+        f"SELECT sid, turnover, ROW_NUMBER() OVER (PARTITION BY sid ORDER BY date DESC) AS day_rank "
+        f"FROM stock_daily_price WHERE sid IN ({placeholders}) AND date BETWEEN ? AND ?) "
+        f"WHERE day_rank <= ? GROUP BY sid",
+        (*sids, to_date_int(from_date) if from_date else 0, to_date_int(as_of), n_day)).fetchall()
+    return {sid: (total / count, count) for sid, total, count in rows}
+
+
+def load_recent_turnover(sids: List[str], n_day: int, as_of: datetime = None) -> Dict[str, Tuple[float, int]]:
+    """
+    一次查詢每檔股票as_of當天或之前最後n_day個交易日的平均成交金額
+    :return: {sid: (平均成交金額, 實際筆數)}，DB內沒有資料的股票不會出現
+    """
+    as_of = as_of or datetime.today()
+    # 先只讀最近一段(涵蓋長假)，筆數不足的股票(停牌、上市不久)再讀全部歷史
+    res = query_recent_turnover(sids, n_day, as_of, as_of - timedelta(days=n_day * 2 + LOOKBACK_BUFFER_DAYS))
+    short_sids = [sid for sid in sids if res.get(sid, (0, 0))[1] < n_day]
+    if short_sids:
+        res.update(query_recent_turnover(short_sids, n_day, as_of))
+    return res
+
+
+def liquidity_impact(etfs: Dict[str, Tuple[ConstituentStocks, float]], n_day: int = 5, as_of: datetime = None,
+                     download=False) -> pd.DataFrame:
+    """
+    計算多檔ETF的成分股購入金額占成交金額的比例
+    :param etfs: {ETF名稱: (成分股, ETF購買金額)}
+    :param n_day: 平均最近幾個交易日的成交金額
+    :param as_of: 計算日期，預設為今天
+    :param download: 是否先下載所有成分股最近兩個月缺少的股價(重複的股票只下載一次)
+    :return: index為sid，欄位stock_name, avg_turnover, n_day(實際筆數), n_etf(幾檔ETF持有),
+        每檔ETF的占比(%，沒有持有為nan), total(各ETF購買金額加總的占比%)，依total由大到小排序
+    """
+    names = {}
+    for constituent_stocks, _ in etfs.values():
+        for sid, (_, stock_name) in constituent_stocks.items():
+            names.setdefault(sid, stock_name)
+    sids = sorted(names)
+    if download:
+        today = datetime.today()
+        from_year, from_month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+        download_stocks(sids, from_year, from_month, today.year, today.month, silent=True)
+    turnover = load_recent_turnover(sids, n_day, as_of)
+
+    res = pd.DataFrame(index=pd.Index(sids, name='sid'))
+    res['stock_name'] = [names[sid] or (codes[sid].name if sid in codes else '') for sid in sids]
+    res['avg_turnover'] = [turnover[sid][0] if sid in turnover else float('nan') for sid in sids]
+    res['n_day'] = [turnover[sid][1] if sid in turnover else 0 for sid in sids]
+    res['n_etf'] = 0
+    total_amount = pd.Series(0.0, index=res.index)
+    for etf, (constituent_stocks, cost) in etfs.items():
+        # 同原本cost * weight / 平均成交金額，權重為%，結果即為%
+        amount = pd.Series({sid: cost * weight for sid, (weight, _) in constituent_stocks.items()},
+                           dtype=float).reindex(res.index)
+        res[etf] = amount / res['avg_turnover']
+        res['n_etf'] += amount.notna()
+        total_amount = total_amount.add(amount, fill_value=0)
+    res['total'] = total_amount / res['avg_turnover']
+    return res.sort_values('total', ascending=False, na_position='last')
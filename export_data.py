@@ -0,0 +1,287 @@
+"""
+把股價、TWII與回測結果匯出成CSV(可gzip壓縮)或XLSX，預設存到config的csv_path、xlsx_path。
+資料從cursor每次讀chunk_size筆，邊讀邊寫，XLSX使用openpyxl的write_only模式(寫入暫存檔，不保留整個工作表)，
+匯出全部股票時記憶體也只需要一個chunk的大小。XLSX單一工作表超過上限(1048576列)時自動換到下一個工作表。
+
+使用方式
+python export_data.py stock_daily_price --sids 2330 2454 --from 2020-01-01 --to 2024-12-31 --gzip
+python export_data.py TWII_daily_price --format xlsx
+python export_data.py backtest --sids 2330 2454 --start-dates 2024-01-02 2024-02-01 --test-days 30 60
+from export_data import export_table
+export_table('stock_daily_price', 'csv', sids=['2330'], from_date=datetime(2024, 1, 1))
+"""
+import argparse
+import csv
+import gzip
+import math
+import os
+import sqlite3
+from datetime import datetime
+from typing import List, Iterator, Tuple
+
+from config import csv_path, xlsx_path
+from connection_manager import READER_PRAGMAS, connect_read_only
+from create_downloaded_stock_price_db import db_file_name, to_date_int
+
+# 每次從cursor讀取的筆數，股價約每1000筆5MB記憶體
+CHUNK_SIZE = 2000
+# 每次回測的股票數
+BACKTEST_SID_CHUNK_SIZE = 50
+# XLSX單一工作表的列數上限(含表頭)
+XLSX_MAX_ROWS = 1048576
+# 匯出只循序讀一次，不需要預設的64MB快取與256MB mmap(映射讀過的頁面會算在RSS)
+EXPORT_PRAGMAS = {**READER_PRAGMAS, 'cache_size': -2 * 1024, 'mmap_size': 0}
+
+STOCK_PRICE_COLUMNS = ['sid', 'date', 'capacity', 'turnover', 'previous_close', 'open', 'high', 'low', 'close',
+                       'change', 'transaction']
+# 同get_stock_price_data.PRICE_COLUMNS，transaction是SQL關鍵字要加引號
+STOCK_PRICE_SELECT_COLUMNS = ('sid, date, capacity, turnover, previous_close, open, high, low, close, change, '
+                              '"transaction"')
+TWII_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits', 'previous_close',
+                'change']
+
+
+def date_int_to_str(date_int: int) -> str:
+    # 20240102 -> '2024-01-02'
+    return f'{date_int // 10000:04d}-{date_int // 100 % 100:02d}-{date_int % 100:02d}'
+
+
+def iter_cursor_chunks(cursor, chunk_size: int = CHUNK_SIZE) -> Iterator[list]:
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def open_export_connection(db_file: str = db_file_name) -> sqlite3.Connection:
+    # 匯出用的唯讀連線，快取小、不用mmap
+    return connect_read_only(db_file, EXPORT_PRAGMAS)
+
+
+def stock_price_chunks(db_conn: sqlite3.Connection, sids: List[str] = None, from_date: datetime = None,
+                       to_date: datetime = None, chunk_size: int = CHUNK_SIZE) -> Tuple[List[str], Iterator[list]]:
+    """
+    依(sid, 日期)排序讀取股價
+    :param db_conn: 讀取用的連線，通常為open_export_connection()
+    :param sids: None為全部股票
+    :return: (欄位, chunk iterator)，日期轉為'yyyy-mm-dd'
+    """
+    sql = f"SELECT {STOCK_PRICE_SELECT_COLUMNS} FROM stock_daily_price WHERE date BETWEEN ? AND ?"
+    params = [to_date_int(from_date) if from_date else 0, to_date_int(to_date) if to_date else 99999999]
+    if sids is not None:
+        sql += f" AND sid IN ({', '.join('?' * len(sids))})"
+        params.extend(sids)
+    cursor = db_conn.execute(sql + " ORDER BY sid, date", params)
+
+    def chunks():
+        for rows in iter_cursor_chunks(cursor, chunk_size):
+            yield [(row[0], date_int_to_str(row[1]), *row[2:]) for row in rows]
+
+    return STOCK_PRICE_COLUMNS, chunks()
+
+
+def TWII_chunks(db_conn: sqlite3.Connection, from_date: datetime = None, to_date: datetime = None,
+                chunk_size: int = CHUNK_SIZE) -> Tuple[List[str], Iterator[list]]:
+    # TWII的日期本來就是'yyyy-mm-dd'
+    cursor = db_conn.execute(
+        f"SELECT {', '.join(TWII_COLUMNS)} FROM TWII_daily_price WHERE date BETWEEN ? AND ? ORDER BY date",
+        (from_date.strftime('%Y-%m-%d') if from_date else '0000-00-00',
+         to_date.strftime('%Y-%m-%d') if to_date else '9999-99-99'))
+    return TWII_COLUMNS, iter_cursor_chunks(cursor, chunk_size)
+
+
+def backtest_chunks(sids: List[str], start_dates, sid_chunk_size: int = BACKTEST_SID_CHUNK_SIZE,
+                    download_missing=False, **backtest_kwargs) -> Tuple[List[str], Iterator[list]]:
+    """
+    每次用panel_backtest回測sid_chunk_size檔股票，結果邊算邊匯出
+    :param download_missing: 是否先下載DB內缺少的月份，預設只用DB內已有的資料，匯出不會連網與寫入DB
+    :param backtest_kwargs: 傳給panel_backtest，例如test_day_list、n_daily_average
+    :return: (欄位, chunk iterator)，日期轉為'yyyy-mm-dd'，nan為空值
+    """
+    # panel_backtest會載入pandas，在這裡才import
+    from panel_backtest import panel_backtest
+    import pandas as pd
+
+    columns = ['sid', 'start_date', 'day', 'real_start_date', 'start_price', 'real_date', 'price', 'day_range',
+               'metric', 'taiex_metric', 'adj_metric']
+
+    def to_cell(value):
+        if isinstance(value, (pd.Timestamp, datetime)):
+            return None if pd.isna(value) else value.strftime('%Y-%m-%d')
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        return value
+
+    def chunks():
+        for i in range(0, len(sids), sid_chunk_size):
+            df = panel_backtest(sids[i:i + sid_chunk_size], start_dates, download_missing=download_missing,
+                                **backtest_kwargs)
+            yield [tuple(to_cell(value) for value in row) for row in df[columns].itertuples(index=False)]
+
+    return columns, chunks()
+
+
+class CsvSink:
+    """
+    逐chunk寫入CSV，compress為True時用gzip壓縮(壓縮等級6，預設的9慢一倍、檔案只小一點)
+    """
+
+    def __init__(self, path: str, compress=False):
+        self.file = gzip.open(path, 'wt', compresslevel=6, newline='', encoding='utf_8') if compress \
+            else open(path, 'w', newline='', encoding='utf_8')
+        self.writer = csv.writer(self.file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+
+    def write_header(self, columns: List[str]):
+        self.writer.writerow(columns)
+
+    def write_rows(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxSink:
+    """
+    用openpyxl write_only模式逐chunk寫入XLSX，每列寫入後即寫到暫存檔，記憶體不會隨列數增加
+    """
+
+    def __init__(self, path: str, sheet_name: str):
+        # openpyxl只有匯出XLSX才需要，在這裡才import
+        from openpyxl import Workbook
+        self.path = path
+        self.sheet_name = sheet_name[:28]
+        self.workbook = Workbook(write_only=True)
+        self.columns = None
+        self.sheet = None
+        self.sheet_rows = 0
+        self.n_sheets = 0
+
+    def _new_sheet(self):
+        # 第二個工作表起名稱加上編號
+        self.n_sheets += 1
+        title = self.sheet_name if self.n_sheets == 1 else f'{self.sheet_name}_{self.n_sheets}'
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.append(self.columns)
+        self.sheet_rows = 1
+
+    def write_header(self, columns: List[str]):
+        self.columns = columns
+        self._new_sheet()
+
+    def write_rows(self, rows: list):
+        for row in rows:
+            if self.sheet_rows >= XLSX_MAX_ROWS:
+                self._new_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+def default_path(name: str, fmt: str, compress=False) -> str:
+    if fmt == 'xlsx':
+        return f'{xlsx_path}{name}.xlsx'
+    return f"{csv_path}{name}.csv{'.gz' if compress else ''}"
+
+
+def write_chunks(columns: List[str], chunks: Iterator[list], fmt: str, path: str, name: str,
+                 compress=False) -> int:
+    """
+    把chunk依序寫入檔案，先寫暫存檔，全部寫完才取代原本的檔案，中途失敗不會留下不完整的檔案
+    :param fmt: 'csv'或'xlsx'
+    :return: 寫入筆數
+    """
+    if fmt not in ('csv', 'xlsx'):
+        raise ValueError('fmt只能為"csv"或"xlsx"')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    sink = CsvSink(tmp_path, compress) if fmt == 'csv' else XlsxSink(tmp_path, name)
+    n_rows = 0
+    try:
+        try:
+            sink.write_header(columns)
+            for rows in chunks:
+                sink.write_rows(rows)
+                n_rows += len(rows)
+        finally:
+            sink.close()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return n_rows
+
+
+def export_table(table: str, fmt: str = 'csv', path: str = None, sids: List[str] = None,
+                 from_date: datetime = None, to_date: datetime = None, compress=False,
+                 chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    匯出stock_daily_price或TWII_daily_price
+    :param path: 預設為csv_path或xlsx_path下的"資料表名稱.csv(.gz)/.xlsx"
+    :param sids: 只匯出這些股票(stock_daily_price)，None為全部
+    :param compress: CSV是否gzip壓縮
+    :return: 匯出筆數
+    """
+    if table not in ('stock_daily_price', 'TWII_daily_price'):
+        raise ValueError('table只能為"stock_daily_price"或"TWII_daily_price"')
+    db_conn = open_export_connection()
+    try:
+        if table == 'stock_daily_price':
+            columns, chunks = stock_price_chunks(db_conn, sids, from_date, to_date, chunk_size)
+        else:
+            columns, chunks = TWII_chunks(db_conn, from_date, to_date, chunk_size)
+        return write_chunks(columns, chunks, fmt, path or default_path(table, fmt, compress), table, compress)
+    finally:
+        db_conn.close()
+
+
+def export_backtest(sids: List[str], start_dates, fmt: str = 'csv', path: str = None, compress=False,
+                    sid_chunk_size: int = BACKTEST_SID_CHUNK_SIZE, download_missing=False, **backtest_kwargs) -> int:
+    """
+    分批回測並匯出結果，欄位同panel_backtest
+    :param download_missing: 是否先下載DB內缺少的月份，預設不下載
+    :return: 匯出筆數
+    """
+    columns, chunks = backtest_chunks(sids, start_dates, sid_chunk_size, download_missing, **backtest_kwargs)
+    return write_chunks(columns, chunks, fmt, path or default_path('backtest', fmt, compress), 'backtest', compress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='匯出股價、TWII或回測結果成CSV/XLSX')
+    parser.add_argument('source', choices=['stock_daily_price', 'TWII_daily_price', 'backtest'])
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--gzip', action='store_true', help='CSV用gzip壓縮')
+    parser.add_argument('--output', help='輸出檔案，預設存到config的csv_path或xlsx_path')
+    parser.add_argument('--sids', nargs='+', help='只匯出這些股票，預設為全部(回測時必填)')
+    parser.add_argument('--from', dest='from_date', help='開始日期yyyy-mm-dd')
+    parser.add_argument('--to', dest='to_date', help='結束日期yyyy-mm-dd')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='每次讀取的筆數')
+    parser.add_argument('--start-dates', nargs='+', help='回測的開始日期yyyy-mm-dd')
+    parser.add_argument('--test-days', nargs='+', type=int, help='回測的測試天數')
+    parser.add_argument('--n-daily-average', type=int, default=5)
+    parser.add_argument('--download-missing', action='store_true', help='回測前先下載DB內缺少的月份')
+    args = parser.parse_args(argv)
+
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+    if args.source == 'backtest':
+        if not args.sids or not args.start_dates:
+            parser.error('回測需要--sids與--start-dates')
+        n_rows = export_backtest(args.sids, args.start_dates, args.format, args.output, args.gzip,
+                                 download_missing=args.download_missing, test_day_list=args.test_days,
+                                 n_daily_average=args.n_daily_average)
+    else:
+        n_rows = export_table(args.source, args.format, args.output, args.sids, parse_date(args.from_date),
+                              parse_date(args.to_date), args.gzip, args.chunk_size)
+    print(f'匯出{n_rows}筆')
+
+
+if __name__ == '__main__':
+    main()
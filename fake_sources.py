@@ -0,0 +1,150 @@
+"""
+不連網的假資料來源，給benchmark與離線測試使用
+FakeFetcher: 模擬twstock的TWSEFetcher/TPEXFetcher
+FakeTicker: 模擬yfinance的Ticker('^TWII')
+fake_universe: 取得n檔股票代碼
+"""
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, date
+
+import numpy as np
+from twstock.codes import codes
+from twstock.stock import DATATUPLE
+
+# 假股價從這天開始產生
+FAKE_START_DATE = date(2000, 1, 3)
+
+
+def fake_universe(n: int):
+    """
+    取前n檔twstock.codes內的股票代碼，MyStock初始化會檢查代碼是否存在，所以假資料也用真的代碼
+    """
+    return sorted(code for code, info in codes.items() if info.type == '股票')[:n]
+
+
+class _PricePath:
+    """
+    依sid產生固定(可重現)的隨機漫步股價，每個平日都是交易日
+    """
+
+    def __init__(self, sid: str, end_date: date):
+        rng = np.random.default_rng(zlib.crc32(sid.encode()))
+        days = np.arange(np.datetime64(FAKE_START_DATE), np.datetime64(end_date) + 1)
+        days = days[np.is_busday(days)]
+        base_price = rng.uniform(10, 500)
+        close = np.round(base_price * np.exp(np.cumsum(rng.normal(0, 0.015, len(days)))), 2)
+        self.days = days
+        self.close = close
+        self.spread = np.round(close * rng.uniform(0, 0.03, len(days)), 2)
+        self.capacity = rng.integers(1_000, 5_000_000, len(days))
+        self.transaction = rng.integers(10, 20_000, len(days))
+
+    def month_data(self, year: int, month: int):
+        month_start = np.datetime64(f'{year}-{month:02d}-01')
+        lo = np.searchsorted(self.days, month_start)
+        hi = np.searchsorted(self.days, month_start + np.timedelta64(31, 'D'))
+        res = []
+        for i in range(lo, hi):
+            day = self.days[i].astype(object)
+            if day.month != month:
+                break
+            close = float(self.close[i])
+            previous_close = float(self.close[i - 1]) if i > 0 else close
+            spread = float(self.spread[i])
+            capacity = int(self.capacity[i])
+            # 以昨收當作開盤價
+            res.append(DATATUPLE(datetime(day.year, day.month, day.day), capacity, int(capacity * close),
+                                 previous_close, round(max(previous_close, close) + spread, 2),
+                                 round(min(previous_close, close) - spread, 2), close,
+                                 round(close - previous_close, 2), int(self.transaction[i]), ''))
+        return res
+
+
+class FakeFetcher:
+    """
+    模擬twstock fetcher，fetch(year, month, sid)回傳格式與twstock相同
+    stock = MyStock('2330', initial_fetch=False)
+    stock.fetcher = FakeFetcher()
+    """
+
+    def __init__(self, end_date: date = None, latency: float = 0.0, fail_rate: float = 0.0, seed: int = 0):
+        """
+        :param end_date: 假資料最後一天，預設為今天
+        :param latency: 每次fetch模擬的網路延遲(秒)
+        :param fail_rate: 每次fetch丟出ConnectionError的機率，用來測試重試
+        :param seed: 失敗機率的亂數種子
+        """
+        self.end_date = end_date if end_date is not None else date.today()
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self._rng = random.Random(seed)
+        self._paths = {}
+        self._lock = threading.Lock()
+        self.fetch_count = 0
+
+    def price_path(self, sid: str) -> _PricePath:
+        with self._lock:
+            if sid not in self._paths:
+                self._paths[sid] = _PricePath(sid, self.end_date)
+            return self._paths[sid]
+
+    def fetch(self, year: int, month: int, sid: str, retry: int = 5):
+        with self._lock:
+            self.fetch_count += 1
+            failed = self._rng.random() < self.fail_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise ConnectionError(f'FakeFetcher模擬連線失敗: {sid} {year}/{month}')
+        return {'stat': 'OK', 'data': self.price_path(sid).month_data(year, month)}
+
+
+class FakeTicker:
+    """
+    模擬yfinance.Ticker('^TWII')，history回傳的DataFrame格式與yfinance相同(index為台北時區的Date)
+    可調整end_date模擬之後新增的交易日
+    set_TWII_ticker_factory(lambda: FakeTicker())
+    """
+
+    def __init__(self, end_date: date = None, symbol: str = '^TWII'):
+        """
+        :param end_date: 假資料最後一天，預設為今天
+        """
+        self.end_date = end_date if end_date is not None else date.today()
+        # 先產生到今天(或end_date)的完整股價，調整end_date時歷史資料不變
+        self._path = _PricePath(symbol, max(self.end_date, date.today()))
+        self.history_count = 0
+        self.row_count = 0
+
+    def history(self, period: str = None, start: str = None, end: str = None):
+        """
+        :param period: 'max'或None，start為None時回傳全部資料
+        :param start: 'yyyy-mm-dd'，包含當天
+        :param end: 'yyyy-mm-dd'，不包含當天
+        """
+        import pandas as pd
+
+        path = self._path
+        mask = path.days <= np.datetime64(self.end_date)
+        if start is not None:
+            mask &= path.days >= np.datetime64(start)
+        if end is not None:
+            mask &= path.days < np.datetime64(end)
+        indexes = np.flatnonzero(mask)
+        close = path.close[indexes]
+        previous_close = path.close[np.maximum(indexes - 1, 0)]
+        spread = path.spread[indexes]
+        self.history_count += 1
+        self.row_count += len(indexes)
+        return pd.DataFrame({
+            'Open': previous_close,
+            'High': np.round(np.maximum(previous_close, close) + spread, 2),
+            'Low': np.round(np.minimum(previous_close, close) - spread, 2),
+            'Close': close,
+            'Volume': path.capacity[indexes],
+            'Dividends': 0.0,
+            'Stock Splits': 0.0,
+        }, index=pd.DatetimeIndex(path.days[indexes], name='Date').tz_localize('Asia/Taipei'))
@@ -1,51 +1,260 @@
-import pandas as pd
-import yfinance as yf
+import math
+import threading
+import time
+from datetime import datetime
 
-from create_downloaded_stock_price_db import conn, create_TWII_table
+import numpy as np
 
+from create_downloaded_stock_price_db import get_conn, create_TWII_table, create_update_status_table
+from instrumentation import timer, timed
 
-# 確認是否有TWII的table，若沒有則建立一個
-def update_TWII_data(start_date, all_data=False):
-    # start_date = '2024-05-22'
-    # 確認start_date是否為str and yyyy-mm-dd格式
-    if not all_data:
+
+# TWII_daily_price由來源下載的欄位
+TWII_SOURCE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+
+def default_TWII_ticker():
+    # yfinance載入很慢，只有需要線上更新時才import
+    import yfinance as yf
+    return yf.Ticker('^TWII')
+
+
+# 產生TWII資料來源的函式，回傳的物件需有history(period=None, start=None)方法(同yfinance.Ticker)
+# 離線測試可換成fake_sources.FakeTicker
+_twii_ticker_factory = default_TWII_ticker
+
+
+def set_TWII_ticker_factory(ticker_factory=None):
+    """
+    設定TWII資料來源，None為恢復使用yfinance
+    """
+    global _twii_ticker_factory
+    _twii_ticker_factory = ticker_factory or default_TWII_ticker
+
+
+def download_TWII_rows(ticker, start_date: str = None) -> list:
+    """
+    下載TWII資料
+    :param start_date: 'yyyy-mm-dd'(包含當天)，None為全部歷史資料
+    :return: (date, open, high, low, close, volume, dividends, stock_splits) list，依日期排序。
+        沒有收盤價(nan)的資料列不回傳，沒有成交量時volume為None
+    """
+    df = ticker.history(period='max') if start_date is None else ticker.history(start=start_date)
+    if df.empty:
+        return []
+    dates = df.index.strftime('%Y-%m-%d').tolist()
+    values = df[TWII_SOURCE_COLUMNS].to_numpy(dtype=float).tolist()
+    # 盤中或假日yfinance可能回傳價格或成交量為nan的資料列
+    return [(date, open_price, high, low, close, None if math.isnan(volume) else int(volume), dividends, stock_splits)
+            for date, (open_price, high, low, close, volume, dividends, stock_splits) in zip(dates, values)
+            if not math.isnan(close)]
+
+
+def update_TWII_data(start_date: str = None, all_data=False, ticker=None) -> int:
+    """
+    以DB內最新的日期為watermark增量更新TWII資料:
+    只下載watermark當天(確認最後一筆有沒有變動，例如盤中抓到的價格)之後的資料，
+    previous_close與change由DB內前一天的收盤價接續計算，只寫入新增或有變動的資料列。
+    所有寫入在同一個transaction內，其他連線讀取時不會看到寫到一半的資料。
+    :param start_date: 'yyyy-mm-dd'，從這天(或更早的watermark)開始重新下載，None為從watermark開始
+    :param all_data: 是否重新下載全部歷史資料
+    :param ticker: 資料來源，None為使用set_TWII_ticker_factory設定的來源(預設yfinance)
+    :return: 新增或變動的筆數
+    """
+    global _twii_index
+    if start_date is not None and not all_data:
+        # 確認start_date是否為str and yyyy-mm-dd格式
         if not isinstance(start_date, str):
             raise ValueError('start_date必須為str的yyyy-mm-dd格式, 例如: "2021-01-01"')
-        if len(start_date) != 10:
+        if len(start_date) != 10 or start_date[4] != '-' or start_date[7] != '-':
             raise ValueError('start_date格式必須為yyyy-mm-dd')
-        if start_date[4] != '-' or start_date[7] != '-':
-            raise ValueError('start_date格式必須為yyyy-mm-dd')
-
-    data = yf.Ticker('^TWII')
+    create_TWII_table()
+    conn = get_conn()
+    ticker = ticker or _twii_ticker_factory()
+    watermark = conn.execute("SELECT MAX(date) FROM TWII_daily_price").fetchone()[0]
     if all_data:
-        df = data.history(period='max')
-    else:
-        # 多抓幾天的資料，才可以算出change
-        start_date = pd.to_datetime(start_date)
-        start_date = start_date - pd.DateOffset(days=10)
-        start_date = start_date.strftime('%Y-%m-%d')
-        df = data.history(start=start_date, end=None)
-
-    df = df.reset_index(drop=False)
-    df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-    # 用前一天的收盤價來當作基準價
-    df['previous_close'] = df['Close'].shift(1)
-    df['change'] = df['Close'] - df['previous_close']
-
-    # 沒有change的資料踢掉，因為沒抓前一天的資料
-    df = df.dropna(subset=['change'])
-
-    # 比db內最晚的時間還要早的替除掉，避免重複
-    if not all_data:
-        # 剔除DB內這次更新的資料
-        min_df_date = min(df['Date'])
-        conn.execute(f"DELETE FROM TWII_daily_price WHERE date >= '{min_df_date}'")
-
-    df.columns = ['date', 'open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits', 'previous_close',
-                  'change']
-    df.to_sql('TWII_daily_price', conn, if_exists='append', index=False)
+        watermark = None
+    elif start_date is not None and watermark is not None:
+        watermark = min(start_date, watermark)
+    with timer('fetch_TWII') as t:
+        rows = download_TWII_rows(ticker, watermark)
+        t.set_rows(rows)
+    if not rows:
+        return 0
+    first_date = rows[0][0]
+    stored = {row[0]: row[1:] for row in conn.execute(
+        "SELECT date, open, high, low, close, volume, dividends, stock_splits, previous_close FROM TWII_daily_price "
+        "WHERE date >= ?", (first_date,))}
+    previous_row = conn.execute("SELECT close FROM TWII_daily_price WHERE date < ? ORDER BY date DESC LIMIT 1",
+                                (first_date,)).fetchone()
+    previous_close = previous_row[0] if previous_row else None
+    upsert_rows = []
+    for row in rows:
+        close = row[4]
+        # 沒有前一天收盤價(全部歷史的第一筆)無法算change，不存入
+        if previous_close is not None:
+            record = (*row, previous_close)
+            if stored.get(row[0]) != record[1:]:
+                upsert_rows.append((*record, close - previous_close))
+        previous_close = close
+    if upsert_rows:
+        with conn:
+            conn.executemany("""
+            INSERT INTO TWII_daily_price (date, open, high, low, close, volume, dividends, stock_splits,
+                                          previous_close, change)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (date) DO UPDATE SET
+                open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close,
+                volume = excluded.volume, dividends = excluded.dividends, stock_splits = excluded.stock_splits,
+                previous_close = excluded.previous_close, change = excluded.change, updated_date = CURRENT_TIMESTAMP
+            """, upsert_rows)
+        # 記憶體內的TWII資料作廢，下次查詢重新載入
+        _twii_index = None
+    return len(upsert_rows)
+
+
+def check_TWII_data_updated() -> bool:
+    """
+    確認資料是不是最新的，今天(UTC，同updated_date)還沒檢查過則增量更新
+    :return: 是否有更新
+    """
+    create_update_status_table()
+    conn = get_conn()
+    checked = conn.execute("SELECT 1 FROM update_status WHERE name = 'TWII' "
+                           "AND checked_date >= date('now', 'start of day')").fetchone()
+    if checked is not None:
+        return False
+    n_updated = update_TWII_data()
+    conn.execute("INSERT OR REPLACE INTO update_status (name, checked_date) VALUES ('TWII', CURRENT_TIMESTAMP)")
+    conn.commit()
+    return n_updated > 0
+
+
+class TWIIIndex:
+    """
+    依日期排序、一次載入記憶體的TWII資料，用二分搜尋找出指定日期當天或之前最近的交易日(as-of)
+    day_keys: 交易日(datetime.toordinal)
+    close: 收盤價
+    rows: 原始資料列，欄位順序同TWII_daily_price
+    """
+    __slots__ = ('day_keys', 'close', 'rows')
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.day_keys = np.fromiter((to_day_key(row[0]) for row in rows), dtype=np.int64, count=len(rows))
+        self.close = np.array([row[4] for row in rows], dtype=float)
+
+    @classmethod
+    def load(cls):
+        with timer('TWII_load') as t:
+            rows = get_conn().execute("SELECT * FROM TWII_daily_price ORDER BY date").fetchall()
+            t.set_rows(rows)
+        return cls(rows)
+
+    def asof_index(self, day_keys) -> np.ndarray:
+        """
+        每個日期當天或之前最近一個交易日的位置，沒有則為-1
+        """
+        return np.searchsorted(self.day_keys, day_keys, side='right') - 1
 
+    def asof(self, day_key: int) -> tuple:
+        i = int(np.searchsorted(self.day_keys, day_key, side='right')) - 1
+        if i < 0:
+            raise ValueError(f'{datetime.fromordinal(day_key).strftime("%Y-%m-%d")}之前沒有TWII資料')
+        return self.rows[i]
 
+
+# 多久檢查一次TWII資料是否為最新(秒)，None代表每個session只檢查一次
+TWII_CHECK_TTL = 60 * 60
+_twii_index = None
+_twii_checked_time = None
+_twii_lock = threading.Lock()
+
+
+def to_day_key(date) -> int:
+    """
+    'yyyy-mm-dd'字串或datetime轉為整數日(datetime.toordinal)
+    """
+    if isinstance(date, str):
+        return datetime.fromisoformat(date[:10]).toordinal()
+    return date.toordinal()
+
+
+def reset_TWII_index():
+    # 資料有更新時，下次查詢重新載入
+    global _twii_index, _twii_checked_time
+    with _twii_lock:
+        _twii_index = None
+        _twii_checked_time = None
+
+
+def skip_TWII_update_check():
+    """
+    之後不再檢查TWII資料是否為最新，唯讀的worker process不能更新資料，由主process先檢查
+    """
+    global TWII_CHECK_TTL, _twii_checked_time
+    with _twii_lock:
+        TWII_CHECK_TTL = None
+        _twii_checked_time = time.monotonic()
+
+
+def get_TWII_index() -> TWIIIndex:
+    """
+    取得載入記憶體的TWII資料，是否為最新的檢查每TWII_CHECK_TTL秒最多一次
+    """
+    global _twii_index, _twii_checked_time
+    with _twii_lock:
+        now = time.monotonic()
+        if _twii_checked_time is None or (TWII_CHECK_TTL is not None and now - _twii_checked_time > TWII_CHECK_TTL):
+            if check_TWII_data_updated():
+                _twii_index = None
+            _twii_checked_time = now
+        if _twii_index is None:
+            _twii_index = TWIIIndex.load()
+        return _twii_index
+
+
+@timed('TWII')
+def get_TWII_close_array():
+    """
+    全部TWII收盤價，給需要大量查詢大盤價格的向量化計算使用
+    :return: (交易日陣列(datetime.toordinal), 收盤價陣列)，依日期排序
+    """
+    twii_index = get_TWII_index()
+    return twii_index.day_keys, twii_index.close
+
+
+@timed('TWII')
+def get_TWII_close_batch(dates) -> np.ndarray:
+    """
+    一次查詢多個日期的TWII收盤價，若單天沒有開盤，則用之前最近一個交易日
+    :param dates: 'yyyy-mm-dd'字串、datetime或整數日(datetime.toordinal)的list
+    """
+    twii_index = get_TWII_index()
+    day_keys = np.fromiter((date if isinstance(date, (int, np.integer)) else to_day_key(date) for date in dates),
+                           dtype=np.int64)
+    indexes = twii_index.asof_index(day_keys)
+    if (indexes < 0).any():
+        raise ValueError('查詢日期早於最早的TWII資料')
+    return twii_index.close[indexes]
+
+
+@timed('TWII')
+def get_TWII_data_batch(dates) -> list:
+    """
+    一次查詢多個日期的TWII資料，回傳資料列同get_TWII_data
+    :param dates: 'yyyy-mm-dd'字串、datetime或整數日(datetime.toordinal)的list
+    """
+    twii_index = get_TWII_index()
+    day_keys = np.fromiter((date if isinstance(date, (int, np.integer)) else to_day_key(date) for date in dates),
+                           dtype=np.int64)
+    indexes = twii_index.asof_index(day_keys)
+    if (indexes < 0).any():
+        raise ValueError('查詢日期早於最早的TWII資料')
+    return [twii_index.rows[i] for i in indexes.tolist()]
+
+
+@timed('TWII')
 def get_TWII_data(date):  # date = '2024-05-26'
     """
     取得指定日期的TWII資料，若單天沒有開盤(沒資料)，則往前找到有資料的日期。
@@ -65,14 +274,6 @@ def get_TWII_data(date):  # date = '2024-05-26'
     :param date:
     :return:
     """
-    # 先確認資料是不是最新的，若不是則更新
-    latest_updated_date = conn.execute("SELECT MAX(updated_date) FROM TWII_daily_price").fetchone()[0]
-    # 轉為時間格式
-    latest_updated_date = pd.to_datetime(latest_updated_date)
-    # 用年月日比較，若更新日期是今天以前，則更新
-    if latest_updated_date.strftime('%Y-%m-%d') < pd.Timestamp.now().strftime('%Y-%m-%d'):
-        update_TWII_data(latest_updated_date.strftime('%Y-%m-%d'))
-
     # 檢查date是否為str and yyyy-mm-dd格式
     if not isinstance(date, str):
         raise ValueError('date必須為str的yyyy-mm-dd格式, 例如: "2021-01-01"')
@@ -81,49 +282,14 @@ def get_TWII_data(date):  # date = '2024-05-26'
         raise ValueError('date格式必須為yyyy-mm-dd')
     if date[4] != '-' or date[7] != '-':
         raise ValueError('date格式必須為yyyy-mm-dd')
-    # 該天可能沒有資料應該是沒有開市，若發生該情況就往前找
-    while 1:
-        res = conn.execute(f"SELECT * FROM TWII_daily_price WHERE date = '{date}'").fetchall()
-        if res:
-            break
-        date = pd.to_datetime(date)
-        date = date - pd.DateOffset(days=1)
-        date = date.strftime('%Y-%m-%d')
-    return res[0]
+    # 該天可能沒有資料應該是沒有開市，若發生該情況就用之前最近一個交易日
+    return get_TWII_index().asof(to_day_key(date))
 
 
 # 測試用: 刪除TWII_daily_price
 # conn.execute("DROP TABLE TWII_daily_price")
 
 if __name__ == '__main__':
-    # 確認是否有TWII的table，若沒有則建立一個
-    if 'TWII_daily_price' not in [table[0] for table in
-                                  conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]:
-        print('TWII_daily_price不存在')
-        # 若TWII_daily_price不存在，則建立一個
-        create_TWII_table()
-        print('TWII_daily_price已建立')
-        # 初次更新TWII資料，更新所有資料
-        update_TWII_data(None, all_data=True)
-
-    else:
-        print('TWII_daily_price存在')
-        # 確認TWII_daily_price內最新的日期
-        latest_date = conn.execute("SELECT MAX(date) FROM TWII_daily_price").fetchone()[0]
-        print('TWII_daily_price最新日期:', latest_date)
-
-        # 加一天
-        latest_date = pd.to_datetime(latest_date)
-        latest_date = latest_date + pd.DateOffset(days=1)
-        latest_date = latest_date.strftime('%Y-%m-%d')
-
-        # 確認是否晚於今天
-        if latest_date > pd.Timestamp.now().strftime('%Y-%m-%d'):
-            print('TWII資料已經是最新的了')
-        else:
-            # 更新TWII資料
-            print('更新TWII資料:', latest_date)
-            update_TWII_data(latest_date)
-    print('TWII資料更新完成')
-
-    get_TWII_data('2024-06-02')
+    # 第一次執行(沒有資料)會下載全部歷史資料，之後只更新新的資料
+    print(f'TWII資料更新{update_TWII_data()}筆')
+    print(get_TWII_data('2024-06-02'))
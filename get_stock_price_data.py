@@ -1,27 +1,118 @@
 import time
 from collections import namedtuple
+from itertools import groupby
 from datetime import datetime, timedelta
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Tuple, Iterator
 
-import numpy as np
-import pandas as pd
 from twstock import Stock
 from twstock.codes import codes
+from twstock.stock import DATA_FETCHER
 
-from create_downloaded_stock_price_db import conn
+from coverage_map import load_coverage, month_ranges
+from create_downloaded_stock_price_db import get_conn, to_date_int, from_date_int
 from get_TWII_price import get_TWII_data
+import indicator_store
+from instrumentation import timer, timed
+from price_cache import price_cache
+import result_cache
+import return_engine
+
+
+def default_fetcher_factory(sid: str):
+    # 依股票上市或上櫃選擇twstock的fetcher
+    return DATA_FETCHER[codes[sid].data_source]()
+
+
+# 依sid產生線上抓取用fetcher的函式，MyStock與batch_downloader沒有指定fetcher時使用
+# 離線測試可換成lambda sid: FakeFetcher()
+_fetcher_factory = default_fetcher_factory
+
+
+def set_fetcher_factory(fetcher_factory=None):
+    """
+    設定預設的fetcher來源，None為恢復使用twstock
+    """
+    global _fetcher_factory
+    _fetcher_factory = fetcher_factory or default_fetcher_factory
+
+
+def get_fetcher(sid: str):
+    return _fetcher_factory(sid)
 
 
 def year_month(year, month):
     return ''.join([str(year), str(month).zfill(2)])
 
 
+def month_date_range(year_month_str: str) -> Tuple[int, int]:
+    # 月份的整數日期範圍，例如'202401' -> (20240100, 20240199)，用主鍵(sid, date)範圍查詢
+    return int(year_month_str) * 100, int(year_month_str) * 100 + 99
+
+
+# stock_daily_price寫入的欄位
+PRICE_COLUMNS = 'sid, date, capacity, turnover, previous_close, open, high, low, close, change, "transaction"'
+# 讀取成DATATUPLE2順序的欄位，month由整數日期算出
+PRICE_SELECT_COLUMNS = ('sid, CAST(date / 100 AS TEXT), date, capacity, turnover, previous_close, open, high, low, '
+                        'close, change, "transaction"')
+
+
+def save_stock_month_data(sid: str, year_month_str: str, fetch_data: list, is_full_data: bool, commit=True):
+    """
+    將線上抓到的單月股價存入DB，header與每日股價在同一個transaction內寫入
+    :param sid: 股票代碼
+    :param year_month_str: 月份，例如'202401'
+    :param fetch_data: twstock fetcher回傳的data(DATATUPLE list)
+    :param is_full_data: 該月資料是否完整，當月資料抓不完整，下次要再抓一次
+    :param commit: 是否寫完馬上commit，大量回補時設為False，由呼叫端最後統一commit
+    """
+    conn = get_conn()
+    with timer('db_write') as t:
+        # 存入DB header，若key存在要更新日期
+        conn.execute("INSERT OR REPLACE INTO stock_header (sid, month, updated_date, is_full_data) "
+                     "VALUES (?, ?, CURRENT_TIMESTAMP, ?)",
+                     (sid, year_month_str, 1 if is_full_data else 0))
+        # 存入DB stock_daily_price，日期存整數yyyymmdd
+        conn.executemany(
+            f"INSERT OR REPLACE INTO stock_daily_price ({PRICE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(sid, to_date_int(data.date), data.capacity, data.turnover, data.close - data.change, data.open,
+              data.high, data.low, data.close, data.change, data.transaction) for data in fetch_data])
+        # 這批最早日期之後的指標作廢，與股價在同一個transaction
+        if fetch_data:
+            indicator_store.invalidate_indicators(sid, min(to_date_int(data.date) for data in fetch_data), conn)
+        if commit:
+            conn.commit()
+        t.set_rows(fetch_data)
+    # 該月資料重抓了，快取作廢
+    price_cache.invalidate(sid, year_month_str)
+
+
 DATATUPLE2 = namedtuple('Data',
                         ['sid', 'month', 'date', 'capacity', 'turnover', 'previous_close', 'open', 'high', 'low',
                          'close', 'change', 'transaction'])
-today = datetime.today()
-cur_month = today.month
-cur_year = today.year
+
+
+def to_datatuple(row: tuple) -> DATATUPLE2:
+    # PRICE_SELECT_COLUMNS順序的資料列轉為DATATUPLE2
+    return DATATUPLE2(row[0], row[1], from_date_int(row[2]), *row[3:])
+
+
+# 分批的key: 每月或每年
+BATCH_KEY = {
+    'month': lambda row: row[1],
+    'year': lambda row: row[1][:4],
+}
+
+
+def iter_db_batches(cursor, batch: str = 'month') -> Iterator[List[DATATUPLE2]]:
+    """
+    把依日期排序、PRICE_SELECT_COLUMNS順序的cursor逐批(每月或每年)轉成DATATUPLE2 list，
+    資料由cursor逐筆讀取，記憶體內只保留目前這一批
+    :param batch: 'month'或'year'
+    """
+    if batch not in BATCH_KEY:
+        raise ValueError(f"batch必須為{list(BATCH_KEY)}其中之一")
+    for _, rows in groupby(cursor, key=BATCH_KEY[batch]):
+        yield [to_datatuple(row) for row in rows]
 
 
 class MyStock(Stock):
@@ -43,10 +134,21 @@ class MyStock(Stock):
     transaction: 成交筆數。
     """
 
-    def __init__(self, sid: str, initial_fetch: bool = True, silent=False):
+    @timed('init')
+    def __init__(self, sid: str, initial_fetch: bool = True, silent=False, db_first=False, fetcher=None):
+        """
+        :param initial_fetch: 是否在初始化時讀取近兩個月的股價
+        :param db_first: DB優先模式，DB內已有的當月資料(即使不是今天抓的)直接使用，只有DB沒有或不完整的過去月份
+            才線上抓取，適合不需要當天最新股價、大量建立MyStock的情境
+        :param fetcher: 線上抓取用的fetcher，預設使用set_fetcher_factory設定的來源(twstock)，離線測試可換成FakeFetcher
+        """
         start_time = datetime.now()
+        self.db_first = db_first
         try:
-            super().__init__(sid, initial_fetch)
+            super().__init__(sid, initial_fetch=False)
+            self.fetcher = fetcher if fetcher is not None else get_fetcher(sid)
+            if initial_fetch:
+                self.fetch_31()
         except Exception as e:
 
             raise Exception(f'股票代碼{sid}初始化失敗，錯誤訊息: {e}')
@@ -59,62 +161,159 @@ class MyStock(Stock):
         before = today - timedelta(days=60)
         self.fetch_from_to(before.year, before.month, today.year, today.month)
 
-    def fetch_from_to(self, from_year: int, from_month: int, to_year: int, to_month: int):
+    @timed('fetch_from_to')
+    def fetch_from_to(self, from_year: int, from_month: int, to_year: int, to_month: int, bulk_load: bool = False):
         """
         抓取指定月份區間的股價資料
+        先用快取，其餘月份由stock_header一次建立CoverageMap找出需要線上抓取的月份，
+        抓完後每段連續月份只用一次範圍查詢從DB讀回
+        :param bulk_load: 大量回補模式，整段區間的寫入放在同一個transaction，最後只commit一次。
+            回補多年資料時使用，預設為每個月commit一次。
         """
+        conn = get_conn()
+        # 每次呼叫重新取得今天，長時間執行的程式跨日後當月判斷仍正確
+        today = datetime.today()
+        this_month = year_month(today.year, today.month)
         self.raw_data = []
         self.data = []
-        for year, month in self._month_year_iter(from_month, from_year, to_month, to_year):
-
-            # 是否為抓取當前月份
-            is_this_month = year == cur_year and month == cur_month
-            year_month_str = year_month(year, month)
-            # 是否抓過該月完整資料，或是今天已經抓過
-            update_price_date = not self.check_stock_data_in_db(year_month_str)
-            # (沒抓過該月資料或是該月資料抓不全)且當天還沒抓過，就要去線上抓取，否則從DB取出資料。
-            if update_price_date:
+        month_list = [(year, month, year_month(year, month))
+                      for year, month in self._month_year_iter(from_month, from_year, to_month, to_year)]
+        # 已經讀過的月份直接用快取，不用再查DB
+        month_rows = {}
+        for _, _, year_month_str in month_list:
+            cache_entry = price_cache.get(self.sid, year_month_str)
+            if cache_entry is not None:
+                month_rows[year_month_str] = cache_entry.rows
+        uncached = [year_month_str for _, _, year_month_str in month_list if year_month_str not in month_rows]
+
+        # 這次寫入DB的月份，失敗rollback時要一併剔除快取
+        written_months = []
+        try:
+            if uncached:
+                self._fetch_missing_months(month_list, uncached, this_month, written_months, commit=not bulk_load)
+                # 從DB取出資料，每段連續月份一次範圍查詢
+                for start_month, end_month in month_ranges(uncached):
+                    with timer('db_read') as t:
+                        rows = conn.execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price "
+                                            f"WHERE sid = ? AND date BETWEEN ? AND ? ORDER BY date",
+                                            (self.sid, month_date_range(start_month)[0],
+                                             month_date_range(end_month)[1])).fetchall()
+                        t.set_rows(rows)
+                    with timer('parse') as t:
+                        for data in rows:
+                            month_rows.setdefault(data[1], []).append(self.to_datatuple(data))
+                        t.set_rows(rows)
+                # 放入快取，當月資料只在今天有效，沒有資料的月份也要放，避免重複查詢
+                for year_month_str in uncached:
+                    # db_first沒有重抓的當月資料可能是之前抓的不完整資料，不放入所有MyStock共用的快取
+                    if self.db_first and year_month_str == this_month and year_month_str not in written_months:
+                        continue
+                    price_cache.put(self.sid, year_month_str, month_rows.setdefault(year_month_str, []),
+                                    is_full_data=year_month_str != this_month)
+        except BaseException:
+            # 寫到一半失敗，未commit的部分全部放棄，避免header寫入但股價沒寫完
+            conn.rollback()
+            for year_month_str in written_months:
+                price_cache.invalidate(self.sid, year_month_str)
+            raise
+        if bulk_load:
+            conn.commit()
+        # 有新的股價寫入，已建立的技術指標接續計算
+        if written_months:
+            indicator_store.extend_indicators(self.sid)
+
+        for _, _, year_month_str in month_list:
+            self.data.extend(month_rows[year_month_str])
+        return self.data
+
+    def _fetch_missing_months(self, month_list: List[tuple], months: List[str], this_month: str,
+                              written_months: List[str], commit=True):
+        """
+        months中(沒抓過該月資料或是該月資料抓不全)且當天還沒抓過的月份，線上抓取後寫入DB
+        :param month_list: (年, 月, 月份字串) list
+        :param written_months: 寫入DB的月份會加到這個list，給呼叫端失敗時剔除快取
+        """
+        # 只讀取需要檢查的月份範圍
+        coverage = load_coverage(self.sid, min(months), max(months))
+        missing = set(coverage.missing_months(months, partial_ok=[this_month] if self.db_first else ()))
+        for year, month, year_month_str in month_list:
+            if year_month_str not in missing:
+                continue
+            with timer('fetch') as t:
                 new_fetch_data = self.fetcher.fetch(year, month, self.sid)
                 new_fetch_data = new_fetch_data['data']
-                # 存入DB header，若key存在要更新日期
-                # 當月抓取當月資料可能會抓不完整，故要記錄起來，下次抓取該閱資料時，需要在抓取一次
-                conn.execute(
-                    f"INSERT OR REPLACE INTO stock_header VALUES ('{self.sid}', '{year_month_str}', CURRENT_TIMESTAMP,{0 if is_this_month else 1})")
-                conn.commit()
-                # 存入DB stock_daily_price
-                for data in new_fetch_data:
-                    conn.execute(
-                        f"INSERT OR REPLACE INTO stock_daily_price VALUES ('{self.sid}', '{year_month_str}', "
-                        f"'{data.date}', {data.capacity}, {data.turnover}, {data.close - data.change}, {data.open}, "
-                        f"{data.high}, {data.low}, {data.close}, {data.change}, {data.transaction}, CURRENT_TIMESTAMP)")
-                    conn.commit()
-            # 從DB取出資料
-            res = conn.execute(
-                f"SELECT * FROM stock_daily_price WHERE sid = '{self.sid}' AND month = '{year_month_str}'")
-            self.purify_data(res.fetchall())
+                t.set_rows(new_fetch_data)
+            # 當月抓取當月資料可能會抓不完整，故要記錄起來，下次抓取該月資料時，需要在抓取一次
+            save_stock_month_data(self.sid, year_month_str, new_fetch_data, is_full_data=year_month_str != this_month,
+                                  commit=commit)
+            written_months.append(year_month_str)
+
+    def _prepare_range(self, from_year: int, from_month: int, to_year: int, to_month: int,
+                       fetch_missing=True) -> Tuple[int, int]:
+        """
+        需要時先線上抓取DB缺少的月份，回傳整段月份區間的整數日期範圍，給直接從DB範圍讀取的方法使用
+        """
+        month_list = [(year, month, year_month(year, month))
+                      for year, month in self._month_year_iter(from_month, from_year, to_month, to_year)]
+        if not month_list:
+            return 0, -1
+        months = [year_month_str for _, _, year_month_str in month_list]
+        if fetch_missing:
+            today = datetime.today()
+            written_months = []
+            try:
+                self._fetch_missing_months(month_list, months, year_month(today.year, today.month), written_months)
+            except BaseException:
+                get_conn().rollback()
+                for year_month_str in written_months:
+                    price_cache.invalidate(self.sid, year_month_str)
+                raise
+        return month_date_range(months[0])[0], month_date_range(months[-1])[1]
+
+    def iter_batches(self, from_year: int, from_month: int, to_year: int, to_month: int, batch: str = 'month',
+                     fetch_missing=True) -> Iterator[List[DATATUPLE2]]:
+        """
+        逐批(每月或每年)產生指定月份區間的股價，直接從DB cursor讀取，不放進self.data與快取，
+        長期歷史資料也只會在記憶體保留一批，搭配price_stream的滾動計算使用
+        :param batch: 'month'或'year'
+        :param fetch_missing: 是否先線上抓取DB缺少的月份，False為只讀DB
+        :return: generator，每次產生一批依日期排序的DATATUPLE2 list
+        """
+        from_date_key, to_date_key = self._prepare_range(from_year, from_month, to_year, to_month, fetch_missing)
+        cursor = get_conn().execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price "
+                                    f"WHERE sid = ? AND date BETWEEN ? AND ? ORDER BY date",
+                                    (self.sid, from_date_key, to_date_key))
+        yield from iter_db_batches(cursor, batch)
 
-        return self.data
+    def fetch_series(self, from_year: int, from_month: int, to_year: int, to_month: int, fetch_missing=True):
+        """
+        抓取指定月份區間的股價成PriceSeries(每個欄位一個numpy陣列)，一次範圍查詢讀出，不產生DATATUPLE2，
+        不放進self.data與快取
+        :param fetch_missing: 是否先線上抓取DB缺少的月份，False為只讀DB
+        :return: PriceSeries
+        """
+        # price_series會import本模組，在這裡才import避免循環import
+        from price_series import PriceSeries
+        from_date_key, to_date_key = self._prepare_range(from_year, from_month, to_year, to_month, fetch_missing)
+        with timer('db_read') as t:
+            rows = get_conn().execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price "
+                                      f"WHERE sid = ? AND date BETWEEN ? AND ? ORDER BY date",
+                                      (self.sid, from_date_key, to_date_key)).fetchall()
+            t.set_rows(rows)
+        return PriceSeries.from_db_rows(self.sid, rows)
+
+    def to_series(self):
+        # 目前self.data轉成PriceSeries
+        from price_series import PriceSeries
+        return PriceSeries.from_datatuples(self.sid, self.data)
 
     def purify_data(self, db_data: List[tuple]):
         # 轉成datatuple
         self.data.extend([self.to_datatuple(data) for data in db_data])
 
     def to_datatuple(self, sub_db_data: tuple):
-        tmp_dict = {
-            'sid': sub_db_data[0],
-            'month': sub_db_data[1],
-            'date': datetime.strptime(sub_db_data[2], '%Y-%m-%d %H:%M:%S'),
-            'capacity': sub_db_data[3],
-            'turnover': sub_db_data[4],
-            'previous_close': sub_db_data[5],
-            'open': sub_db_data[6],
-            'high': sub_db_data[7],
-            'low': sub_db_data[8],
-            'close': sub_db_data[9],
-            'change': sub_db_data[10],
-            'transaction': sub_db_data[11]
-        }
-        return DATATUPLE2(**tmp_dict)
+        # sub_db_data為PRICE_SELECT_COLUMNS順序的資料列
+        return to_datatuple(sub_db_data)
 
     def get_target_date_n_daily_average_price(self, target_date: datetime, n_daily_average: int, soft=True):
         """
@@ -124,8 +323,23 @@ class MyStock(Stock):
         :param soft: 是否使用軟性搜尋，若為True，則會往前找到有資料的日期，若為False，則會直接回傳None
         stock = MyStock('2330')
         stock.get_target_date_n_daily_average_price(datetime(year=2024, month=2, day=25), 60)
+        1日與5/20/60日均價直接查指標表，不會載入股價到self.data，之後的to_df()、price不是這段期間的資料，
+        需要時請另外呼叫fetch_from_to
         """
 
+        # 1日(收盤價)與5/20/60日均價直接查指標表，不用載入整段股價再計算
+        if indicator_store.supports(n_daily_average):
+            pre_month = target_date - timedelta(days=n_daily_average * 3)
+            from_date_key, _ = self._prepare_range(pre_month.year, pre_month.month, target_date.year,
+                                                   target_date.month)
+            res = indicator_store.average_price_asof(self.sid, [target_date], n_daily_average)
+            # 3倍N天內沒有資料或資料不足N日時，照原本的做法往前找或報錯
+            if res is not None and res[0][1] is not None and to_date_int(res[0][0]) >= from_date_key:
+                price, real_date = res[0][1], res[0][0]
+                if real_date != target_date and not soft:
+                    return None, None
+                return price, real_date
+
         n_day_plus = 3
 
         while n_day_plus<60:
@@ -146,11 +360,16 @@ class MyStock(Stock):
         if self.data[-1].date != target_date and not soft:
             return None, None
 
-        return self.moving_average(self.price, n_daily_average)[-1], self.data[-1].date
+        with timer('moving_average'):
+            average_price = self.moving_average(self.price, n_daily_average)[-1]
+        return average_price, self.data[-1].date
 
     def get_taiex_performance(self, target_date: datetime, n_daily_average: int, soft=True):
         pass
 
+    @timed('cal_return')
+    @result_cache.cached('cal_return', uses_taiex=lambda arguments: arguments['adjust_by_taiex'],
+                         last_date=result_cache.cal_return_last_date)
     def cal_return(self, start_cal_return_date: datetime, n_daily_average=5,
                    test_day_list: List[int] = [10, 30, 60, 120, 180, 360], evaluation_metric='ROI', silent=False,
                    adjust_by_taiex=False) -> Dict[str, Union[float, None]]:
@@ -176,74 +395,55 @@ class MyStock(Stock):
         # 確認時間格式
         assert isinstance(start_cal_return_date, datetime)
 
-        start_stock_price, real_start_cal_return_date = self.get_target_date_n_daily_average_price(
-            start_cal_return_date,
-            n_daily_average)
+        # 一次載入整段股價，所有測試天數一起計算
+        res = return_engine.cal_horizon_returns(self, start_cal_return_date, n_daily_average, test_day_list,
+                                                evaluation_metric, adjust_by_taiex)
+        start_stock_price, real_start_cal_return_date = res.start_price, res.real_start_date
         if not silent:
             print(f'開始回測股票SID : {self.sid}')
             print(
                 f'    起始日期: {real_start_cal_return_date}, 起始股價: {start_stock_price}, N日均價: {n_daily_average}日')
         result_dict = {}
-        for i in test_day_list:
-            test_date = start_cal_return_date + timedelta(days=i)
-            if test_date > datetime.today():
+        for horizon in res.horizons:
+            i = horizon.day
+            if horizon.price is None:
                 if not silent:
-                    print(f'    測試日期: {test_date}超過今天，無法進行測試')
+                    print(f'    測試日期: {horizon.test_date}超過今天，無法進行測試')
                 result_dict[str(i)] = None
                 if adjust_by_taiex:
                     result_dict[str(i) + '_adj'] = None
                 continue
-            test_stock_price, real_end_cal_return_date = self.get_target_date_n_daily_average_price(test_date,
-                                                                                                    n_daily_average)
-
-            day_range = (real_end_cal_return_date - real_start_cal_return_date).days
-            if evaluation_metric == 'IRR':
-                metric = ((test_stock_price / start_stock_price) ** (365 / day_range) - 1) * 100
-                metric = round(metric, 2)
-            elif evaluation_metric == 'ROI':
-                metric = ((test_stock_price / start_stock_price) - 1) * 100
-                metric = round(metric, 2)
-            else:
-                raise ValueError('evaluation_metric只能為"ROI"或"IRR"')
-
-            result_dict[str(i)] = metric
+            result_dict[str(i)] = horizon.metric
             # 是否用大盤進行校正
             if adjust_by_taiex:
-                # 計算大盤報酬率
-                # 開始日期的大盤價格，這個日期是股票有資料的日期，理論上大盤也會有。4是收盤價
-                taiex_start_price = get_TWII_data(real_start_cal_return_date.strftime('%Y-%m-%d'))[4]
-                taiex_end_price = get_TWII_data(real_end_cal_return_date.strftime('%Y-%m-%d'))[4]
-                # 計算大盤報酬率
-                if evaluation_metric == 'IRR':
-                    taiex_metric = ((taiex_end_price / taiex_start_price) ** (365 / day_range) - 1) * 100
-                    taiex_metric = round(taiex_metric, 2)
-                elif evaluation_metric == 'ROI':
-                    taiex_metric = ((taiex_end_price / taiex_start_price) - 1) * 100
-                    taiex_metric = round(taiex_metric, 2)
-                # 扣去大盤報酬率
-                adjust_metric = metric - taiex_metric
-                result_dict[str(i) + '_adj'] = round(adjust_metric, 2)
+                result_dict[str(i) + '_adj'] = horizon.adj_metric
 
             if not silent:
+                test_stock_price = horizon.price
                 print(
-                    f"    測試日期: {real_end_cal_return_date}(經過{day_range}天), "
+                    f"    測試日期: {horizon.real_date}(經過{horizon.day_range}天), "
                     f"測試股價: {test_stock_price}, "
                     f"起始股價: {start_stock_price}, "
                     f"漲跌幅: {(test_stock_price / start_stock_price - 1) * 100:.2f}%,"
-                    f"年均報酬率: {metric:.2f}%")
+                    f"年均報酬率: {horizon.metric:.2f}%")
 
         return result_dict
 
     def to_df(self):
-        # 轉成dataframe
+        # 轉成dataframe，pandas載入很慢，用到時才import
+        import pandas as pd
         return pd.DataFrame(self.data)
 
-    def check_stock_data_in_db(self, year_month_str: str) -> bool:  # sid = '2330'; year_month_str = '202301'
-        # 確認該股票該月份是否已經完整抓取過或是當天已經抓過了
-        res = conn.execute(
-            f"SELECT * FROM stock_header WHERE sid = '{self.sid}' AND month = '{year_month_str}' and (is_full_data = 1 or updated_date >= date('now', 'start of day'))")
+    def check_stock_data_in_db(self, year_month_str: str, allow_partial=False) -> bool:
+        # sid = '2330'; year_month_str = '202301'
+        # 確認該股票該月份是否已經完整抓取過或是當天已經抓過了，allow_partial為True時只要抓過就算
+        res = get_conn().execute(
+            "SELECT 1 FROM stock_header WHERE sid = ? AND month = ? "
+            "and (is_full_data = 1 or updated_date >= date('now', 'start of day') or ?)",
+            (self.sid, year_month_str, 1 if allow_partial else 0))
         return res.fetchone() is not None
 
+    @timed('recent_fluctuation')
     def recent_fluctuation(self, days_list: List[int] = [5, 10, 30, 60, 120]):
         """
         往回看，最近n日的漲跌幅
@@ -277,22 +477,18 @@ class MyStock(Stock):
     def cal_periodic_returns(self, start_date: datetime, end_date: datetime, interval: int = 1):
         """
         計算一段時間內的週期性報酬率，主要用於計算beta值
+        股價與大盤各只載入一次，用陣列一次算出每期報酬
         :param start_date: 開始日期
         :param end_date: 結束日期
         :param interval: 計算間隔
-        :return:
+        :return: [(股票報酬, 大盤報酬), ...]
         """
-        res = []
-        # 計算回測報酬率
-        while start_date < end_date and start_date + timedelta(days=interval) < today:
-            # 計算回測報酬率
-            stock_return = self.cal_return(start_date, n_daily_average=1, test_day_list=[interval], silent=True)[
-                str(interval)]
-            taiex_return = self.cal_taiex_return(start_date, start_date + timedelta(days=interval))
-            res.append((stock_return, taiex_return))
-            start_date += timedelta(days=interval)
-        return res
+        _, stock_returns, taiex_returns = return_engine.cal_periodic_returns(self, start_date, end_date, interval)
+        return list(zip(stock_returns, taiex_returns))
 
+    @timed('cal_beta')
+    @result_cache.cached('cal_beta', uses_taiex=lambda arguments: True,
+                         last_date=lambda arguments: arguments['end_date'])
     def cal_beta(self, start_date: datetime, end_date: datetime, interval: int = 1):
         """
         計算beta值
@@ -301,14 +497,21 @@ class MyStock(Stock):
         :param interval: 計算間隔
         :return:
         """
-        # 計算週期性報酬率
-        periodic_returns = self.cal_periodic_returns(start_date, end_date, interval)
-        # 計算beta值
-        stock_returns = [tmp[0] for tmp in periodic_returns]
-        taiex_returns = [tmp[1] for tmp in periodic_returns]
-        # 計算beta值
-        beta = np.cov(stock_returns, taiex_returns)[0][1] / np.var(taiex_returns)
-        return beta
+        return return_engine.cal_beta(self, start_date, end_date, interval)
+
+    @timed('cal_rolling_beta')
+    def cal_rolling_beta(self, start_date: datetime, end_date: datetime, interval: int = 1, window: int = 60):
+        """
+        計算滾動beta、相關係數與alpha
+        :param start_date: 開始日期
+        :param end_date: 結束日期
+        :param interval: 計算間隔
+        :param window: 滾動視窗期數
+        :return: DataFrame，欄位stock_return, taiex_return, beta, correlation, alpha
+        stock = MyStock('2330')
+        stock.cal_rolling_beta(datetime.today() - timedelta(days=365 * 3), datetime.today(), interval=7, window=52)
+        """
+        return return_engine.cal_rolling_beta(self, start_date, end_date, interval, window)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,192 @@
+"""
+技術指標表stock_indicator: 每檔股票每個交易日的5/20/60日均價、5/20日平均成交金額與日報酬率。
+第一次使用時整段歷史向量化計算，之後只從沒有指標的日子接續計算(往前多讀60筆當作視窗)。
+save_stock_month_data寫入股價時，每批一次讓該批最早日期之後的指標作廢，MyStock、batch_downloader、daily_update
+都經過這裡，不會讀到過期的指標；不經過save_stock_month_data直接寫入股價的程式要自己呼叫invalidate_indicators。
+N日均價變成一次索引查詢，不用每次載入整段股價重算。
+
+使用方式
+from indicator_store import average_price_asof, load_indicators
+average_price_asof('2330', [datetime(2024, 1, 5), datetime(2024, 2, 5)], 20)  # [(實際交易日, 20日均價), ...]
+load_indicators('2330', datetime(2024, 1, 1), datetime(2024, 6, 30))['ma60']
+"""
+import sqlite3
+from datetime import datetime
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+from create_downloaded_stock_price_db import get_conn, to_date_int, from_date_int, create_indicator_table
+from instrumentation import timer
+from return_engine import rolling_sum
+
+MA_WINDOWS = (5, 20, 60)
+TURNOVER_WINDOWS = (5, 20)
+INDICATOR_COLUMNS = ['ma5', 'ma20', 'ma60', 'turnover_ma5', 'turnover_ma20', 'daily_return']
+# 均價同twstock的moving_average四捨五入到小數第二位，其他欄位不四捨五入
+ROUND_COLUMNS = {'ma5', 'ma20', 'ma60'}
+# 接續計算時，往前需要的股價筆數
+LOOKBACK = max(MA_WINDOWS) - 1
+# 確認過指標是最新的股票: {sid: (連線, 當時的PRAGMA data_version)}
+# 其他連線寫入後data_version會改變，同一條連線寫入股價則由invalidate_indicators移除
+_fresh = {}
+
+
+def supports(n_daily_average: int) -> bool:
+    # N日均價是否可以直接查詢(1日為收盤價)
+    return n_daily_average == 1 or n_daily_average in MA_WINDOWS
+
+
+def compute_indicators(close: np.ndarray, turnover: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    向量化計算指標，筆數不足或視窗內有沒成交(nan)的日子為nan
+    :param close: 依日期排序的收盤價，沒成交為nan
+    :param turnover: 成交金額
+    :return: {欄位: 陣列}，均價未四捨五入
+    """
+    # rolling_sum由左往右相加，結果與moving_average的sum(list[-n:])相同
+    res = {f'ma{n}': rolling_sum(close, n) / n for n in MA_WINDOWS}
+    res.update({f'turnover_ma{n}': rolling_sum(turnover, n) / n for n in TURNOVER_WINDOWS})
+    daily_return = np.full(len(close), np.nan)
+    daily_return[1:] = close[1:] / close[:-1] - 1
+    res['daily_return'] = daily_return
+    return res
+
+
+def to_db_column(values: np.ndarray, column: str) -> list:
+    # nan存成NULL，均價用python round(同moving_average)
+    if column in ROUND_COLUMNS:
+        return [None if value != value else round(value, 2) for value in values.tolist()]
+    return [None if value != value else value for value in values.tolist()]
+
+
+def refresh_indicators(sid: str) -> int:
+    """
+    把指標補到DB內股價的最後一天
+    :return: 這次計算寫入的筆數，已是最新為0
+    """
+    conn = get_conn()
+    price_max, indicator_max = conn.execute(
+        "SELECT (SELECT MAX(date) FROM stock_daily_price WHERE sid = ?), "
+        "(SELECT MAX(date) FROM stock_indicator WHERE sid = ?)", (sid, sid)).fetchone()
+    if price_max is None or price_max == indicator_max:
+        return 0
+    watermark = indicator_max or 0
+    with timer('indicator_build') as t:
+        context = conn.execute("SELECT date, close, turnover FROM stock_daily_price WHERE sid = ? AND date <= ? "
+                               "ORDER BY date DESC LIMIT ?", (sid, watermark, LOOKBACK)).fetchall()[::-1]
+        new_rows = conn.execute("SELECT date, close, turnover FROM stock_daily_price WHERE sid = ? AND date > ? "
+                                "ORDER BY date", (sid, watermark)).fetchall()
+        rows = context + new_rows
+        # None(沒成交)轉為nan
+        close = np.array([row[1] for row in rows], dtype=float)
+        turnover = np.array([row[2] for row in rows], dtype=float)
+        indicators = compute_indicators(close, turnover)
+        columns = [to_db_column(indicators[column][len(context):], column) for column in INDICATOR_COLUMNS]
+        records = [(sid, row[0], *values) for row, values in zip(new_rows, zip(*columns))]
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO stock_indicator (sid, date, {', '.join(INDICATOR_COLUMNS)}) "
+                             f"VALUES (?, ?, {', '.join('?' * len(INDICATOR_COLUMNS))})", records)
+        t.set_rows(records)
+    return len(records)
+
+
+def invalidate_indicators(sid: str, from_date_key: int, db_conn: sqlite3.Connection = None):
+    """
+    股價寫入後，from_date_key(整數日期)之後的指標作廢，下次使用時從該天接續計算。只執行DELETE，由呼叫端commit
+    """
+    _fresh.pop(sid, None)
+    try:
+        (db_conn or get_conn()).execute("DELETE FROM stock_indicator WHERE sid = ? AND date >= ?",
+                                        (sid, from_date_key))
+    except sqlite3.OperationalError as e:
+        # 還沒有指標表，不用作廢
+        if 'no such table' not in str(e):
+            raise
+
+
+def ensure_indicators(sid: str) -> bool:
+    """
+    確認指標是最新的，上次確認後資料庫沒有變動時不用再查詢
+    :return: 是否可以使用指標表，唯讀連線(parallel_runner的worker)無法補算時為False
+    """
+    conn = get_conn()
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    fresh = _fresh.get(sid)
+    if fresh is not None and fresh[0] is conn and fresh[1] == data_version:
+        return True
+    try:
+        refresh_indicators(sid)
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            return False
+        # 舊資料庫還沒有指標表
+        try:
+            create_indicator_table()
+            refresh_indicators(sid)
+        except sqlite3.OperationalError:
+            return False
+    _fresh[sid] = (conn, data_version)
+    return True
+
+
+def extend_indicators(sid: str) -> int:
+    """
+    股價有新寫入後接續計算指標，只處理已經建立過指標的股票，還沒用過的等第一次查詢時再整段計算
+    :return: 計算寫入的筆數
+    """
+    try:
+        if get_conn().execute("SELECT 1 FROM stock_indicator WHERE sid = ? LIMIT 1", (sid,)).fetchone() is None:
+            return 0
+        return refresh_indicators(sid)
+    except sqlite3.OperationalError:
+        # 沒有指標表或唯讀連線，之後查詢時再處理
+        return 0
+
+
+def average_price_asof(sid: str, target_dates: List[datetime], n_daily_average: int) \
+        -> List[Tuple[datetime, float]]:
+    """
+    各目標日期當天或之前最近一個交易日的N日均價，每個日期一次索引查詢
+    :param n_daily_average: 1(收盤價)或MA_WINDOWS
+    :return: [(實際交易日, N日均價)]，之前沒有資料為(None, None)，資料不足N日為(交易日, None)。
+        不支援的N或無法補算指標時回傳None
+    """
+    if n_daily_average == 1:
+        sql = "SELECT date, close FROM stock_daily_price WHERE sid = ? AND date <= ? ORDER BY date DESC LIMIT 1"
+    elif n_daily_average in MA_WINDOWS and ensure_indicators(sid):
+        sql = (f"SELECT date, ma{n_daily_average} FROM stock_indicator WHERE sid = ? AND date <= ? "
+               f"ORDER BY date DESC LIMIT 1")
+    else:
+        return None
+    conn = get_conn()
+    res = []
+    with timer('indicator_read'):
+        for target_date in target_dates:
+            row = conn.execute(sql, (sid, to_date_int(target_date))).fetchone()
+            if row is None:
+                res.append((None, None))
+            else:
+                # 同moving_average(price, 1)
+                price = row[1] if n_daily_average > 1 or row[1] is None else round(row[1], 2)
+                res.append((from_date_int(row[0]), price))
+    return res
+
+
+def load_indicators(sid: str, from_date: datetime = None, to_date: datetime = None) -> Dict[str, np.ndarray]:
+    """
+    一次讀取日期區間內的所有指標
+    :return: {'date': datetime64陣列, 欄位: float陣列(NULL為nan)}，無法補算指標時回傳None
+    """
+    # price_series會import get_stock_price_data(會import本模組)，在這裡才import避免循環import
+    from price_series import date_ints_to_datetime64
+    if not ensure_indicators(sid):
+        return None
+    rows = get_conn().execute(
+        f"SELECT date, {', '.join(INDICATOR_COLUMNS)} FROM stock_indicator WHERE sid = ? AND date BETWEEN ? AND ? "
+        f"ORDER BY date", (sid, to_date_int(from_date) if from_date else 0,
+                           to_date_int(to_date) if to_date else 99999999)).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * (len(INDICATOR_COLUMNS) + 1)
+    res = {'date': date_ints_to_datetime64(columns[0])}
+    res.update({column: np.array(values, dtype=float) for column, values in zip(INDICATOR_COLUMNS, columns[1:])})
+    return res
@@ -0,0 +1,299 @@
+"""
+各階段的計數與計時: twstock線上抓取(fetch)、SQLite讀寫(db_read/db_write)、資料列轉DATATUPLE2(parse)、
+均價計算(moving_average)、TWII查詢(TWII/TWII_load)，記錄次數、筆數、bytes(估計值)與耗時分布。
+預設關閉，關閉時每個量測點只多一次函式呼叫。
+
+使用方式
+import instrumentation
+instrumentation.enable()  # 或enable(log_sink=JsonLinesSink('stages.jsonl'))，每次量測寫一行JSON
+MyStock('2330').cal_return(datetime(2024, 1, 5))
+print(instrumentation.stats.report())
+instrumentation.stats.get('db_read').seconds
+
+# 找出某個方法慢在哪個函式(cProfile或取樣)
+with instrumentation.profile(mode='sampling'):
+    stock.cal_beta(datetime(2021, 1, 1), datetime.today(), interval=7)
+"""
+import cProfile
+import functools
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from price_cache import estimate_size
+
+# 耗時分布的上界(秒)，最後一格為超過1秒
+HISTOGRAM_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+HISTOGRAM_LABELS = ('<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '>=1s')
+
+_enabled = False
+_log_sink = None
+
+
+class StageStats:
+    """
+    單一階段的累計結果
+    """
+    __slots__ = ('calls', 'rows', 'bytes', 'seconds', 'max_seconds', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, seconds: float, rows: int, nbytes: int):
+        self.calls += 1
+        self.rows += rows
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if seconds < bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def to_dict(self) -> dict:
+        return {'calls': self.calls, 'rows': self.rows, 'bytes': self.bytes, 'seconds': round(self.seconds, 6),
+                'max_seconds': round(self.max_seconds, 6),
+                'histogram': dict(zip(HISTOGRAM_LABELS, self.histogram))}
+
+
+class Stats:
+    """
+    所有階段的累計結果，可同時被多個thread記錄
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, rows: int = 0, nbytes: int = 0):
+        with self._lock:
+            stage_stats = self._stages.get(stage)
+            if stage_stats is None:
+                stage_stats = self._stages[stage] = StageStats()
+            stage_stats.add(seconds, rows, nbytes)
+
+    def get(self, stage: str) -> StageStats:
+        # 沒有記錄過的階段回傳全為0的結果
+        with self._lock:
+            return self._stages.get(stage) or StageStats()
+
+    def snapshot(self) -> dict:
+        # {階段: {calls, rows, bytes, seconds, max_seconds, histogram}}
+        with self._lock:
+            return {stage: stage_stats.to_dict() for stage, stage_stats in self._stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def report(self) -> str:
+        lines = [f'{"stage":<16}{"calls":>8}{"rows":>10}{"MB":>9}{"秒":>10}{"平均ms":>10}  分布']
+        for stage, res in sorted(self.snapshot().items(), key=lambda item: -item[1]['seconds']):
+            histogram = ' '.join(f'{label}:{count}' for label, count in res['histogram'].items() if count)
+            lines.append(f'{stage:<16}{res["calls"]:>8}{res["rows"]:>10}{res["bytes"] / 2 ** 20:>9.2f}'
+                         f'{res["seconds"]:>10.3f}{res["seconds"] / res["calls"] * 1000:>10.3f}  {histogram}')
+        return '\n'.join(lines)
+
+
+stats = Stats()
+
+
+class JsonLinesSink:
+    """
+    每次量測寫一行JSON到檔案: {"time", "stage", "seconds", "rows", "bytes"}
+    檔案在disable()或close()時才確定寫入
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def enable(log_sink=None):
+    """
+    開始記錄
+    :param log_sink: 每次量測呼叫一次的函式，參數為event dict，例如JsonLinesSink(path)或print
+    """
+    global _enabled, _log_sink
+    _log_sink = log_sink
+    _enabled = True
+
+
+def disable():
+    global _enabled, _log_sink
+    _enabled = False
+    if hasattr(_log_sink, 'close'):
+        _log_sink.close()
+    _log_sink = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def record(stage: str, seconds: float, rows: int = 0, nbytes: int = 0):
+    stats.record(stage, seconds, rows, nbytes)
+    if _log_sink is not None:
+        _log_sink({'time': time.time(), 'stage': stage, 'seconds': seconds, 'rows': rows, 'bytes': nbytes})
+
+
+class _Timer:
+    __slots__ = ('stage', 'rows', 'nbytes', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.rows = 0
+        self.nbytes = 0
+
+    def set_rows(self, rows):
+        # 記錄資料列筆數與估計的bytes
+        self.rows = len(rows)
+        self.nbytes = estimate_size(rows)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start, self.rows, self.nbytes)
+
+
+class _NoopTimer:
+    # 關閉時共用的timer，不計時也不計算筆數
+    __slots__ = ()
+
+    def set_rows(self, rows):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_noop_timer = _NoopTimer()
+
+
+def timer(stage: str):
+    """
+    量測一段程式
+    with timer('db_read') as t:
+        rows = cursor.fetchall()
+        t.set_rows(rows)
+    """
+    return _Timer(stage) if _enabled else _noop_timer
+
+
+def timed(stage: str):
+    """
+    量測整個函式的decorator
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class ProfileResult:
+    """
+    profile的結果，cProfile為pstats.Stats，取樣為每個函式(檔名:行號 函式名)被取樣到的次數
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.stats = None
+        self.samples = Counter()
+        self.n_sample = 0
+
+    def report(self, limit: int = 20, sort: str = 'cumulative') -> str:
+        if self.mode == 'cprofile':
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(limit)
+            return stream.getvalue()
+        lines = [f'取樣{self.n_sample}次']
+        for frame, count in self.samples.most_common(limit):
+            lines.append(f'{count / max(self.n_sample, 1) * 100:6.1f}% {frame}')
+        return '\n'.join(lines)
+
+
+def _sample(thread_id: int, result: ProfileResult, interval: float, stop: threading.Event):
+    # 每隔interval取樣目標thread的call stack，每個函式在同一次取樣只算一次(類似cumulative)
+    # 本模組的函式(timed的wrapper等)不列入
+    while not stop.wait(interval):
+        frame = sys._current_frames().get(thread_id)
+        seen = set()
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename != __file__:
+                seen.add(f'{code.co_filename}:{code.co_firstlineno} {code.co_name}')
+            frame = frame.f_back
+        result.samples.update(seen)
+        result.n_sample += 1
+
+
+@contextmanager
+def profile(mode: str = 'cprofile', limit: int = 20, interval: float = 0.005, silent=False):
+    """
+    分析with區塊內(例如MyStock的某個方法)時間花在哪些函式
+    :param mode: 'cprofile'(完整但會拖慢執行)或'sampling'(每interval秒取樣一次，幾乎不影響執行速度)
+    :param limit: print前幾名
+    :param interval: 取樣間隔(秒)
+    :param silent: 是否不print結果，可用yield的ProfileResult自行查看
+    """
+    if mode not in ('cprofile', 'sampling'):
+        raise ValueError('mode只能為"cprofile"或"sampling"')
+    result = ProfileResult(mode)
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            result.stats = pstats.Stats(profiler)
+    else:
+        stop = threading.Event()
+        sampler = threading.Thread(target=_sample, args=(threading.get_ident(), result, interval, stop), daemon=True)
+        sampler.start()
+        try:
+            yield result
+        finally:
+            stop.set()
+            sampler.join()
+    if not silent:
+        print(result.report(limit))
@@ -5,23 +5,31 @@
 # TWSE equities = 上市證券
 # TPEx equities = 上櫃證券
 #
+# 預設直接下載網頁並計算hash，網頁內容與上次相同時不解析也不更新CSV，
+# 不同時才邊解析(不建立整頁的樹)邊寫入CSV。
+# 也可以解析存在本機的網頁: stream_to_csv('C_public.html', 'twse_equities.csv')
+# 網站擋掉非瀏覽器的連線時，再改用to_csv(Selenium開Chrome)。
+#
 
-import os
+import codecs
 import csv
+import hashlib
+import os
+import time
+import urllib.request
 from collections import namedtuple
+from contextlib import suppress
+from itertools import islice
 
 from lxml import etree
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-import time
-
 TWSE_EQUITIES_URL = 'http://isin.twse.com.tw/isin/C_public.jsp?strMode=2'
 TPEX_EQUITIES_URL = 'http://isin.twse.com.tw/isin/C_public.jsp?strMode=4'
 ROW = namedtuple('Row', ['type', 'code', 'name', 'ISIN', 'start',
                          'market', 'group', 'CFI'])
+# ISIN網頁的編碼(MS950)
+ISIN_ENCODING = 'cp950'
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 def make_row_tuple(typ, row):
@@ -30,6 +38,11 @@ def make_row_tuple(typ, row):
 
 
 def fetch_data(url):
+    # selenium只有這個方法用到，在這裡才import，其他方法不需要安裝
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+
     # 初始化Selenium WebDriver
     service = Service(ChromeDriverManager().install())
     driver = webdriver.Chrome(service=service)
@@ -41,11 +54,18 @@ def fetch_data(url):
     # 獲取網頁的源代碼
     page_source = driver.page_source
     driver.quit()  # 關閉瀏覽器
+    return parse_page(page_source)
+
 
+def parse_page(page_source):
+    # 整頁建立lxml樹後解析
     root = etree.HTML(page_source)
     trs = root.xpath('//tr')[1:]
+    return list(rows_from_trs(trs))
 
-    result = []
+
+def rows_from_trs(trs):
+    # 依序處理表格的每一列，種類列之後的資料列都屬於該種類
     typ = ''
     for tr in trs:
         tr = list(map(lambda x: x.text, tr.iter()))
@@ -54,8 +74,123 @@ def fetch_data(url):
             typ = tr[2].strip(' ')
         else:
             # This is the row data
-            result.append(make_row_tuple(typ, tr))
-    return result
+            yield make_row_tuple(typ, tr)
+
+
+def iter_chunks(source, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    把來源轉成bytes chunk
+    :param source: 檔案路徑、bytes、有read()的物件(開啟的檔案、HTTP回應)或bytes chunk的iterable
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter_chunks(f, chunk_size)
+    elif isinstance(source, (bytes, bytearray)):
+        yield bytes(source)
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        yield from source
+
+
+def iter_trs(chunks, encoding=ISIN_ENCODING):
+    """
+    邊讀邊解析，每解析完一個<tr>就交給呼叫端，處理完後清掉，記憶體只保留目前這一列
+    """
+    parser = etree.HTMLPullParser(events=('end',), tag='tr')
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    def read_events():
+        for _, tr in parser.read_events():
+            yield tr
+            # 清掉已處理的列，不讓整頁的樹留在記憶體
+            tr.clear()
+            while tr.getprevious() is not None:
+                del tr.getparent()[0]
+
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        yield from read_events()
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from read_events()
+
+
+def iter_rows(source, encoding=ISIN_ENCODING, chunk_size=STREAM_CHUNK_SIZE):
+    # 串流解析ISIN網頁，結果與parse_page相同，第一列為表頭
+    return rows_from_trs(islice(iter_trs(iter_chunks(source, chunk_size), encoding), 1, None))
+
+
+def stream_to_csv(source, path, encoding=ISIN_ENCODING, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    先邊讀邊計算原始內容的hash(不解析)，與上次相同時直接保留原本的CSV；
+    不同時才邊解析邊寫入CSV(先寫暫存檔)
+    :param source: 同iter_chunks
+    :return: 是否更新了CSV
+    """
+    digest = hashlib.sha256()
+    hash_path = path + '.sha256'
+    tmp_path = path + '.tmp'
+    raw_path = None
+    try:
+        if isinstance(source, (str, os.PathLike, bytes, bytearray)):
+            # 可以重複讀取的來源，先只計算hash
+            for chunk in iter_chunks(source, chunk_size):
+                digest.update(chunk)
+        else:
+            # HTTP回應等只能讀一次的來源，計算hash的同時存到暫存檔，內容有變時再從暫存檔解析
+            raw_path = path + '.raw'
+            with open(raw_path, 'wb') as f:
+                for chunk in iter_chunks(source, chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+            source = raw_path
+
+        content_hash = digest.hexdigest()
+        if os.path.exists(path) and os.path.exists(hash_path):
+            with open(hash_path) as f:
+                if f.read().strip() == content_hash:
+                    return False
+
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf_8') as csvfile:
+                writer = csv.writer(csvfile,
+                                    delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(ROW._fields)
+                n_row = 0
+                for row in iter_rows(source, encoding, chunk_size):
+                    writer.writerow(row)
+                    n_row += 1
+            if n_row == 0:
+                raise ValueError('網頁內沒有證券資料')
+        except BaseException:
+            # 暫存檔可能還沒建立，不要蓋掉原本的錯誤
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        with open(hash_path, 'w') as f:
+            f.write(content_hash)
+        return True
+    finally:
+        if raw_path is not None:
+            with suppress(FileNotFoundError):
+                os.remove(raw_path)
+
+
+def open_url(url):
+    # 不開瀏覽器直接下載，回傳的HTTP回應可以邊讀邊解析
+    request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    return urllib.request.urlopen(request, timeout=60)
+
+
+def to_csv_streaming(url, path):
+    with open_url(url) as response:
+        return stream_to_csv(response, path)
 
 
 def to_csv(url, path):
@@ -72,10 +207,10 @@ def __update_codes():
     def get_directory():
         return os.path.dirname(os.path.abspath(__file__))
 
-    to_csv(TWSE_EQUITIES_URL, os.path.join(get_directory(), 'twse_equities.csv'))
-    to_csv(TPEX_EQUITIES_URL, os.path.join(get_directory(), 'tpex_equities.csv'))
+    to_csv_streaming(TWSE_EQUITIES_URL, os.path.join(get_directory(), 'twse_equities.csv'))
+    to_csv_streaming(TPEX_EQUITIES_URL, os.path.join(get_directory(), 'tpex_equities.csv'))
 
 
 if __name__ == '__main__':
-    to_csv(TWSE_EQUITIES_URL, 'twse_equities.csv')
-    to_csv(TPEX_EQUITIES_URL, 'tpex_equities.csv')
\ No newline at end of file
+    to_csv_streaming(TWSE_EQUITIES_URL, 'twse_equities.csv')
+    to_csv_streaming(TPEX_EQUITIES_URL, 'tpex_equities.csv')
@@ -0,0 +1,147 @@
+"""
+多檔股票、多個起始日期一次回測。
+所有股價用一次SQL查詢載入，依(股票, 日期)排序後整段一起算N日均價，
+再用二分搜尋找出每個(股票, 日期)實際有資料的交易日，報酬的定義與MyStock.cal_return相同。
+
+使用方式
+from panel_backtest import panel_backtest
+df = panel_backtest(['2454', '2603'], ['2024-01-02', '2024-02-01'], test_day_list=[30], n_daily_average=1)
+"""
+from datetime import datetime, timedelta
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+from batch_downloader import download_stocks
+from create_downloaded_stock_price_db import get_conn, to_date_int
+from get_TWII_price import get_TWII_close_batch
+from return_engine import rolling_mean, to_day_key
+
+# 組合key用: sid位置 * SID_KEY_BASE + 整數日，整數日(toordinal)遠小於這個數
+SID_KEY_BASE = 10 ** 7
+# datetime64[D]的0為1970-01-01，加上這個數轉為toordinal
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def load_close_panel(sids: List[str], from_date: datetime, to_date: datetime) -> pd.DataFrame:
+    """
+    一次查詢多檔股票一段期間的收盤價
+    :return: 欄位sid, day_key(toordinal), close，依sid、日期排序
+    """
+    placeholders = ', '.join('?' * len(sids))
+    rows = get_conn().execute(
+        f"SELECT sid, date, close FROM stock_daily_price WHERE sid IN ({placeholders}) AND date BETWEEN ? AND ? "
+        f"ORDER BY sid, date",
+        (*sids, to_date_int(from_date), to_date_int(to_date))).fetchall()
+    df = pd.DataFrame(rows, columns=['sid', 'date', 'close'])
+    df['day_key'] = pd.to_datetime(df['date'], format='%Y%m%d').values.astype('datetime64[D]').astype(
+        np.int64) + EPOCH_ORDINAL
+    df['close'] = df['close'].astype(float)
+    return df[['sid', 'day_key', 'close']]
+
+
+def to_date_list(dates) -> List[datetime]:
+    # 字串、Timestamp或datetime，統一轉為datetime list
+    if isinstance(dates, (str, datetime, pd.Timestamp)):
+        dates = [dates]
+    return [pd.to_datetime(tmp_date).to_pydatetime() for tmp_date in dates]
+
+
+def round_list(values: np.ndarray) -> List[float]:
+    # 與cal_return相同用python round四捨五入到小數第二位，nan保持nan
+    return [value if np.isnan(value) else round(value, 2) for value in values.tolist()]
+
+
+def panel_backtest(sids: List[str], start_dates: Union[str, datetime, List], test_day_list: List[int] = None,
+                   n_daily_average=5, evaluation_metric='ROI', adjust_by_taiex=False,
+                   download_missing=True) -> pd.DataFrame:
+    """
+    多檔股票、多個起始日期一次回測
+    :param sids: 股票代碼list
+    :param start_dates: 一個或多個開始計算報酬的日期
+    :param test_day_list: 績效測試天數列表，預設同cal_return
+    :param n_daily_average: 使用幾日均價當作當天價格
+    :param evaluation_metric: ROI或IRR
+    :param adjust_by_taiex: 是否用大盤進行校正
+    :param download_missing: 是否先下載DB內缺少的月份
+    :return: 每個(sid, start_date, day)一列，欄位
+        sid, start_date, day, real_start_date, start_price, real_date, price, day_range, metric,
+        taiex_metric, adj_metric。超過今天或資料不足為nan
+    """
+    if evaluation_metric not in ('ROI', 'IRR'):
+        raise ValueError('evaluation_metric只能為"ROI"或"IRR"')
+    test_day_list = test_day_list if test_day_list is not None else [10, 30, 60, 120, 180, 360]
+    start_dates = to_date_list(start_dates)
+    now = datetime.today()
+    # 往前多載入一段，確保起始日有N日均價
+    from_date = min(start_dates) - timedelta(days=max(3 * n_daily_average, 57))
+    from_date = from_date.replace(day=1)
+    to_date = min(max(start_dates) + timedelta(days=max(test_day_list + [0])), now)
+    if download_missing:
+        download_stocks(sids, from_date.year, from_date.month, to_date.year, to_date.month, silent=True)
+    prices = load_close_panel(sids, from_date, to_date)
+
+    # 整段一起算N日均價，跨到前一檔股票的視窗作廢。sid位置依字串排序，與SQL的ORDER BY sid一致
+    sid_index = {sid: i for i, sid in enumerate(sorted(set(sids)))}
+    price_sid = prices['sid'].map(sid_index).to_numpy(dtype=np.int64)
+    day_keys = prices['day_key'].to_numpy()
+    average_price = rolling_mean(prices['close'].to_numpy(), n_daily_average)
+    group_start = np.searchsorted(price_sid, price_sid, side='left')
+    average_price[np.arange(len(price_sid)) - group_start < n_daily_average - 1] = np.nan
+    panel_keys = price_sid * SID_KEY_BASE + day_keys
+
+    # 每個(sid, start_date, day)一列
+    grid = pd.MultiIndex.from_product([sids, start_dates, test_day_list], names=['sid', 'start_date', 'day'])
+    res = grid.to_frame(index=False)
+    res_sid = res['sid'].map(sid_index).to_numpy(dtype=np.int64)
+    start_keys = np.array([to_day_key(tmp_date) for tmp_date in res['start_date']], dtype=np.int64)
+    test_dates = res['start_date'] + pd.to_timedelta(res['day'], unit='D')
+    test_keys = start_keys + res['day'].to_numpy(dtype=np.int64)
+
+    def asof(target_keys):
+        # 每個目標日期當天或之前最近的交易日位置，不同股票或沒有資料為-1
+        index = np.searchsorted(panel_keys, res_sid * SID_KEY_BASE + target_keys, side='right') - 1
+        valid = (index >= 0) & (price_sid[np.maximum(index, 0)] == res_sid)
+        return np.where(valid, index, -1)
+
+    def take(values, index, fill=np.nan):
+        return np.where(index >= 0, values[np.maximum(index, 0)], fill)
+
+    start_index = asof(start_keys)
+    end_index = np.where((test_dates <= now).to_numpy(), asof(test_keys), -1)
+    start_price = np.array(round_list(take(average_price, start_index)))
+    end_price = np.array(round_list(take(average_price, end_index)))
+    real_start_key = take(day_keys, start_index, 0)
+    real_end_key = take(day_keys, end_index, 0)
+    valid = (start_index >= 0) & (end_index >= 0) & ~np.isnan(start_price) & ~np.isnan(end_price)
+    day_range = np.where(valid, real_end_key - real_start_key, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = end_price / start_price
+        if evaluation_metric == 'IRR':
+            metric = np.where(valid, (ratio ** (365 / day_range) - 1) * 100, np.nan)
+        else:
+            metric = np.where(valid, (ratio - 1) * 100, np.nan)
+    res['real_start_date'] = pd.to_datetime(np.where(start_index >= 0, real_start_key - EPOCH_ORDINAL, np.nan),
+                                            unit='D')
+    res['start_price'] = start_price
+    res['real_date'] = pd.to_datetime(np.where(valid, real_end_key - EPOCH_ORDINAL, np.nan), unit='D')
+    res['price'] = np.where(valid, end_price, np.nan)
+    res['day_range'] = np.where(valid, day_range, np.nan)
+    res['metric'] = round_list(metric)
+
+    res['taiex_metric'] = np.nan
+    res['adj_metric'] = np.nan
+    if adjust_by_taiex and valid.any():
+        taiex_start = get_TWII_close_batch(real_start_key[valid].tolist())
+        taiex_end = get_TWII_close_batch(real_end_key[valid].tolist())
+        if evaluation_metric == 'IRR':
+            taiex_metric = ((taiex_end / taiex_start) ** (365 / day_range[valid]) - 1) * 100
+        else:
+            taiex_metric = (taiex_end / taiex_start - 1) * 100
+        taiex_metric = np.array(round_list(taiex_metric))
+        res.loc[valid, 'taiex_metric'] = taiex_metric
+        # 扣去大盤報酬率
+        res.loc[valid, 'adj_metric'] = round_list(res.loc[valid, 'metric'].to_numpy() - taiex_metric)
+    return res
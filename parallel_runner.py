@@ -0,0 +1,79 @@
+"""
+把每檔股票的計算(cal_return、cal_beta、recent_fluctuation等MyStock方法)分散到多個process平行執行。
+每個worker process開啟自己的唯讀SQLite連線，不共用主process的conn，只讀取DB內已有的資料，
+MyStock用db_first模式建立，DB內已有的當月資料(即使不是今天抓的)直接使用，不會重抓寫入。
+DB沒有的月份無法抓取，需要的資料請先用batch_downloader下載。max_workers=1不開process時也一樣只用唯讀連線。
+
+使用方式
+from parallel_runner import run_stock_method
+res = run_stock_method(['2330', '2454'], 'cal_beta', datetime(2021, 1, 1), datetime(2024, 1, 1), interval=7,
+                       max_workers=4)
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Callable
+
+from create_downloaded_stock_price_db import db_file_name, use_read_only_connection, read_only_connection
+from get_TWII_price import get_TWII_index, skip_TWII_update_check
+from get_stock_price_data import MyStock
+
+
+def init_worker(db_file: str):
+    # worker process初始化: 開啟唯讀連線，TWII資料由主process確認過是最新的
+    use_read_only_connection(db_file)
+    skip_TWII_update_check()
+
+
+def call_stock_method(sid: str, method_name: str, args: tuple, kwargs: dict, return_exceptions: bool):
+    # 在worker內建立MyStock(不做初始抓取、DB優先，唯讀連線不能重抓當月)並呼叫指定方法
+    try:
+        stock = MyStock(sid, initial_fetch=False, silent=True, db_first=True)
+        return getattr(stock, method_name)(*args, **kwargs)
+    except Exception as e:
+        if not return_exceptions:
+            raise
+        return e
+
+
+def default_chunksize(n_task: int, max_workers: int = None) -> int:
+    # 每個worker大約分到4批
+    max_workers = max_workers or os.cpu_count() or 1
+    return max(1, n_task // (max_workers * 4))
+
+
+def run_parallel(func: Callable, sids: List[str], max_workers: int = None, chunksize: int = None) -> list:
+    """
+    平行執行func(sid)，回傳結果順序與sids相同
+    :param func: 接受sid的函式，必須可以pickle(模組層級的函式或functools.partial)
+    :param max_workers: process數，None為CPU核心數，1代表不開process直接在目前process執行
+    :param chunksize: 每次交給worker的sid數量，sid多且每個計算很快時調大可減少process間溝通，None為自動
+    """
+    # 先在主process確認TWII是最新的，worker只讀取
+    get_TWII_index()
+    if max_workers == 1:
+        # 同worker改用唯讀連線
+        with read_only_connection(db_file_name):
+            return [func(sid) for sid in sids]
+    if chunksize is None:
+        chunksize = default_chunksize(len(sids), max_workers)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(db_file_name,)) as executor:
+        return list(executor.map(func, sids, chunksize=chunksize))
+
+
+def run_stock_method(sids: List[str], method_name: str, *args, max_workers: int = None, chunksize: int = None,
+                     return_exceptions=False, **kwargs) -> list:
+    """
+    平行對每檔股票呼叫MyStock的方法，例如cal_return、cal_beta、recent_fluctuation
+    :param sids: 股票代碼list
+    :param method_name: MyStock的方法名稱
+    :param args: 傳給方法的參數
+    :param max_workers: process數，None為CPU核心數
+    :param chunksize: 每次交給worker的sid數量，None為自動
+    :param return_exceptions: True時單檔失敗回傳Exception物件，False時直接丟出錯誤
+    :param kwargs: 傳給方法的參數
+    :return: 結果list，順序與sids相同
+    """
+    func = partial(call_stock_method, method_name=method_name, args=args, kwargs=kwargs,
+                   return_exceptions=return_exceptions)
+    return run_parallel(func, sids, max_workers=max_workers, chunksize=chunksize)
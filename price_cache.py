@@ -0,0 +1,132 @@
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+# rows: 該月已轉成DATATUPLE2的股價(tuple，避免被外部修改)
+# is_full_data: 該月資料是否完整，不完整的資料只在快取當天有效
+# cached_date: 放入快取的日期
+# size: 估計佔用的記憶體(bytes)
+CACHE_ENTRY = namedtuple('CacheEntry', ['rows', 'is_full_data', 'cached_date', 'size'])
+# configure沒有指定的上限維持原本的設定(max_bytes的None代表不限制，不能當作沒指定)
+_UNCHANGED = object()
+
+
+def estimate_size(rows) -> int:
+    """
+    估計一個月股價資料佔用的記憶體，以第一筆資料的大小乘上筆數
+    """
+    if not rows:
+        return sys.getsizeof(rows)
+    row_size = sys.getsizeof(rows[0]) + sum(sys.getsizeof(field) for field in rows[0])
+    return sys.getsizeof(rows) + row_size * len(rows)
+
+
+class PriceCache:
+    """
+    跨MyStock共用的股價快取，key為(sid, 月份)，value為已解析好的股價資料。
+    超過筆數上限或記憶體上限時，依LRU(最久沒用到)剔除。
+
+    使用方式
+    from price_cache import price_cache
+    price_cache.configure(max_entries=1000, max_bytes=50 * 1024 ** 2)
+    """
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = None):
+        """
+        :param max_entries: 最多快取幾個(sid, 月份)
+        :param max_bytes: 記憶體上限(估計值)，None代表不限制
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_entries: int = None, max_bytes=_UNCHANGED):
+        """
+        調整上限，超過的部分馬上剔除，沒有指定的上限維持原本的設定
+        :param max_bytes: 記憶體上限(估計值)，None代表取消限制
+        """
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not _UNCHANGED:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, sid: str, year_month_str: str):
+        """
+        取得快取資料，若不存在或是不完整的資料已過期(非今天放入)則回傳None
+        """
+        key = (sid, year_month_str)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not entry.is_full_data and entry.cached_date != date.today():
+                # 不完整的月份隔天要重抓，快取作廢
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, sid: str, year_month_str: str, rows, is_full_data: bool):
+        rows = tuple(rows)
+        entry = CACHE_ENTRY(rows, is_full_data, date.today(), estimate_size(rows))
+        key = (sid, year_month_str)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._total_size += entry.size
+            self._evict()
+
+    def invalidate(self, sid: str, year_month_str: str = None):
+        """
+        剔除快取，重新抓取該月份或是標記為不完整時呼叫
+        :param year_month_str: None代表剔除該股票所有月份
+        """
+        with self._lock:
+            if year_month_str is not None:
+                self._remove((sid, year_month_str))
+            else:
+                for key in [key for key in self._entries if key[0] == sid]:
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total_size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_size -= entry.size
+
+    def _evict(self):
+        # 從最久沒用到的開始剔除，直到符合上限
+        while self._entries and (len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._total_size > self.max_bytes)):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+# 全域共用的快取
+price_cache = PriceCache()
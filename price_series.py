@@ -0,0 +1,164 @@
+"""
+以欄位陣列(struct-of-arrays)儲存的股價序列，每個欄位一個numpy陣列，取代每天一個DATATUPLE2 namedtuple的list。
+日期區間切片用二分搜尋，切片與轉pandas/numpy都不複製資料。
+
+使用方式
+stock = MyStock('2330', initial_fetch=False)
+series = stock.fetch_series(2020, 1, 2024, 12)
+series.between(datetime(2023, 1, 1), datetime(2023, 6, 30)).close.mean()
+df = series.to_df()
+"""
+from collections.abc import Sequence
+from datetime import datetime
+from typing import List, Dict
+
+import numpy as np
+
+from create_downloaded_stock_price_db import get_conn, to_date_int
+from get_stock_price_data import DATATUPLE2, PRICE_SELECT_COLUMNS
+
+# 數值欄位與dtype，順序同DATATUPLE2(不含sid, month, date)，價格沒有成交為nan
+FIELDS = {
+    'capacity': np.int64,
+    'turnover': np.int64,
+    'previous_close': np.float64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'change': np.float64,
+    'transaction': np.int64,
+}
+# 日期用秒為單位，pandas可以直接使用不用轉換
+DATE_DTYPE = 'datetime64[s]'
+
+
+def date_ints_to_datetime64(date_ints) -> np.ndarray:
+    # 整數日期yyyymmdd陣列轉datetime64，不逐筆解析
+    date_ints = np.asarray(date_ints, dtype=np.int64)
+    months = (date_ints // 10000 - 1970) * 12 + date_ints // 100 % 100 - 1
+    return (months.astype('datetime64[M]').astype('datetime64[D]') + (date_ints % 100 - 1)).astype(DATE_DTYPE)
+
+
+def to_column(values, dtype) -> np.ndarray:
+    # None轉為nan(價格，numpy轉float時自動處理)或0(數量)
+    try:
+        return np.array(values, dtype=dtype)
+    except TypeError:
+        return np.array([0 if value is None else value for value in values], dtype=dtype)
+
+
+class PriceSeries:
+    """
+    單一股票依日期排序的股價，date與FIELDS每個欄位各一個等長的numpy陣列
+    """
+    __slots__ = ('sid', 'date', *FIELDS)
+
+    def __init__(self, sid: str, date: np.ndarray, **columns):
+        self.sid = sid
+        self.date = np.asarray(date, dtype=DATE_DTYPE)
+        for field, dtype in FIELDS.items():
+            setattr(self, field, np.asarray(columns[field], dtype=dtype))
+
+    @classmethod
+    def from_datatuples(cls, sid: str, data: List[DATATUPLE2]) -> 'PriceSeries':
+        # 由DATATUPLE2 list建立，例如MyStock.data
+        columns = list(zip(*data)) if data else [()] * len(DATATUPLE2._fields)
+        offset = DATATUPLE2._fields.index('capacity')
+        return cls(sid, np.array(columns[2], dtype=DATE_DTYPE),
+                   **{field: to_column(columns[offset + i], dtype) for i, (field, dtype) in enumerate(FIELDS.items())})
+
+    @classmethod
+    def from_db_rows(cls, sid: str, rows: List[tuple]) -> 'PriceSeries':
+        # 由PRICE_SELECT_COLUMNS順序的DB資料列建立，日期直接由整數轉換
+        columns = list(zip(*rows)) if rows else [()] * len(DATATUPLE2._fields)
+        return cls(sid, date_ints_to_datetime64(columns[2]),
+                   **{field: to_column(columns[3 + i], dtype) for i, (field, dtype) in enumerate(FIELDS.items())})
+
+    @classmethod
+    def load(cls, sid: str, from_date: datetime = None, to_date: datetime = None) -> 'PriceSeries':
+        """
+        一次範圍查詢讀取DB內已有的股價，不會線上抓取(需要抓取請用MyStock.fetch_series)
+        """
+        from_date_key = to_date_int(from_date) if from_date else 0
+        to_date_key = to_date_int(to_date) if to_date else 99999999
+        rows = get_conn().execute(
+            f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price WHERE sid = ? AND date BETWEEN ? AND ? "
+            f"ORDER BY date", (sid, from_date_key, to_date_key)).fetchall()
+        return cls.from_db_rows(sid, rows)
+
+    def __len__(self):
+        return len(self.date)
+
+    def __getitem__(self, item):
+        """
+        整數回傳單日DATATUPLE2，slice或陣列回傳PriceSeries(slice不複製資料)
+        """
+        if isinstance(item, (int, np.integer)):
+            return self.data[item]
+        return PriceSeries(self.sid, self.date[item], **{field: getattr(self, field)[item] for field in FIELDS})
+
+    def index_range(self, from_date: datetime = None, to_date: datetime = None) -> slice:
+        # 二分搜尋日期區間的位置，包含頭尾兩天
+        start = 0 if from_date is None else int(np.searchsorted(self.date, np.datetime64(from_date, 's')))
+        end = len(self) if to_date is None else int(np.searchsorted(self.date, np.datetime64(to_date, 's'),
+                                                                    side='right'))
+        return slice(start, end)
+
+    def between(self, from_date: datetime = None, to_date: datetime = None) -> 'PriceSeries':
+        # 日期區間(包含頭尾)的切片，O(log n)且不複製資料
+        return self[self.index_range(from_date, to_date)]
+
+    def asof(self, target_date: datetime) -> int:
+        # 指定日期當天或之前最近一個交易日的位置，沒有則為-1
+        return int(np.searchsorted(self.date, np.datetime64(target_date, 's'), side='right')) - 1
+
+    def to_numpy(self) -> Dict[str, np.ndarray]:
+        # {欄位: 陣列}，直接回傳內部陣列不複製
+        return {'date': self.date, **{field: getattr(self, field) for field in FIELDS}}
+
+    def to_df(self):
+        # 轉成DataFrame，欄位直接使用內部陣列不複製
+        import pandas as pd
+        return pd.DataFrame(self.to_numpy(), copy=False)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in self.to_numpy().values())
+
+    @property
+    def price(self) -> List[float]:
+        # 相容twstock Stock.price: 收盤價list，沒有成交為None
+        return [None if np.isnan(value) else value for value in self.close.tolist()]
+
+    @property
+    def data(self) -> 'DataView':
+        # 相容MyStock.data: 依需要才產生DATATUPLE2的唯讀序列
+        return DataView(self)
+
+    def __repr__(self):
+        if not len(self):
+            return f'PriceSeries({self.sid}, 0筆)'
+        return f'PriceSeries({self.sid}, {len(self)}筆, {self.date[0]} ~ {self.date[-1]})'
+
+
+class DataView(Sequence):
+    """
+    PriceSeries的唯讀DATATUPLE2序列，給仍使用self.data寫法的程式，取用時才產生該筆namedtuple
+    """
+    __slots__ = ('series',)
+
+    def __init__(self, series: PriceSeries):
+        self.series = series
+
+    def __len__(self):
+        return len(self.series)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        series = self.series
+        date = series.date[item].astype(object)
+        values = [getattr(series, field)[item].item() for field in FIELDS]
+        values = [None if isinstance(value, float) and np.isnan(value) else value for value in values]
+        return DATATUPLE2(series.sid, f'{date.year}{date.month:02d}', date, *values)
@@ -0,0 +1,98 @@
+"""
+長期歷史股價的串流計算: 股價由DB cursor逐批(每月或每年)讀出，滾動計算(N日均價、N日報酬)逐批累加，
+記憶體只保留每檔股票最近N筆，不會隨歷史長度增加。
+
+使用方式
+from price_stream import iter_universe_batches, rolling_by_sid, RollingMean
+for values in rolling_by_sid(iter_universe_batches(['2330', '2454'], datetime(2010, 1, 1)), lambda: RollingMean(20)):
+    for sid, date, ma20 in values:
+        ...
+
+單檔股票使用MyStock.iter_batches
+for batch in rolling_by_sid(MyStock('2330', initial_fetch=False).iter_batches(2010, 1, 2024, 12), ...):
+"""
+from collections import deque
+from datetime import datetime
+from typing import List, Iterator, Callable, Iterable, Tuple
+
+from create_downloaded_stock_price_db import get_conn, to_date_int
+from get_stock_price_data import DATATUPLE2, PRICE_SELECT_COLUMNS, iter_db_batches
+
+
+def iter_universe_batches(sids: List[str] = None, from_date: datetime = None, to_date: datetime = None,
+                          batch: str = 'month') -> Iterator[List[DATATUPLE2]]:
+    """
+    逐批產生多檔股票的股價，同一批內依日期、股票代碼排序，只讀DB內已有的資料，缺少的請先用batch_downloader下載
+    :param sids: 股票代碼list，None為DB內所有股票
+    :param from_date: 開始日期，None為最早
+    :param to_date: 結束日期，None為最新
+    :param batch: 'month'或'year'
+    """
+    conditions = ['date BETWEEN ? AND ?']
+    params = [to_date_int(from_date) if from_date else 0, to_date_int(to_date) if to_date else 99999999]
+    if sids is not None:
+        conditions.append(f"sid IN ({', '.join('?' * len(sids))})")
+        params.extend(sids)
+    cursor = get_conn().execute(f"SELECT {PRICE_SELECT_COLUMNS} FROM stock_daily_price "
+                                f"WHERE {' AND '.join(conditions)} ORDER BY date, sid", params)
+    yield from iter_db_batches(cursor, batch)
+
+
+class RollingMean:
+    """
+    N日均價，同twstock的moving_average四捨五入到小數第二位，資料不足N筆時為None
+    沒有成交(None)的日子不加入視窗
+    """
+    __slots__ = ('n', 'window')
+
+    def __init__(self, n: int):
+        self.n = n
+        self.window = deque(maxlen=n)
+
+    def update(self, value: float):
+        if value is None:
+            return None
+        self.window.append(value)
+        if len(self.window) < self.n:
+            return None
+        # 每次重新加總視窗(N很小)，結果與sum(list[-n:])完全相同，不會有累加誤差
+        return round(sum(self.window) / self.n, 2)
+
+
+class RollingReturn:
+    """
+    N個交易日的報酬率(%)，同cal_return的ROI四捨五入到小數第二位，資料不足N + 1筆時為None
+    """
+    __slots__ = ('n', 'window')
+
+    def __init__(self, n: int):
+        self.n = n
+        self.window = deque(maxlen=n + 1)
+
+    def update(self, value: float):
+        if value is None:
+            return None
+        self.window.append(value)
+        if len(self.window) <= self.n:
+            return None
+        return round((value / self.window[0] - 1) * 100, 2)
+
+
+def rolling_by_sid(batches: Iterable[List[DATATUPLE2]], window_factory: Callable, field: str = 'close') \
+        -> Iterator[List[Tuple[str, datetime, float]]]:
+    """
+    逐批套用滾動計算，每檔股票各自一個視窗(跨批延續)
+    :param batches: iter_universe_batches或MyStock.iter_batches
+    :param window_factory: 產生滾動計算物件的函式，例如lambda: RollingMean(20)
+    :param field: 要計算的欄位
+    :return: generator，每批產生(sid, date, 計算結果) list
+    """
+    windows = {}
+    for rows in batches:
+        res = []
+        for row in rows:
+            window = windows.get(row.sid)
+            if window is None:
+                window = windows[row.sid] = window_factory()
+            res.append((row.sid, row.date, window.update(getattr(row, field))))
+        yield res
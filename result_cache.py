@@ -0,0 +1,281 @@
+"""
+MyStock.cal_return、cal_beta結果的磁碟快取，重跑notebook或ETF_analysis時同樣的回測不用重算。
+key為方法名稱、sid與正規化後的參數(不含silent)，每筆結果記錄當時的資料版本:
+該股票stock_header的月份數、完整月份數與最後更新時間，用到大盤時加上TWII的最後日期與最後更新時間。
+重抓當月不完整的資料、補抓月份或大盤更新後版本改變，舊結果自動作廢。
+結果會隨今天改變的(測試日期或結束日期還沒到)只在當天有效。
+超過筆數或大小上限時依LRU(最久沒用到)剔除。預設關閉。
+
+使用方式
+import result_cache
+result_cache.enable()  # 存在db_path/result_cache.db，可用enable(max_entries=..., max_bytes=...)調整上限
+MyStock('2330').cal_return(datetime(2024, 1, 5))  # 第二次起直接讀取快取(命中時不print回測結果)
+result_cache.get_cache().stats()
+"""
+import functools
+import hashlib
+import inspect
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime, date, timedelta
+
+from config import db_path
+from connection_manager import ConnectionManager
+from create_downloaded_stock_price_db import get_conn
+
+RESULT_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    sid TEXT NOT NULL,
+    method TEXT NOT NULL,
+    arguments TEXT NOT NULL,
+    version TEXT NOT NULL,
+    expires_date TEXT,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+RESULT_CACHE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS result_cache_last_used ON result_cache (last_used)
+"""
+# 不影響結果的參數
+IGNORED_ARGUMENTS = {'self', 'silent'}
+# 累積幾筆命中後寫回使用時間
+TOUCH_BATCH_SIZE = 1000
+
+_cache = None
+
+
+def normalize_argument(value):
+    # 參數轉成可比較、repr固定的值，list與tuple視為相同
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_argument(item) for item in value)
+    if hasattr(value, 'item'):
+        # numpy數值
+        return value.item()
+    return value
+
+
+def data_version(sid: str, uses_taiex: bool):
+    """
+    目前DB內資料的版本
+    :return: (版本字串, 是否剛寫入)。updated_date只到秒，剛寫入(同一秒)的資料之後再寫一次版本可能不變，這時不存快取。
+        還沒有TWII資料表時版本為None，不使用快取
+    """
+    conn = get_conn()
+    count, full_count, updated_date, fresh = conn.execute(
+        "SELECT COUNT(*), SUM(is_full_data), MAX(updated_date), MAX(updated_date) >= CURRENT_TIMESTAMP "
+        "FROM stock_header WHERE sid = ?", (sid,)).fetchone()
+    version = f'{count}|{full_count}|{updated_date}'
+    if uses_taiex:
+        # 分開的子查詢，MAX才會用索引直接取最後一筆
+        try:
+            last_date, taiex_updated_date, taiex_fresh = conn.execute(
+                "SELECT last_date, updated_date, updated_date >= CURRENT_TIMESTAMP FROM "
+                "(SELECT (SELECT MAX(date) FROM TWII_daily_price) AS last_date, "
+                "(SELECT MAX(updated_date) FROM TWII_daily_price) AS updated_date)").fetchone()
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+            return None, False
+        version += f'|TWII|{last_date}|{taiex_updated_date}'
+        fresh = fresh or taiex_fresh
+    return version, bool(fresh)
+
+
+class ResultCache:
+    """
+    存在SQLite檔案的結果快取，每個thread各自一條連線
+    """
+
+    def __init__(self, db_file: str, max_entries: int = 100000, max_bytes: int = None):
+        """
+        :param max_entries: 最多幾筆結果
+        :param max_bytes: 結果(pickle後)的總大小上限，None代表不限制
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._manager = ConnectionManager(db_file)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        # 命中時的使用時間先記在記憶體，累積一批或寫入時再一起更新，讀取快取不用每次commit
+        self._touched = {}
+        conn = self._manager.connection()
+        conn.execute(RESULT_CACHE_TABLE_SQL)
+        conn.execute(RESULT_CACHE_INDEX_SQL)
+        conn.commit()
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key: str, version: str):
+        """
+        :return: (是否命中, 結果)，版本不同或已過期的結果刪除並算未命中
+        """
+        conn = self._manager.connection()
+        row = conn.execute("SELECT version, expires_date, value FROM result_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return False, None
+        if row[0] != version or (row[1] is not None and row[1] != date.today().isoformat()):
+            with conn:
+                conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+            self._count('expired')
+            self._count('misses')
+            return False, None
+        with self._lock:
+            self.hits += 1
+            self._touched[key] = time.time()
+            flush = len(self._touched) >= TOUCH_BATCH_SIZE
+        if flush:
+            with conn:
+                self._flush_touched(conn)
+        return True, pickle.loads(row[2])
+
+    def _flush_touched(self, conn):
+        # 把累積的使用時間寫回DB
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        conn.executemany("UPDATE result_cache SET last_used = ? WHERE key = ?",
+                         [(last_used, key) for key, last_used in touched.items()])
+
+    def put(self, key: str, sid: str, method: str, arguments: str, version: str, value, expires_date: date = None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._manager.connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO result_cache "
+                         "(key, sid, method, arguments, version, expires_date, value, size, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (key, sid, method, arguments, version, expires_date.isoformat() if expires_date else None,
+                          blob, len(blob), time.time()))
+            self._flush_touched(conn)
+            self._evict(conn)
+
+    def _evict(self, conn):
+        # 從最久沒用到的開始剔除，直到符合上限
+        count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache").fetchone()
+        if count <= self.max_entries and (self.max_bytes is None or total_size <= self.max_bytes):
+            return
+        n_remove = 0
+        for size, in conn.execute("SELECT size FROM result_cache ORDER BY last_used"):
+            if count - n_remove <= self.max_entries and (self.max_bytes is None or total_size <= self.max_bytes):
+                break
+            n_remove += 1
+            total_size -= size
+        conn.execute("DELETE FROM result_cache WHERE key IN "
+                     "(SELECT key FROM result_cache ORDER BY last_used LIMIT ?)", (n_remove,))
+        with self._lock:
+            self.evictions += n_remove
+
+    def invalidate(self, sid: str = None):
+        # 剔除某檔股票(None為全部)的結果
+        conn = self._manager.connection()
+        with conn:
+            if sid is None:
+                conn.execute("DELETE FROM result_cache")
+            else:
+                conn.execute("DELETE FROM result_cache WHERE sid = ?", (sid,))
+
+    def clear(self):
+        self.invalidate()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.expired = self.evictions = 0
+
+    def stats(self) -> dict:
+        conn = self._manager.connection()
+        count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache").fetchone()
+        with self._lock:
+            return {'entries': count, 'bytes': total_size, 'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions}
+
+    def close(self):
+        conn = self._manager.connection()
+        with conn:
+            self._flush_touched(conn)
+        self._manager.close()
+
+
+def enable(db_file: str = None, max_entries: int = 100000, max_bytes: int = None) -> ResultCache:
+    """
+    開啟快取
+    :param db_file: 快取檔案，預設為db_path/result_cache.db
+    """
+    global _cache
+    disable()
+    _cache = ResultCache(db_file or db_path + 'result_cache.db', max_entries, max_bytes)
+    return _cache
+
+
+def disable():
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+
+def get_cache() -> ResultCache:
+    # 沒有開啟時為None
+    return _cache
+
+
+def cached(method: str, uses_taiex=None, last_date=None):
+    """
+    快取MyStock方法結果的decorator，沒有開啟快取時直接呼叫
+    :param method: 方法名稱，與參數一起組成key
+    :param uses_taiex: 函式(參數dict) -> 結果是否用到大盤，用到時大盤更新也會讓結果作廢，None代表沒用到
+    :param last_date: 函式(參數dict) -> 結果用到的最後日期，今天或之後代表結果會隨今天改變，只在當天有效
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = _cache
+            if cache is None:
+                return func(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name: value for name, value in bound.arguments.items() if name not in IGNORED_ARGUMENTS}
+            arguments_text = repr(sorted((name, normalize_argument(value)) for name, value in arguments.items()))
+            key = hashlib.sha1(f'{method}|{self.sid}|{arguments_text}'.encode()).hexdigest()
+            with_taiex = uses_taiex is not None and uses_taiex(arguments)
+
+            version, _ = data_version(self.sid, with_taiex)
+            if version is not None:
+                hit, value = cache.get(key, version)
+                if hit:
+                    return value
+            value = func(self, *args, **kwargs)
+            # 計算時可能補抓了缺少的月份，用算完後的版本
+            version, fresh = data_version(self.sid, with_taiex)
+            if version is not None and not fresh:
+                today = date.today()
+                until = None if last_date is None else last_date(arguments).date()
+                # db_first的MyStock可能用了沒重抓的不完整當月資料，結果不給其他MyStock使用
+                if getattr(self, 'db_first', False) and until is not None and until >= today.replace(day=1):
+                    return value
+                expires_date = today if until is not None and until >= today else None
+                cache.put(key, self.sid, method, arguments_text, version, value, expires_date)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def cal_return_last_date(arguments: dict) -> datetime:
+    # 最後一個測試日期
+    return arguments['start_cal_return_date'] + timedelta(days=max(arguments['test_day_list'], default=0))
@@ -0,0 +1,276 @@
+"""
+向量化回測引擎，一次載入整段股價成numpy陣列，N日均價只算一次，
+各測試天數的日期用二分搜尋(searchsorted)找到實際有資料的交易日。
+"""
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, TYPE_CHECKING
+
+import numpy as np
+
+from create_downloaded_stock_price_db import to_date_int
+from get_TWII_price import get_TWII_close_array, get_TWII_close_batch
+from instrumentation import timed
+
+if TYPE_CHECKING:
+    # pandas只有cal_rolling_beta用到，執行時才import
+    import pandas as pd
+
+# day: 測試天數
+# test_date: 測試日期(開始日期 + day天)
+# price: 測試日期的N日均價，超過今天為None
+# real_date: 實際有資料的交易日
+# day_range: 實際交易日與起始交易日相差天數
+# metric: ROI或IRR
+# adj_metric: 用大盤校正後的metric，沒有校正為None
+HORIZON_RESULT = namedtuple('HorizonResult',
+                            ['day', 'test_date', 'price', 'real_date', 'day_range', 'metric', 'adj_metric'])
+# start_price: 起始日期的N日均價
+# real_start_date: 起始日期實際有資料的交易日
+# horizons: HORIZON_RESULT list，順序與test_day_list相同
+RETURN_RESULT = namedtuple('ReturnResult', ['start_price', 'real_start_date', 'horizons'])
+
+
+def rolling_sum(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    計算N日加總，res[i]為values[i-n+1:i+1]的加總，前n-1筆為nan。
+    由左往右逐項相加，結果與python sum(values[-n:])完全相同。
+    """
+    res = np.full(len(values), np.nan)
+    m = len(values) - n + 1
+    if m <= 0:
+        return res
+    acc = values[0:m].copy()
+    for k in range(1, n):
+        acc += values[k:k + m]
+    res[n - 1:] = acc
+    return res
+
+
+@timed('moving_average')
+def rolling_mean(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    N日均價(未四捨五入)，前n-1筆為nan
+    """
+    return rolling_sum(values, n) / n
+
+
+def to_day_key(target_date) -> int:
+    """
+    日期轉為整數日(datetime.toordinal)，比較與二分搜尋都用整數，比datetime64轉換快很多。
+    股價的日期都是當天0點，所以同一天帶時間的目標日期轉成同一個整數也不影響比較結果。
+    """
+    return target_date.toordinal()
+
+
+def asof_index(day_keys: np.ndarray, targets) -> np.ndarray:
+    """
+    找出每個目標日期當天或之前最近一個交易日的位置，沒有則為-1
+    :param day_keys: 排序好的交易日(to_day_key)
+    :param targets: 目標日期(datetime)
+    """
+    target_keys = np.fromiter((to_day_key(target) for target in targets), dtype=np.int64)
+    return np.searchsorted(day_keys, target_keys, side='right') - 1
+
+
+def to_price_arrays(data):
+    """
+    DATATUPLE2 list轉為(交易日陣列(to_day_key), 收盤價陣列)，沒有收盤價(當天無成交)為nan
+    """
+    day_keys = np.fromiter((tmp_data.date.toordinal() for tmp_data in data), dtype=np.int64, count=len(data))
+    close = np.array([np.nan if tmp_data.close is None else tmp_data.close for tmp_data in data], dtype=float)
+    return day_keys, close
+
+
+def cal_metric(end_price: float, start_price: float, day_range: int, evaluation_metric: str) -> float:
+    # 與MyStock.cal_return相同的算法
+    if evaluation_metric == 'IRR':
+        metric = ((end_price / start_price) ** (365 / day_range) - 1) * 100
+    elif evaluation_metric == 'ROI':
+        metric = ((end_price / start_price) - 1) * 100
+    else:
+        raise ValueError('evaluation_metric只能為"ROI"或"IRR"')
+    return round(metric, 2)
+
+
+def load_stock_range(stock, start_date: datetime, end_date: datetime, n_daily_average: int):
+    """
+    一次載入回測需要的股價。與get_target_date_n_daily_average_price相同，
+    先往前抓3倍N天，若起始日之前沒有資料，再每次多往前3倍N天，最多到60倍。
+    :return: (DATATUPLE2 list, 交易日陣列, 收盤價陣列, 起始日期位置)
+    """
+    n_day_plus = 3
+    while n_day_plus < 60:
+        pre_month = start_date - timedelta(days=n_daily_average * n_day_plus)
+        data = stock.fetch_from_to(pre_month.year, pre_month.month, end_date.year, end_date.month)
+        day_keys, close = to_price_arrays(data)
+        start_index = int(asof_index(day_keys, [start_date])[0])
+        if start_index >= 0:
+            return data, day_keys, close, start_index
+        n_day_plus += 3
+    raise ValueError(f'股票代碼{stock.sid}在{start_date}之前{60}天內無法抓取資料')
+
+
+def load_average_prices(stock, start_date: datetime, test_dates: List[datetime], n_daily_average: int):
+    """
+    載入整段股價，起始日與各測試日(都不晚於今天)當天或之前最近交易日的N日均價
+    :return: (N日均價list, 實際交易日list)，第一個為起始日
+    """
+    # 只需要載入到最後一個測試日為止
+    end_date = max(test_dates, default=start_date)
+    data, day_keys, close, start_index = load_stock_range(stock, start_date, end_date, n_daily_average)
+    # N日均價只算一次
+    average_price = rolling_mean(close, n_daily_average)
+    indexes = [start_index] + asof_index(day_keys, test_dates).tolist()
+    if np.isnan(average_price[indexes]).any():
+        raise ValueError(f'股票代碼{stock.sid}資料不足{n_daily_average}日，無法計算N日均價')
+    # 與moving_average相同，四捨五入到小數第二位
+    return [round(float(average_price[i]), 2) for i in indexes], [data[i].date for i in indexes]
+
+
+def load_indicator_prices(stock, start_date: datetime, test_dates: List[datetime], n_daily_average: int):
+    """
+    同load_average_prices，但由指標表每個日期一次索引查詢，結果相同
+    :return: (N日均價list, 實際交易日list)，不支援的N、無法補算指標(唯讀連線)或起始日前3倍N天內沒有資料時
+        回傳None，改用load_average_prices
+    """
+    # indicator_store會import本模組，在這裡才import避免循環import
+    import indicator_store
+    if not indicator_store.supports(n_daily_average):
+        return None
+    # 與load_stock_range相同，先線上抓取DB缺少的月份
+    pre_month = start_date - timedelta(days=n_daily_average * 3)
+    end_date = max(test_dates, default=start_date)
+    from_date_key, _ = stock._prepare_range(pre_month.year, pre_month.month, end_date.year, end_date.month)
+    res = indicator_store.average_price_asof(stock.sid, [start_date] + test_dates, n_daily_average)
+    if res is None or res[0][0] is None or to_date_int(res[0][0]) < from_date_key:
+        return None
+    if any(price is None for _, price in res):
+        raise ValueError(f'股票代碼{stock.sid}資料不足{n_daily_average}日，無法計算N日均價')
+    return [price for _, price in res], [real_date for real_date, _ in res]
+
+
+def cal_horizon_returns(stock, start_cal_return_date: datetime, n_daily_average: int, test_day_list: List[int],
+                        evaluation_metric='ROI', adjust_by_taiex=False) -> RETURN_RESULT:
+    """
+    一次算出所有測試天數的報酬，結果與MyStock.cal_return逐日計算相同
+    :param stock: MyStock
+    :param start_cal_return_date: 開始計算報酬的日期
+    :param n_daily_average: 使用幾日均價當作當天價格
+    :param test_day_list: 績效測試天數列表
+    :param evaluation_metric: ROI或IRR
+    :param adjust_by_taiex: 是否用大盤進行校正
+    :return: RETURN_RESULT
+    """
+    if evaluation_metric not in ('ROI', 'IRR'):
+        raise ValueError('evaluation_metric只能為"ROI"或"IRR"')
+    now = datetime.today()
+    test_dates = [start_cal_return_date + timedelta(days=i) for i in test_day_list]
+    valid_test_dates = [tmp_date for tmp_date in test_dates if tmp_date <= now]
+    # 5/20/60日均價直接查指標表，其他N日載入整段股價計算
+    res = load_indicator_prices(stock, start_cal_return_date, valid_test_dates, n_daily_average)
+    if res is None:
+        res = load_average_prices(stock, start_cal_return_date, valid_test_dates, n_daily_average)
+    prices, real_dates = res
+    start_price, real_start_date = prices[0], real_dates[0]
+
+    # 起始日與各測試日的大盤收盤價一次查詢
+    taiex_prices = [None] * len(prices)
+    if adjust_by_taiex:
+        taiex_prices = get_TWII_close_batch(real_dates).tolist()
+    taiex_start_price = taiex_prices[0]
+
+    horizons = []
+    valid_iter = iter(zip(prices[1:], real_dates[1:], taiex_prices[1:]))
+    for i, test_date in zip(test_day_list, test_dates):
+        if test_date > now:
+            horizons.append(HORIZON_RESULT(i, test_date, None, None, None, None, None))
+            continue
+        test_price, real_end_date, taiex_end_price = next(valid_iter)
+        day_range = (real_end_date - real_start_date).days
+        metric = cal_metric(test_price, start_price, day_range, evaluation_metric)
+        adj_metric = None
+        if adjust_by_taiex:
+            taiex_metric = cal_metric(taiex_end_price, taiex_start_price, day_range, evaluation_metric)
+            # 扣去大盤報酬率
+            adj_metric = round(metric - taiex_metric, 2)
+        horizons.append(HORIZON_RESULT(i, test_date, test_price, real_end_date, day_range, metric, adj_metric))
+    return RETURN_RESULT(start_price, real_start_date, horizons)
+
+
+def periodic_day_keys(start_date: datetime, end_date: datetime, interval: int, now: datetime) -> np.ndarray:
+    """
+    週期報酬的日期格點(to_day_key)，與原本cal_periodic_returns的while條件相同:
+    start_date + k * interval < end_date 且 start_date + (k + 1) * interval < now。
+    回傳K + 1個格點，第k期報酬為格點k到格點k + 1。
+    """
+    step = timedelta(days=interval)
+    n_before_end = math.ceil((end_date - start_date) / step)
+    n_before_now = math.ceil((now - start_date) / step) - 1
+    n_period = max(0, min(n_before_end, n_before_now))
+    return to_day_key(start_date) + interval * np.arange(n_period + 1, dtype=np.int64)
+
+
+def cal_roi_array(prices: np.ndarray) -> List[float]:
+    # 相鄰價格的ROI(%)，四捨五入到小數第二位，與cal_return相同用python round
+    return [round(metric, 2) for metric in ((prices[1:] / prices[:-1] - 1) * 100).tolist()]
+
+
+def cal_periodic_returns(stock, start_date: datetime, end_date: datetime, interval: int = 1):
+    """
+    向量化計算週期報酬，股價與大盤各只載入一次，結果與逐期呼叫cal_return、cal_taiex_return相同
+    :param stock: MyStock
+    :param start_date: 開始日期
+    :param end_date: 結束日期
+    :param interval: 計算間隔(天)
+    :return: (每期開始日期list, 股票報酬list, 大盤報酬list)
+    """
+    grid = periodic_day_keys(start_date, end_date, interval, datetime.today())
+    last_date = start_date + timedelta(days=interval * (len(grid) - 1))
+    # 1日均價往前最多找57天
+    data, day_keys, close, _ = load_stock_range(stock, start_date, last_date, 1)
+    stock_index = np.searchsorted(day_keys, grid, side='right') - 1
+    if (stock_index < 0).any():
+        raise ValueError(f'股票代碼{stock.sid}在{start_date}之前無法抓取資料')
+    # 1日均價，四捨五入到小數第二位
+    stock_price = np.array([round(price, 2) for price in close[stock_index].tolist()])
+
+    taiex_day_keys, taiex_close = get_TWII_close_array()
+    taiex_index = np.searchsorted(taiex_day_keys, grid, side='right') - 1
+    if (taiex_index < 0).any():
+        raise ValueError(f'{start_date}之前沒有大盤資料')
+    taiex_price = taiex_close[taiex_index]
+
+    period_dates = [start_date + timedelta(days=interval * k) for k in range(len(grid) - 1)]
+    return period_dates, cal_roi_array(stock_price), cal_roi_array(taiex_price)
+
+
+def cal_beta(stock, start_date: datetime, end_date: datetime, interval: int = 1) -> float:
+    """
+    計算beta值，算法與原本MyStock.cal_beta相同(共變異數ddof=1，變異數ddof=0)
+    """
+    _, stock_returns, taiex_returns = cal_periodic_returns(stock, start_date, end_date, interval)
+    return np.cov(stock_returns, taiex_returns)[0][1] / np.var(taiex_returns)
+
+
+def cal_rolling_beta(stock, start_date: datetime, end_date: datetime, interval: int = 1,
+                     window: int = 60) -> 'pd.DataFrame':
+    """
+    計算滾動beta、相關係數與alpha
+    beta = cov(股票報酬, 大盤報酬) / var(大盤報酬)，皆使用樣本(ddof=1)
+    alpha = 股票平均報酬 - beta * 大盤平均報酬(單位同報酬，%/期)
+    :param window: 滾動視窗期數，前window - 1期為nan
+    :return: index為每期開始日期，欄位stock_return, taiex_return, beta, correlation, alpha
+    """
+    import pandas as pd
+
+    period_dates, stock_returns, taiex_returns = cal_periodic_returns(stock, start_date, end_date, interval)
+    df = pd.DataFrame({'stock_return': stock_returns, 'taiex_return': taiex_returns},
+                      index=pd.DatetimeIndex(period_dates, name='date'), dtype=float)
+    stock_rolling = df['stock_return'].rolling(window)
+    taiex_rolling = df['taiex_return'].rolling(window)
+    df['beta'] = stock_rolling.cov(df['taiex_return']) / taiex_rolling.var()
+    df['correlation'] = stock_rolling.corr(df['taiex_return'])
+    df['alpha'] = stock_rolling.mean() - df['beta'] * taiex_rolling.mean()
+    return df
@@ -0,0 +1,215 @@
+"""
+全市場選股: 用DB內已下載的股價，一次計算twstock.codes內所有股票的多個回看期間漲跌幅、平均成交金額、
+對大盤(TWII)的beta與均線交叉，再依條件篩選、排序。
+全部股票的資料用一次SQL查詢載入(依主鍵(sid, 日期)排序)，接成一整段陣列向量化計算，不逐檔建立MyStock，
+約2000檔幾秒內完成。只使用DB內的資料，不會下載，需要最新資料請先用batch_downloader.download_stocks更新。
+
+使用方式
+from screener import screen
+df = screen(min_turnover=1e8, cross='golden', sort_by='return_60', top=30)
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List
+
+import numpy as np
+import pandas as pd
+from twstock.codes import codes
+
+from create_downloaded_stock_price_db import get_conn, to_date_int
+from get_TWII_price import get_TWII_close_array
+from instrumentation import timer
+from panel_backtest import SID_KEY_BASE, EPOCH_ORDINAL, round_list
+from price_series import date_ints_to_datetime64
+from return_engine import rolling_sum, to_day_key
+
+# 預設的選股範圍
+UNIVERSE_TYPES = ('股票', 'ETF')
+# 同MyStock.recent_fluctuation
+DEFAULT_DAYS_LIST = [5, 10, 30, 60, 120]
+# 回看期間的第一天可能沒開盤，多載入幾天讓asof找得到之前的交易日
+ASOF_BUFFER_DAYS = 14
+CROSS_VALUES = {'golden': 1, 'death': -1}
+
+# 依(sid, 日期)排序的整段股價，group為每筆所屬股票在sids的位置
+UniversePanel = namedtuple('UniversePanel', ['sids', 'group', 'day_key', 'close', 'turnover'])
+
+
+def universe_sids(types=UNIVERSE_TYPES) -> List[str]:
+    # twstock.codes內指定種類的代碼
+    return sorted(code for code, info in codes.items() if info.type in types)
+
+
+def load_universe(sids: List[str], from_date: datetime, to_date: datetime) -> UniversePanel:
+    """
+    一次查詢多檔股票一段期間的收盤價與成交金額，沒有收盤價(沒成交)的日子不載入
+    :return: UniversePanel，只包含DB內有資料的股票
+    """
+    placeholders = ', '.join('?' * len(sids))
+    with timer('screen_load') as t:
+        # sid IN與日期區間都在主鍵上，每檔股票只讀需要的一段
+        rows = get_conn().execute(
+            f"SELECT sid, date, close, turnover FROM stock_daily_price "
+            f"WHERE sid IN ({placeholders}) AND date BETWEEN ? AND ? AND close IS NOT NULL ORDER BY sid, date",
+            (*sids, to_date_int(from_date), to_date_int(to_date))).fetchall()
+        t.set_rows(rows)
+    if not rows:
+        return UniversePanel([], *(np.array([], dtype=dtype) for dtype in (np.int64, np.int64, float, float)))
+    sid_column, date_column, close_column, turnover_column = zip(*rows)
+    # 已依sid排序，sid改變的地方就是下一檔股票
+    sid_array = np.array(sid_column)
+    is_new = np.empty(len(sid_array), dtype=bool)
+    is_new[0] = True
+    is_new[1:] = sid_array[1:] != sid_array[:-1]
+    group = np.cumsum(is_new) - 1
+    panel_sids = sid_array[is_new]
+    day_key = date_ints_to_datetime64(date_column).astype('datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+    return UniversePanel(panel_sids.tolist(), group.astype(np.int64), day_key,
+                         np.array(close_column, dtype=float), np.array(turnover_column, dtype=float))
+
+
+def group_moving_average(values: np.ndarray, n: int, position: np.ndarray) -> np.ndarray:
+    # 整段一起算N日平均，每檔股票前n-1筆(視窗跨到前一檔)為nan
+    res = rolling_sum(values, n) / n
+    res[position < n - 1] = np.nan
+    return res
+
+
+def group_beta(group: np.ndarray, n_group: int, stock_returns: np.ndarray, taiex_returns: np.ndarray,
+               min_periods: int) -> np.ndarray:
+    """
+    每檔股票的beta = cov(股票報酬, 大盤報酬) / var(大盤報酬)，皆使用樣本(ddof=1)，同cal_rolling_beta
+    :param min_periods: 報酬筆數少於此數為nan
+    """
+    count = np.bincount(group, minlength=n_group).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stock_mean = np.bincount(group, stock_returns, n_group) / count
+        taiex_mean = np.bincount(group, taiex_returns, n_group) / count
+        stock_diff = stock_returns - stock_mean[group]
+        taiex_diff = taiex_returns - taiex_mean[group]
+        cov = np.bincount(group, stock_diff * taiex_diff, n_group) / (count - 1)
+        var = np.bincount(group, taiex_diff * taiex_diff, n_group) / (count - 1)
+        beta = cov / var
+    beta[count < min_periods] = np.nan
+    return beta
+
+
+def compute_screen(panel: UniversePanel, as_of: datetime, days_list: List[int] = None, turnover_days: int = 20,
+                   beta_days: int = 365, min_beta_periods: int = 20, ma_short: int = 5, ma_long: int = 20,
+                   max_stale_days: int = 14) -> pd.DataFrame:
+    """
+    計算每檔股票在as_of當天的選股指標，panel需載入到as_of為止
+    :param days_list: 漲跌幅的回看天數(日曆日)，算法同MyStock.recent_fluctuation
+    :param turnover_days: 平均成交金額的交易日數
+    :param beta_days: beta使用最近幾個日曆日的日報酬
+    :param ma_short: 短均線的交易日數
+    :param ma_long: 長均線的交易日數
+    :param max_stale_days: 最後交易日早於as_of超過此天數(下市、停牌或沒更新)的股票不列入
+    :return: 欄位sid, name, last_date, close, return_{n}, turnover_ma{n}, beta, ma{short}, ma{long}, ma_cross
+        (1: 黃金交叉，-1: 死亡交叉，0: 沒有交叉)
+    """
+    days_list = DEFAULT_DAYS_LIST if days_list is None else days_list
+    group, day_key, close = panel.group, panel.day_key, panel.close
+    n_group = len(panel.sids)
+    as_of_key = to_day_key(as_of)
+    with timer('screen_compute'):
+        index = np.arange(len(group))
+        # 每檔股票第一筆與最後一筆的位置
+        first = np.searchsorted(group, np.arange(n_group), side='left')
+        last = np.searchsorted(group, np.arange(n_group), side='right') - 1
+        position = index - first[group]
+        sid_positions = np.arange(n_group)
+        keys = group * SID_KEY_BASE + day_key
+
+        res = pd.DataFrame({'sid': panel.sids,
+                            'name': [codes[sid].name if sid in codes else '' for sid in panel.sids],
+                            'last_date': pd.to_datetime(day_key[last] - EPOCH_ORDINAL, unit='D'),
+                            'close': round_list(close[last])})
+        # 同moving_average(price, 1)，價格先四捨五入到小數第二位
+        today_price = res['close'].to_numpy()
+        for tmp_day in days_list:
+            past_index = np.searchsorted(keys, sid_positions * SID_KEY_BASE + as_of_key - tmp_day, side='right') - 1
+            valid = (past_index >= 0) & (group[np.maximum(past_index, 0)] == sid_positions)
+            past_price = np.array(round_list(np.where(valid, close[np.maximum(past_index, 0)], np.nan)))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                res[f'return_{tmp_day}'] = round_list((today_price / past_price - 1) * 100)
+
+        res[f'turnover_ma{turnover_days}'] = group_moving_average(panel.turnover, turnover_days, position)[last]
+
+        # 日報酬與同一段期間的大盤報酬，大盤用asof對應到股票的交易日
+        twii_day_keys, twii_close = get_TWII_close_array()
+        twii_index = np.searchsorted(twii_day_keys, day_key, side='right') - 1
+        twii_price = np.where(twii_index >= 0, twii_close[np.maximum(twii_index, 0)], np.nan)
+        in_window = (position >= 1) & (day_key > as_of_key - beta_days)
+        previous = index[in_window] - 1
+        stock_returns = close[in_window] / close[previous] - 1
+        taiex_returns = twii_price[in_window] / twii_price[previous] - 1
+        usable = ~np.isnan(taiex_returns)
+        res['beta'] = group_beta(group[in_window][usable], n_group, stock_returns[usable], taiex_returns[usable],
+                                 min_beta_periods)
+
+        # 均線同twstock的moving_average四捨五入到小數第二位，比較最後兩個交易日的長短均線位置
+        # 只有最後兩筆需要四捨五入
+        last_previous = np.maximum(last - 1, 0)
+        has_previous = position[last] >= 1
+        ma, previous_ma = {}, {}
+        for n in (ma_short, ma_long):
+            values = group_moving_average(close, n, position)
+            ma[n] = np.array(round_list(values[last]))
+            previous_ma[n] = np.array(round_list(np.where(has_previous, values[last_previous], np.nan)))
+        diff = ma[ma_short] - ma[ma_long]
+        previous_diff = previous_ma[ma_short] - previous_ma[ma_long]
+        res[f'ma{ma_short}'] = ma[ma_short]
+        res[f'ma{ma_long}'] = ma[ma_long]
+        res['ma_cross'] = np.select([(diff > 0) & (previous_diff <= 0), (diff < 0) & (previous_diff >= 0)],
+                                    [CROSS_VALUES['golden'], CROSS_VALUES['death']], 0)
+        res = res[day_key[last] >= as_of_key - max_stale_days].reset_index(drop=True)
+    return res
+
+
+def screen(sids: List[str] = None, as_of: datetime = None, days_list: List[int] = None, turnover_days: int = 20,
+           beta_days: int = 365, ma_short: int = 5, ma_long: int = 20, max_stale_days: int = 14,
+           min_turnover: float = None, min_beta: float = None, max_beta: float = None, cross: str = None,
+           sort_by: str = None, ascending: bool = False, top: int = None) -> pd.DataFrame:
+    """
+    全市場選股
+    :param sids: 選股範圍，預設為twstock.codes內的股票與ETF
+    :param as_of: 計算日期，預設為今天(同recent_fluctuation)
+    :param min_turnover: 平均成交金額下限
+    :param min_beta: beta下限
+    :param max_beta: beta上限
+    :param cross: 'golden'只留黃金交叉，'death'只留死亡交叉
+    :param sort_by: 排序欄位，例如'return_60'，有指定時加上rank欄位(1為第一名，nan排最後)
+    :param top: 只取排序後前幾名
+    :return: 欄位同compute_screen
+    """
+    if cross is not None and cross not in CROSS_VALUES:
+        raise ValueError(f'cross只能是{list(CROSS_VALUES)}')
+    sids = universe_sids() if sids is None else sids
+    as_of = datetime.today() if as_of is None else as_of
+    days_list = DEFAULT_DAYS_LIST if days_list is None else days_list
+    from_date = as_of - timedelta(days=max(max(days_list) + ASOF_BUFFER_DAYS, beta_days))
+    panel = load_universe(sids, from_date, as_of)
+    res = compute_screen(panel, as_of, days_list, turnover_days, beta_days, ma_short=ma_short, ma_long=ma_long,
+                         max_stale_days=max_stale_days)
+
+    mask = np.ones(len(res), dtype=bool)
+    if min_turnover is not None:
+        mask &= res[f'turnover_ma{turnover_days}'].to_numpy() >= min_turnover
+    if min_beta is not None:
+        mask &= res['beta'].to_numpy() >= min_beta
+    if max_beta is not None:
+        mask &= res['beta'].to_numpy() <= max_beta
+    if cross is not None:
+        mask &= res['ma_cross'].to_numpy() == CROSS_VALUES[cross]
+    res = res[mask]
+    if sort_by is not None:
+        res = res.sort_values(sort_by, ascending=ascending, na_position='last', kind='stable')
+        res['rank'] = np.arange(1, len(res) + 1)
+    if top is not None:
+        res = res.head(top)
+    return res.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    print(screen(sort_by='return_60', top=30).to_string())